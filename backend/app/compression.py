@@ -0,0 +1,234 @@
+# app/compression.py
+# İstek/yanıt sıkıştırma (ASGI middleware).
+# - Yanıt: Accept-Encoding'e göre br (brotli paketi kuruluysa; ilk br isteğinde
+#   import edilir) ya da gzip.
+#   Tek parça yanıtlar bütün olarak, akış yanıtları (NDJSON vb.) parça parça
+#   sync-flush ile sıkıştırılır; küçük ve zaten sıkıştırılmış içerik olduğu gibi geçer.
+# - İstek: Content-Encoding gzip / deflate / br gövdeler açılıp uygulamaya düz verilir
+#   (açılmış boyut COMPRESS_MAX_REQUEST_BYTES ile sınırlı; eksik / bozuk akış 400).
+from __future__ import annotations
+
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.settings import settings
+
+_SKIP_TYPES = ("image/", "video/", "audio/", "application/zip", "application/gzip",
+               "application/pdf", "application/octet-stream")
+
+
+class _TooLarge(Exception):
+    pass
+
+
+_brotli: list = []   # [modül ya da None]; ilk kullanımda doldurulur
+
+
+def _brotli_mod():
+    """brotli opsiyonel; soğuk başlatmada değil ilk br isteğinde import edilir."""
+    if not _brotli:
+        try:
+            import brotli  # type: ignore
+        except ImportError:
+            print("[compression] brotli kurulu değil, br devre dışı")
+            brotli = None
+        _brotli.append(brotli)
+    return _brotli[0]
+
+
+def _negotiate(accept: str) -> Optional[str]:
+    accepted = {}
+    for part in accept.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name] = q
+    if accepted.get("br", 0) > 0 and _brotli_mod() is not None:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def _decode_br(body: bytes, limit: int) -> bytes:
+    """
+    brotli.decompress tek seferde tamamını açar (sıkıştırma bombası); bunun
+    yerine Decompressor ile parça parça açılır, sınır aşılınca hemen kesilir.
+    brotli >= 1.2 çıktı tamponunu sınırlar; eski sürümlerde girdi küçük
+    parçalarla verilir ki tek çağrıdaki çıktı sınırlı kalsın.
+    """
+    d = _brotli_mod().Decompressor()
+    bounded = hasattr(d, "can_accept_more_data")
+    step = 64 * 1024 if bounded else 256
+    out = bytearray()
+    for i in range(0, len(body), step):
+        chunk = body[i:i + step]
+        while True:
+            if bounded:
+                out += d.process(chunk, output_buffer_limit=limit + 1 - len(out))
+            else:
+                out += d.process(chunk)
+            if len(out) > limit:
+                raise _TooLarge()
+            if not bounded or d.can_accept_more_data():
+                break
+            chunk = b""  # tampon doldu: kalan çıktıyı boş girdiyle çek
+    if not d.is_finished():
+        raise ValueError("br akışı eksik")
+    return bytes(out)
+
+
+def _decode(encoding: str, body: bytes, limit: int) -> bytes:
+    if encoding == "br":
+        if _brotli_mod() is None:
+            raise ValueError("br desteklenmiyor")
+        return _decode_br(body, limit)
+    # wbits=47: gzip ve zlib başlığını otomatik tanır
+    d = zlib.decompressobj(47)
+    out = d.decompress(body, limit + 1)
+    if len(out) > limit:
+        raise _TooLarge()
+    # kesik ya da arkasında fazladan bayt olan gövde kısmi veri olarak geçmesin
+    if not d.eof or d.unconsumed_tail or d.unused_data:
+        raise ValueError("gzip akışı eksik ya da bozuk")
+    return out
+
+
+class _Compressor:
+    def __init__(self, encoding: str) -> None:
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = _brotli_mod().Compressor(quality=settings.COMPRESS_BROTLI_QUALITY)
+        else:
+            self._c = zlib.compressobj(settings.COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._c.process(data) + self._c.flush()
+        return self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._c.process(data) + self._c.finish()
+        return self._c.compress(data) + self._c.flush()
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int | None = None, max_request_bytes: int | None = None) -> None:
+        self.app = app
+        self.minimum_size = settings.COMPRESS_MIN_BYTES if minimum_size is None else minimum_size
+        self.max_request_bytes = max_request_bytes or settings.COMPRESS_MAX_REQUEST_BYTES
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+
+        # --------- sıkıştırılmış istek gövdesi ----------
+        req_enc = headers.get("content-encoding", "").strip().lower()
+        if req_enc and req_enc != "identity":
+            if req_enc not in ("gzip", "deflate", "br"):
+                await PlainTextResponse("Desteklenmeyen Content-Encoding", status_code=415)(scope, receive, send)
+                return
+            body = bytearray()
+            more = True
+            while more:
+                msg = await receive()
+                body += msg.get("body", b"")
+                more = msg.get("more_body", False)
+            try:
+                raw = _decode(req_enc, bytes(body), self.max_request_bytes)
+            except _TooLarge:
+                await PlainTextResponse("İstek gövdesi çok büyük", status_code=413)(scope, receive, send)
+                return
+            except Exception:
+                await PlainTextResponse("Gövde açılamadı", status_code=400)(scope, receive, send)
+                return
+            scope = dict(scope)
+            scope["headers"] = [(k, v) for k, v in scope["headers"]
+                                if k not in (b"content-encoding", b"content-length")]
+            scope["headers"].append((b"content-length", str(len(raw)).encode()))
+            receive = _replay(raw, receive)
+
+        # --------- yanıt sıkıştırma ----------
+        encoding = _negotiate(headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _Responder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+def _replay(raw: bytes, receive: Receive) -> Receive:
+    sent = False
+
+    async def inner() -> Message:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": raw, "more_body": False}
+        return await receive()  # http.disconnect
+    return inner
+
+
+class _Responder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int) -> None:
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start: Optional[Message] = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        async def wrapped(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                self.start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            if self.passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+
+            if self.compressor is None:
+                assert self.start is not None
+                h = MutableHeaders(raw=list(self.start["headers"]))
+                ctype = h.get("content-type", "")
+                if ("content-encoding" in h or ctype.startswith(_SKIP_TYPES)
+                        or (not more and len(body) < self.minimum_size)):
+                    self.passthrough = True
+                    await send(self.start)
+                    await send(message)
+                    return
+                self.compressor = _Compressor(self.encoding)
+                h["Content-Encoding"] = self.encoding
+                h.add_vary_header("Accept-Encoding")
+                if not more:
+                    data = self.compressor.finish(body)
+                    h["Content-Length"] = str(len(data))
+                    await send({**self.start, "headers": h.raw})
+                    await send({"type": "http.response.body", "body": data, "more_body": False})
+                    return
+                if "content-length" in h:
+                    del h["Content-Length"]
+                await send({**self.start, "headers": h.raw})
+                await send({"type": "http.response.body", "body": self.compressor.chunk(body), "more_body": True})
+                return
+
+            data = self.compressor.chunk(body) if more else self.compressor.finish(body)
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, wrapped)
@@ -1,15 +1,65 @@
-from fastapi import Header, HTTPException
+import hmac
+from fastapi import Depends, Header, HTTPException, Request
+from app.settings import settings
 from app.store import store
 from app.models import Session
+from app.services import session_token
 
-async def get_session(x_session_id: str = Header(alias="X-Session-Id")) -> Session:
+async def get_session(
+    request: Request,
+    x_session_id: str | None = Header(default=None, alias="X-Session-Id"),
+    x_session_token: str | None = Header(default=None, alias="X-Session-Token"),
+) -> Session:
     """
     Frontend her isteğe X-Session-Id header'ı ile gelsin.
+    STATELESS_SESSIONS=1 iken son yanıttaki X-Session-Token gönderilirse oturum
+    token'dan çözülür (store araması yok); yanıtla birlikte yeni token döner.
     """
+    if settings.STATELESS_SESSIONS and x_session_token:
+        try:
+            sess = store.adopt(session_token.decode(x_session_token))
+        except session_token.TokenError as e:
+            print(f"[DEPS] Session token rejected: {e}")
+            raise HTTPException(status_code=401, detail=str(e))
+        request.state.session_id = sess.id
+        return sess
+    if not x_session_id:
+        raise HTTPException(status_code=422, detail="X-Session-Id header required")
     print(f"[DEPS] get_session called with: {x_session_id}")
     sess = store.get(x_session_id)
     if not sess:
         print(f"[DEPS] Session not found: {x_session_id}")
         raise HTTPException(status_code=404, detail="Session not found or expired")
     print(f"[DEPS] Session found: {x_session_id}")
-    return sess
\ No newline at end of file
+    request.state.session_id = sess.id
+    return sess
+async def require_admin(x_admin_token: str | None = Header(default=None, alias="X-Admin-Token")) -> None:
+    """
+    /debug gibi yönetim uçları için: ADMIN_TOKEN tanımlı değilse uçlar kapalıdır.
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+async def get_clinic(x_clinic_token: str | None = Header(default=None, alias="X-Clinic-Token")) -> str | None:
+    """
+    Opsiyonel klinik kimliği: header yoksa None, CLINIC_TOKENS'ta yoksa 401.
+    """
+    if not x_clinic_token:
+        return None
+    given = x_clinic_token.encode("utf-8")
+    for token, clinic in settings.CLINIC_TOKENS.items():
+        if hmac.compare_digest(given, token.encode("utf-8")):
+            return clinic
+    raise HTTPException(status_code=401, detail="Invalid clinic token")
+
+async def require_clinic(clinic: str | None = Depends(get_clinic)) -> str:
+    """
+    Toplu tahlil gibi klinik uçları için: CLINIC_TOKENS tanımlı değilse uçlar kapalıdır.
+    """
+    if not settings.CLINIC_TOKENS:
+        raise HTTPException(status_code=404, detail="Not found")
+    if clinic is None:
+        raise HTTPException(status_code=401, detail="Clinic token required")
+    return clinic
@@ -0,0 +1,163 @@
+# app/history.py
+# Oturum sohbet geçmişi için kompakt iç temsil.
+# Tur başına Pydantic modeli + datetime yerine sütun dizileri tutulur;
+# ChatTurn modelleri yalnızca API sınırında (sessions.get_session) üretilir.
+from __future__ import annotations
+
+import sys
+import time
+import zlib
+from array import array
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+
+from app.prompts import EXPERT_SIGNATURE
+from app.settings import settings
+
+if TYPE_CHECKING:
+    from app.models import ChatTurn
+
+# role -> küçük tamsayı (interned)
+ROLES = ("user", "assistant", "system")
+_ROLE_IDX = {r: i for i, r in enumerate(ROLES)}
+
+# Tekrar eden önekler: içerikten ayrılıp indeksle tutulur
+PREFIXES = (
+    "[INITIAL FORM]\n",
+    "[FOLLOW-UP ANSWERS]\n",
+)
+
+# flag bitleri
+_F_ZLIB = 1         # içerik zlib ile sıkıştırılmış (bytes)
+_F_SIGNATURE = 2    # sondaki uzman imza satırı ayrıldı
+
+# Son N tur sıcak kalır (prompt_chat_followup son 8 turu kullanır)
+HOT_TURNS = 8
+# Bundan küçük soğuk turlar sıkıştırılmaz (zlib başlığı kazancı yer)
+COMPRESS_MIN_BYTES = 512
+# Kısa sabit içerikler ("[LAB ANALYSIS REQUEST]" vb.) intern edilir
+INTERN_MAX_LEN = 64
+
+
+class CompactHistory:
+    """
+    Sütun tabanlı sohbet geçmişi:
+    - role: array('b') indeks
+    - ts: array('q') epoch saniye
+    - prefix: array('b') PREFIXES indeksi (-1 yok)
+    - flags: array('B') (_F_ZLIB, _F_SIGNATURE)
+    - content: list[str | bytes]
+
+    append() tek yazar varsayar (store oturum kilidi altında çağırır); okumalar
+    kilitsizdir: content en son eklenir, len(content) tüm sütunlar için güvenli sınırdır.
+    """
+
+    __slots__ = ("_role", "_ts", "_prefix", "_flags", "_content", "compress_cold")
+
+    def __init__(self, compress_cold: Optional[bool] = None) -> None:
+        self._role = array("b")
+        self._ts = array("q")
+        self._prefix = array("b")
+        self._flags = array("B")
+        self._content: List[str | bytes] = []
+        self.compress_cold = settings.HISTORY_COMPRESS_COLD if compress_cold is None else compress_cold
+
+    # --------- yazma ----------
+    def append(self, role: str, content: str, ts: Optional[int] = None) -> None:
+        prefix = -1
+        for i, p in enumerate(PREFIXES):
+            if content.startswith(p):
+                prefix = i
+                content = content[len(p):]
+                break
+
+        flags = 0
+        if role == "assistant" and content.endswith(EXPERT_SIGNATURE):
+            flags |= _F_SIGNATURE
+            content = content[:-len(EXPERT_SIGNATURE)]
+
+        if len(content) <= INTERN_MAX_LEN:
+            content = sys.intern(content)
+
+        self._role.append(_ROLE_IDX[role])
+        self._ts.append(int(time.time()) if ts is None else int(ts))
+        self._prefix.append(prefix)
+        self._flags.append(flags)
+        self._content.append(content)
+
+        if self.compress_cold:
+            self._compress(len(self._content) - HOT_TURNS - 1)
+
+    def _compress(self, idx: int) -> None:
+        if idx < 0 or self._flags[idx] & _F_ZLIB:
+            return
+        c = self._content[idx]
+        if isinstance(c, str) and len(c) >= COMPRESS_MIN_BYTES:
+            self._content[idx] = zlib.compress(c.encode("utf-8"), 6)
+            self._flags[idx] |= _F_ZLIB
+
+    # --------- okuma ----------
+    def __len__(self) -> int:
+        return len(self._content)
+
+    def role(self, idx: int) -> str:
+        return ROLES[self._role[idx]]
+
+    def content(self, idx: int) -> str:
+        c = self._content[idx]
+        flags = self._flags[idx]
+        # sıkıştırma tek bir liste ataması; bayrağa değil tipe bakmak kilitsiz okumayı güvenli kılar
+        text = zlib.decompress(c).decode("utf-8") if isinstance(c, bytes) else c
+        if flags & _F_SIGNATURE:
+            text = text + EXPERT_SIGNATURE  # type: ignore[operator]
+        p = self._prefix[idx]
+        return PREFIXES[p] + text if p >= 0 else text  # type: ignore[return-value]
+
+    def ts(self, idx: int) -> datetime:
+        return datetime.utcfromtimestamp(self._ts[idx])
+
+    def to_dicts(self, last: Optional[int] = None) -> List[Dict]:
+        """prompt/özet fonksiyonları için [{"role", "content", "ts"}] (isteğe bağlı son N tur)."""
+        n = len(self._content)
+        start = 0 if last is None else max(0, n - last)
+        return [
+            {"role": ROLES[self._role[i]], "content": self.content(i), "ts": self.ts(i)}
+            for i in range(start, n)
+        ]
+
+    def to_models(self) -> List["ChatTurn"]:
+        """API sınırı: ChatTurn modellerini yalnızca burada üret."""
+        from app.models import ChatTurn  # models -> history döngüsünü kır
+        return [ChatTurn(**d) for d in self.to_dicts()]
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.to_dicts())
+
+    # --------- snapshot ----------
+    def to_state(self) -> Dict:
+        """marshal edilebilir ham durum (sütunlar bytes olarak)."""
+        return {
+            "role": self._role.tobytes(),
+            "ts": self._ts.tobytes(),
+            "prefix": self._prefix.tobytes(),
+            "flags": self._flags.tobytes(),
+            "content": list(self._content),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "CompactHistory":
+        h = cls()
+        h._role.frombytes(state["role"])
+        h._ts.frombytes(state["ts"])
+        h._prefix.frombytes(state["prefix"])
+        h._flags.frombytes(state["flags"])
+        h._content = [sys.intern(c) if isinstance(c, str) and len(c) <= INTERN_MAX_LEN else c
+                      for c in state["content"]]
+        return h
+
+    def nbytes(self) -> int:
+        """Yaklaşık bellek kullanımı (içerik + sütunlar)."""
+        total = sum(len(c) for c in self._content)
+        for a in (self._role, self._ts, self._prefix, self._flags):
+            total += a.itemsize * len(a)
+        return total
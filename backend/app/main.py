@@ -2,14 +2,24 @@ from __future__ import annotations
 
 import asyncio
 import json
+import time
 from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from app.settings import settings
-from app.routers import sessions, assessment, labs, chat
+from app.compression import CompressionMiddleware
+from app.services.session_token import SessionTokenMiddleware, TOKEN_HEADER, MODE_HEADER
+from app.routers import sessions, assessment, labs, lab_batch, chat, debug, jobs
 from app.store import store
+from app.services.openai_service import latency, warm_up
+from app.services.summarizer import summaries
+from app.services.form_cache import form_cache
+from app.services.profiler import watchdog
+from app.services.jobs import jobs as async_jobs
+from app.services.lab_history import lab_history
+from app.services.usage import usage, QuotaExceeded
 
 app = FastAPI(title="Medvise Backend", version="0.1.0", docs_url="/docs")
 
@@ -29,8 +39,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[TOKEN_HEADER, MODE_HEADER],
 )
 
+# ==== Stateless oturum ====
+# STATELESS_SESSIONS=1: oturuma dokunan yanıtlara imzalı X-Session-Token eklenir
+app.add_middleware(SessionTokenMiddleware)
+
+# ==== Sıkıştırma ====
+# gzip/brotli yanıtlar + Content-Encoding'li istek gövdeleri (büyük lab payload'ları)
+app.add_middleware(CompressionMiddleware)
+
 # ==== Root & Health ====
 @app.get("/")
 def root():
@@ -40,6 +59,18 @@ def root():
 def health():
     return {"ok": True}
 
+@app.get("/metrics/store")
+def store_metrics():
+    return store.stats()
+
+@app.get("/metrics/llm")
+def llm_metrics():
+    return latency.snapshot()
+
+@app.get("/metrics/form-cache")
+def form_cache_metrics():
+    return {"enabled": form_cache.enabled, **form_cache.stats()}
+
 # ==== 422 hata günlüğü ====
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -56,18 +87,76 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     print("============================")
     return JSONResponse(status_code=422, content={"detail": exc.errors()})
 
+# ==== TPM kotası ====
+@app.exception_handler(QuotaExceeded)
+async def quota_exceeded_handler(request: Request, exc: QuotaExceeded):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "scope": exc.scope},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # ==== Routers ====
 app.include_router(sessions.router)
 app.include_router(assessment.router)
 app.include_router(labs.router)
+app.include_router(lab_batch.router)
 app.include_router(chat.router)
+app.include_router(jobs.router)
+app.include_router(debug.router)
 
 # ==== TTL temizlik döngüsü ====
 async def janitor():
+    last_snapshot = time.monotonic()
     while True:
         store.sweep()
+        lab_batch.jobs.sweep()
+        async_jobs.sweep()
+        summaries.sweep()
+        usage.sweep()
+        lab_history.sweep(store.has)
+        interval = settings.STORE_SNAPSHOT_INTERVAL
+        if interval > 0 and time.monotonic() - last_snapshot >= interval:
+            try:
+                await asyncio.to_thread(store.write_snapshot)
+            except Exception as e:
+                print("[janitor] snapshot failed:", e)
+            last_snapshot = time.monotonic()
+        # tahlil geçmişi yalnızca değiştiyse yazılır
+        try:
+            await asyncio.to_thread(lab_history.save)
+        except Exception as e:
+            print("[janitor] lab history save failed:", e)
         await asyncio.sleep(60)
 
 @app.on_event("startup")
 async def _startup():
-    asyncio.create_task(janitor())
+    # Önceki sürecin oturumları: yalnızca indeks okunur, oturumlar ilk erişimde açılır
+    store.clean_stale_blobs()
+    store.restore_snapshot()
+    lab_history.load()
+    app.state.background = [
+        asyncio.create_task(janitor()),
+        summaries.start(),
+    ]
+    # openai istemcisi / PDF motoru arka planda ısınır; ilk istekler beklemez
+    app.state.background.append(asyncio.create_task(asyncio.to_thread(warm_up)))
+    # Event loop gecikme bekçisi (LOOP_LAG_THRESHOLD_MS=0 ise kapalı)
+    lag_task = watchdog.start()
+    if lag_task is not None:
+        app.state.background.append(lag_task)
+
+@app.on_event("shutdown")
+async def _shutdown():
+    watchdog.stop()
+    async_jobs.shutdown()
+    try:
+        store.write_snapshot()
+    except Exception as e:
+        print("[shutdown] snapshot failed:", e)
+    # blob'lar (hasta verisi) snapshot'a kopyalandı; düz metin dosyalar diskte kalmasın
+    store.close_blobs()
+    try:
+        lab_history.save()
+    except Exception as e:
+        print("[shutdown] lab history save failed:", e)
@@ -1,10 +1,12 @@
 # app/models.py
 from __future__ import annotations
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Dict, Optional, Literal, Any
 from datetime import datetime
 from uuid import uuid4
 
+from app.history import CompactHistory
+
 Stage = Literal[
     "initial_assessment", "follow_up", "expert_evaluation",
     "lab_analysis", "lab_follow_up", "lab_final"
@@ -18,6 +20,8 @@ class LabValue(BaseModel):
     unit: Optional[str] = None
     normalRange: Optional[str] = None  # "12-15" biçimi
     status: Optional[Literal["normal", "high", "low"]] = None
+    # Numune tarihi ("2026-04-02" / "02.04.2026"); yoksa satır trend serisine girmez
+    date: Optional[str] = None
 
 # ——— Form (belirti) tarafı ———
 class InitialForm(BaseModel):
@@ -32,6 +36,8 @@ class InitialForm(BaseModel):
 class PatientData(BaseModel):
     # Temel
     name: Optional[str] = None
+    # Oturumlar arası kalıcı hasta referansı (klinik hasta no vb.); tahlil trendleri buna bağlanır
+    patientRef: Optional[str] = None
     age: Optional[int] = None
     gender: Optional[str] = None
     symptoms: Optional[str] = None
@@ -55,12 +61,20 @@ class ChatTurn(BaseModel):
     ts: datetime = Field(default_factory=datetime.utcnow)
 
 class Session(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     id: str = Field(default_factory=lambda: uuid4().hex)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     stage: Optional[Stage] = None
     patient: PatientData = Field(default_factory=PatientData)
-    history: List[ChatTurn] = Field(default_factory=list)
+    # Kompakt iç temsil; ChatTurn listesi yalnızca API sınırında üretilir
+    history: CompactHistory = Field(default_factory=CompactHistory)
     last_used_at: datetime = Field(default_factory=datetime.utcnow)
+    # upsert_patient'te artar; render edilmiş hasta bloğu cache anahtarı
+    profile_version: int = 0
+    # her mutasyonda (tur, profil, aşama) artar; stateless modda token ile yerel kopyadan
+    # hangisinin daha yeni olduğunu belirler
+    version: int = 0
 
 class CreateSessionResp(BaseModel):
     session_id: str
@@ -83,4 +97,31 @@ class SessionSnapshot(BaseModel):
     patient: PatientData
     history: List[ChatTurn]
     created_at: datetime
-    last_used_at: datetime
\ No newline at end of file
+    last_used_at: datetime
+# ——— Toplu tahlil analizi (klinik toplu aktarım) ———
+class LabBatchRequest(BaseModel):
+    # Her öğe /labs/analyze gövdesiyle aynı biçimde: {"patientData": {...}} ya da doğrudan alanlar.
+    # Opsiyonel "ref" alanı sonuçta aynen geri döner (klinik hasta numarası vb.)
+    items: List[Dict[str, Any]]
+    # online: sınırlı eşzamanlılıkla hemen işle; offline: upstream batch endpoint'ine gönder
+    mode: Literal["online", "offline"] = "online"
+
+class LabBatchStatus(BaseModel):
+    job_id: str
+    mode: Literal["online", "offline"]
+    status: Literal["running", "submitted", "completed", "failed"]
+    total: int
+    done: int
+    failed: int
+    created_at: datetime
+    error: Optional[str] = None
+
+# ——— Asenkron iş modu (?async=1) ———
+class JobStatus(BaseModel):
+    job_id: str
+    kind: str
+    status: Literal["queued", "running", "completed", "failed"]
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
@@ -1,4 +1,10 @@
 # app/prompts.py
+from __future__ import annotations
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List
 
 SYSTEM_GENERAL = (
     "Sen bir sağlık danışmanı yapay zekâsın. Tanı koymazsın; bilgilendirir ve "
@@ -9,22 +15,64 @@ SYSTEM_GENERAL = (
     "Mesajlarını ‘geçmiş olsun’ gibi kapanışlarla bitirme."
 )
 
+EXPERT_SIGNATURE = "Merak ettiğin bir şey var mı, başka nasıl yardımcı olabilirim?"
+
 # ---------------------------------------------------------------------
-# İlk değerlendirme — formdan (SORU MODU)
+# Sistem promptları — import anında BİR KEZ kurulur.
+# Ortak önek (SYSTEM_GENERAL) her zaman başta; böylece upstream
+# prompt-prefix cache'i aşamalar arasında isabet eder.
 # ---------------------------------------------------------------------
-def prompt_initial_from_form(form: dict) -> tuple[str, str]:
-    user = f"""
+_SYSTEM_EXPERT = SYSTEM_GENERAL + (
+    " Uzmansın; klinik ve aksiyon odaklı konuş. "
+    "Konuşma dilini hastaya hitaben konuşuyormuş gibi ayarla"
+    "Çıktın başlıksız ve madde işaretsiz, kısa bir paragraf olsun. "
+    "Artık anamnez sorusu sorma, yeni soru üretme. "
+    "Önceki soruları veya vaka özetini tekrar etme. "
+    "Kullanıcı bundan sonra ne sorarsa sadece doğrudan yanıt ver. "
+    "Konuşma bağlamını koru. "
+    "Son cümlende nazikçe alt satıra geçip: "
+    f"‘{EXPERT_SIGNATURE}’ diye sor."
+)
+
+SYSTEM_PROMPTS: Dict[str, str] = {
+    "general": SYSTEM_GENERAL,
+    "chat_expert": SYSTEM_GENERAL + (
+        " EXPERT MOD: Artık anamnez sorusu sorma, yeni soru üretme. "
+        "Önceki soruları veya vaka özetini tekrar etme. "
+        "Kullanıcı bundan sonra ne sorarsa sadece doğrudan yanıt ver. "
+        "Yanıtın kısa, net ve hastaya hitaben olsun. Konuşma bağlamını koru. "
+        f"Mesajın sonunda alt satıra geçip: ‘{EXPERT_SIGNATURE}’ diye sor."
+    ),
+    "chat_question": SYSTEM_GENERAL + (
+        " SORU MODU: Açıklama/yorum/öneri verme; tanısal çıkarım yapma. "
+        "Yalnızca eksik noktaları tamamlamak için 1–3 (maks 5) kısa, numaralı soru sor. "
+        "Acil değerlendirmesinde SADECE kanama veya zehirlenme red-flag sayılır. "
+        "Acil talimatı daha önce verdiysen tekrarlama; teyit isteme."
+    ),
+    "expert": _SYSTEM_EXPERT,
+    "case_condense": SYSTEM_GENERAL + (
+        " Vaka özetleyicisin; hastaya hitap etmezsin, yorum ve öneri eklemezsin. "
+        "Yalnızca verilen bilgiyi klinik açıdan önemli olanı koruyarak kısaltırsın."
+    ),
+}
+
+# ---------------------------------------------------------------------
+# Kullanıcı mesajı şablonları — str.format ile doldurulur.
+# Alan adları patient_block() çıktısıyla birebir aynıdır.
+# ---------------------------------------------------------------------
+USER_TEMPLATES: Dict[str, str] = {
+    "initial_from_form": """
 HASTA FORMU
-- İsim: {form.get('name') or '-'}
-- Yaş: {form.get('age') or '-'}
-- Cinsiyet: {form.get('gender') or '-'}
-- Ana şikayet/belirtiler: {form.get('symptoms') or '-'}
-- Süre: {form.get('duration') or '-'}
-- Ek notlar: {form.get('extra_notes') or '-'}
+- İsim: {name}
+- Yaş: {age}
+- Cinsiyet: {gender}
+- Ana şikayet/belirtiler: {symptoms}
+- Süre: {duration}
+- Ek notlar: {extra_notes}
 
 KURALLAR:
 - SELAM: Hasta formunda isim sağlanmamış/boş gibi ise isim kullanmadan giriş cümlesi kur.
-- SELAM: İsim sağlandıysa ilk cümlede yalnızca “Merhaba {form.get('name')}, geçmiş olsun.” diyerek giriş cümlesi kur.
+- SELAM: İsim sağlandıysa ilk cümlede yalnızca “Merhaba {name}, geçmiş olsun.” diyerek giriş cümlesi kur.
 - SORU MODU: Tanı tahmini, açıklama veya öneri YAPMA. Yalnızca eksik bilgiye yönelik 1–3 (maks 5) kısa, numaralı soru sor.
 - TUR SINIRI: En fazla 2 tur soru-cevap yap.
 - ACİL KARARI: Yalnızca ŞU İKİ durumda acil kabul et:
@@ -32,70 +80,13 @@ KURALLAR:
   * olası ZEHİRLENME (ilaç/kimyasal/madde alımı; duman/gaz maruziyeti).
 - ACİL ise: netçe belirt; 2–4 maddelik “şimdi yapman gerekenler” listesi + 112 yönlendirmesi ver. Ek soru sorma. “112 ile görüştün mü?” gibi teyit cümleleri KULLANMA.
 - BİTİRME: Bilgi uzman değerlendirmesi için YETERLİ ise veya ~2 tur soru-cevap olduysa, TEK SATIRDA yalnızca [GO_EXPERT] yaz.
-"""
-    return SYSTEM_GENERAL, user
-
-def prompt_chat_followup(user_msg: str, patient: dict, history: list[dict]) -> tuple[str, str]:
-    # --- Debug: gelen full history hakkında kısa log ---
-    print("[prompt_chat_followup] -- START --")
-    print("[prompt_chat_followup] total_turns:", len(history))
-
-    # son 8 turu prompta koyuyoruz (ayrıca loglayalım)
-    recent = history[-8:]
-    print("[prompt_chat_followup] recent_turns:", len(recent))
-    for i, t in enumerate(recent, 1):
-        role = t.get("role")
-        content = str(t.get("content") or "")
-
-        cleaned = content[:220].replace("\n", " ")
-        print(f"[prompt_chat_followup] recent[{i}] {role}: {cleaned}")
-        
-    convo = "\n".join([f"{t['role']}: {t['content']}" for t in recent])
-
-    # --- Heuristik: şimdiye kadar kaç "soru turu" yapıldı? ---
-    # Not: regex kullanmadan basit işaretlerle sayıyoruz.
-    # Bir turu saymak için: asistan mesajında numaralı soru kalıbından en az biri olsun.
-    # (örn. "1." ve "?" barındırması veya satır içi "\n2." / "\n3." geçmesi)
-    qa_rounds = 0
-    for t in history:
-        if t.get("role") == "assistant":
-            c = (t.get("content") or "")
-            if (("1." in c and "?" in c) or ("\n2." in c) or ("\n3." in c)):
-                qa_rounds += 1
-
-    # --- Expert mod kontrolü (sohbet uzman aşamasına geçtiyse) ---
-    # Sahnenin 'expert_evaluation' olmasından veya uzman imza cümlesinin geçmişte bulunmasından anlayalım
-    expert_signature = "Merak ettiğin bir şey var mı, başka nasıl yardımcı olabilirim?"
-    in_expert_mode = any(
-        ("expert_evaluation" in ((getattr(t, "stage", None) or t.get("stage") or ""))) or
-        (t.get("role") == "assistant" and expert_signature in (t.get("content") or ""))
-        for t in history
-    )
-
-    print("[prompt_chat_followup] qa_rounds:", qa_rounds, "in_expert_mode:", in_expert_mode)
-
-    name = (patient.get("name") or "").strip()
-    # Selam sadece ilk turda
-    selam = (f"Merhaba {name}, birkaç kısa sorum olacak."
-             if (name and qa_rounds == 0) else
-             ("Birkaç kısa sorum olacak." if qa_rounds == 0 else ""))
-
-    if in_expert_mode:
-        # Expert modu promptu: soru sorma, doğrudan yanıt
-        sys = (
-            SYSTEM_GENERAL +
-            " EXPERT MOD: Artık anamnez sorusu sorma, yeni soru üretme. "
-            "Önceki soruları veya vaka özetini tekrar etme. "
-            "Kullanıcı bundan sonra ne sorarsa sadece doğrudan yanıt ver. "
-            "Yanıtın kısa, net ve hastaya hitaben olsun. Konuşma bağlamını koru. "
-            "Mesajın sonunda alt satıra geçip: ‘Merak ettiğin bir şey var mı, başka nasıl yardımcı olabilirim?’ diye sor."
-        )
-        usr = f"""
+""",
+    "chat_expert": """
 HASTA ÖZETİ
-- Yaş/Cinsiyet: {patient.get('age')}/{patient.get('gender')}
-- Ana şikayet: {patient.get('symptoms')}
-- Önceki yanıtlar: {patient.get('previousAnswers')}
-- Ek: {patient.get('additionalInfo')}
+- Yaş/Cinsiyet: {age}/{gender}
+- Ana şikayet: {symptoms}
+- Önceki yanıtlar: {previous_answers}
+- Ek: {additional}
 
 SON KONUŞMA
 {convo}
@@ -106,27 +97,16 @@ KULLANICI MESAJI
 GÖREV:
 - Sorunun cevabını doğrudan ver; uzun açıklama ve tekrar yok.
 - Kısa, anlaşılır, tek-paragraf yanıt ver.
-- Son cümlede alt satıra geçip: ‘Merak ettiğin bir şey var mı, başka nasıl yardımcı olabilirim?’ yaz.
-"""
-        return sys, usr
-
-    # SORU MODU (yalnızca tur sayısına göre karar ver)
-    sys = (
-        SYSTEM_GENERAL +
-        " SORU MODU: Açıklama/yorum/öneri verme; tanısal çıkarım yapma. "
-        "Yalnızca eksik noktaları tamamlamak için 1–3 (maks 5) kısa, numaralı soru sor. "
-        "Acil değerlendirmesinde SADECE kanama veya zehirlenme red-flag sayılır. "
-        "Acil talimatı daha önce verdiysen tekrarlama; teyit isteme."
-    )
-
-    usr = f"""
+- Son cümlede alt satıra geçip: ‘{signature}’ yaz.
+""",
+    "chat_question": """
 HASTA ÖZETİ
-- İsim: {patient.get('name') or '-'}
-- Yaş/Cinsiyet: {patient.get('age')}/{patient.get('gender')}
-- Şikayet: {patient.get('symptoms')}
-- Süre: {patient.get('duration')}
-- Notlar: {patient.get('extra_notes')}
-- Ek: {patient.get('additionalInfo')}
+- İsim: {name}
+- Yaş/Cinsiyet: {age}/{gender}
+- Şikayet: {symptoms}
+- Süre: {duration}
+- Notlar: {extra_notes}
+- Ek: {additional}
 
 ŞU ANA KADAR SORU–CEVAP TURU: {qa_rounds}
 
@@ -140,59 +120,33 @@ GÖREV — KESİN KURAL:
 1) Eğer (ŞU ANA KADAR TUR SAYISI ≥ 4) ise: başka metin ekleme, TEK SATIRDA SADECE [GO_EXPERT] yaz.
 2) Red-flag (kanama/zehirlenme) varsa: acil uyarısı + 2–4 adımlık talimat + 112 (teyit isteme, soru sorma).
 3) Aksi halde:
-   {(selam + " ") if selam else ""}“Size daha iyi yardımcı olabilmem için lütfen aşağıdaki soruları cevaplayın.” diye tek cümlelik giriş yaz;
+   {selam}“Size daha iyi yardımcı olabilmem için lütfen aşağıdaki soruları cevaplayın.” diye tek cümlelik giriş yaz;
    ardından birbirinden farklı 1–3 numaralı hedefli soru üret; açıklama/öneri yazma.
-"""
-    return sys, usr
-# ---------------------------------------------------------------------
-# Geri uyumluluk — SORU MODU korunur (tur sınırı eklendi)
-# ---------------------------------------------------------------------
-def prompt_initial_assessment(patient: dict) -> tuple[str, str]:
-    user = f"""
+""",
+    "initial_assessment": """
 HASTA BİLGİLERİ
-- İsim: {patient.get('name') or '-'}
-- Yaş: {patient.get('age') or '-'}
-- Cinsiyet: {patient.get('gender') or '-'}
-- Ana şikayet/belirtiler: {patient.get('symptoms') or '-'}
+- İsim: {name}
+- Yaş: {age}
+- Cinsiyet: {gender}
+- Ana şikayet/belirtiler: {symptoms}
 
 Görev:
 - Yalnızca KANAMA veya ZEHİRLENME varsa acil uyarısı + 2–4 adımlık talimat + 112 (teyit isteme).
 - Red-flag yoksa: eksiklere 1–3 kısa soru (maks 5); açıklama/öneri yok.
 - Toplam soru-cevap turu 2'yi aşma.
 - Yeterliyse tek satırda [GO_EXPERT].
-"""
-    return SYSTEM_GENERAL, user
-
-def prompt_follow_up(patient: dict) -> tuple[str, str]:
-    name = (patient.get("name") or "").strip()
-    selam = f"Merhaba {name}, birkaç kısa sorum olacak." if name else "Birkaç kısa sorum olacak."
-    user = f"""
-ÖNCEKİ CEVAPLAR: {patient.get('previousAnswers') or '—'}
-MEVCUT ŞİKAYET/ÖYKÜ: {patient.get('symptoms') or '—'}
+""",
+    "follow_up": """
+ÖNCEKİ CEVAPLAR: {previous_answers}
+MEVCUT ŞİKAYET/ÖYKÜ: {symptoms}
 
 Görev:
 - Acil (kanama/zehirlenme) talimatı daha önce verildiyse tekrarlama; teyit isteme; yeni soru sorma.
 - Red-flag yoksa: {selam} Sonrasında 1–3 hedefli soru; açıklama/öneri yazma.
 - Toplam soru-cevap turu 2'yi aşma.
 - Yeterliyse SADECE [GO_EXPERT].
-"""
-    return SYSTEM_GENERAL, user
-# ---------------------------------------------------------------------
-# Uzman değerlendirme — paragraf üslubu, sonda nazik soru
-# ---------------------------------------------------------------------
-def prompt_expert_from_summary(summary: str) -> tuple[str, str]:
-    sys = SYSTEM_GENERAL + (
-        " Uzmansın; klinik ve aksiyon odaklı konuş. "
-        "Konuşma dilini hastaya hitaben konuşuyormuş gibi ayarla"
-        "Çıktın başlıksız ve madde işaretsiz, kısa bir paragraf olsun. "
-        "Artık anamnez sorusu sorma, yeni soru üretme. "
-        "Önceki soruları veya vaka özetini tekrar etme. "
-        "Kullanıcı bundan sonra ne sorarsa sadece doğrudan yanıt ver. "
-        "Konuşma bağlamını koru. "
-        "Son cümlende nazikçe alt satıra geçip: "
-        "‘Merak ettiğin bir şey var mı, başka nasıl yardımcı olabilirim?’ diye sor."
-    )
-    usr = f"""
+""",
+    "expert_from_summary": """
 Aşağıdaki vaka özetini değerlendir ve tek-paragraf halinde, uygulanabilir, kısa bir klinik yorum yaz.
 
 VAKA ÖZETİ
@@ -201,42 +155,31 @@ VAKA ÖZETİ
 İçerik: en olası neden(ler) + kısa gerekçe; ne zaman başvurmalı (bugün/48–72s/elektif);
 evde yapılabilecekler/kaçınılacaklar; gerekli test/bölüm; hangi durumda tekrar başvurmalı.
 Liste ve başlık kullanma.
-"""
-    return sys, usr
+""",
+    "case_condense": """
+Aşağıdaki vaka özetini en fazla 6 kısa satıra indir.
+Yaş/cinsiyet, ana şikayet, süre, önemli bulgular ve hastanın verdiği yanıtlar korunsun;
+tekrarları at, yeni bilgi ekleme.
 
-def prompt_expert(patient: dict) -> tuple[str, str]:
-    sys = SYSTEM_GENERAL + (
-        " Uzmansın; klinik ve aksiyon odaklı konuş. "
-        "Konuşma dilini hastaya hitaben konuşuyormuş gibi ayarla"
-        "Çıktın başlıksız ve madde işaretsiz, kısa bir paragraf olsun. "
-        "Artık anamnez sorusu sorma, yeni soru üretme. "
-        "Önceki soruları veya vaka özetini tekrar etme. "
-        "Kullanıcı bundan sonra ne sorarsa sadece doğrudan yanıt ver. "
-        "Konuşma bağlamını koru. "
-        "Son cümlende nazikçe alt satıra geçip: "
-        "‘Merak ettiğin bir şey var mı, başka nasıl yardımcı olabilirim?’ diye sor."
-    )
-    usr = f"""
+VAKA ÖZETİ
+{summary}
+""",
+    "expert": """
 HASTA DOSYASI
-- Yaş/Cinsiyet: {patient.get('age')}/{patient.get('gender')}
-- Ana şikayet: {patient.get('symptoms')}
-- Önceki yanıtlar: {patient.get('previousAnswers')}
+- Yaş/Cinsiyet: {age}/{gender}
+- Ana şikayet: {symptoms}
+- Önceki yanıtlar: {previous_answers}
 
 Tek-paragraf kısa bir değerlendirme yaz:
 olası neden(ler) + kısa gerekçe; ne zaman başvurmalı; evde yapılabilecekler/kaçınılacaklar;
 gerekli test/bölüm; takip tetikleyicileri.
-"""
-    return sys, usr
-
-# ---------------------------------------------------------------------
-# Tahlil akışı — AYNEN BIRAKILDI
-# ---------------------------------------------------------------------
-def prompt_lab_analysis(patient: dict) -> tuple[str, str]:
-    user = f"""
+""",
+    "lab_analysis": """
 TAHLİL BİLGİLERİ
-- Yaş/Cinsiyet: {patient.get('age')}/{patient.get('gender')}
-- Sonuçlar: {patient.get('labResults')}
-- Ek metin: {(patient.get('additionalInfo') or {}).get('extractedText', '—')}
+- Yaş/Cinsiyet: {age}/{gender}
+- Sonuçlar: {labs}
+- Önceki sonuçlara göre trend: {trends}
+- Ek metin: {extracted_text}
 
 ÖNEMLİ KURALLAR:
 - SADECE verilen tahlil sonuçlarına göre analiz yap
@@ -252,27 +195,22 @@ TAHLİL BİLGİLERİ
 4. Hangi durumda doktora başvurulmalı
 
 Kısa, net ve uygulanabilir öneriler ver. Başlık kullanma, liste yapma.
-"""
-    return SYSTEM_GENERAL, user
-
-def prompt_lab_follow_up(patient: dict) -> tuple[str, str]:
-    user = f"""
+""",
+    "lab_follow_up": """
 LAB ÖZETİ
-- Sonuçlar: {patient.get('labResults')}
-- Ek bilgiler/cevaplar: {patient.get('additionalInfo')}
+- Sonuçlar: {labs}
+- Ek bilgiler/cevaplar: {additional}
 
 Görev:
 - Kısa açıklama + 2–4 hedefli ek soru çıkar (sadece gerekiyorsa).
 - Tekrar yok, numaralı ve kısa.
-"""
-    return SYSTEM_GENERAL, user
-
-def prompt_lab_final(patient: dict) -> tuple[str, str]:
-    user = f"""
+""",
+    "lab_final": """
 HASTA PROFİLİ
-- Yaş/Cinsiyet: {patient.get('age')}/{patient.get('gender')}
-- Lab sonuçları: {patient.get('labResults')}
-- Ek/cevaplar: {patient.get('additionalInfo')}
+- Yaş/Cinsiyet: {age}/{gender}
+- Lab sonuçları: {labs}
+- Önceki sonuçlara göre trend: {trends}
+- Ek/cevaplar: {additional}
 
 Çıktı:
 - Sonuç özeti (kritik/dikkat/normal)
@@ -280,5 +218,197 @@ HASTA PROFİLİ
 - Kısa öneriler (evde, kaçınılacaklar, gerekirse test/bölüm)
 - Takip planı (ne zaman tekrar bakılmalı)
 Elde olmayan alanlar için '—' kullan; gereksiz tekrar ve başlık yok.
-"""
-    return SYSTEM_GENERAL, user
\ No newline at end of file
+""",
+}
+
+# ---------------------------------------------------------------------
+# Hasta bloğu — store'daki profil sürümü (store.get_profile anahtarı) başına
+# bir kez render edilir; upsert_patient sürümü artırır. Anahtarsız çağrılar
+# (istek gövdesinden gelen profiller) cache'lenmez.
+# ---------------------------------------------------------------------
+_BLOCK_CACHE_MAX = 512
+_block_cache: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+_block_lock = threading.Lock()
+
+
+def _dash(v: Any) -> str:
+    return "-" if v is None or v == "" else str(v)
+
+
+def _num(v: Any) -> str:
+    """Değer olduğu gibi: ':g' 6 basamağa yuvarlar (1234567 -> 1.23457e+06), model yanlış sayı görür."""
+    if isinstance(v, float):
+        return str(int(v)) if v.is_integer() and abs(v) < 1e15 else repr(v)
+    return str(v)
+
+
+def _compact(v: Any) -> str:
+    return json.dumps(v, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def render_lab_rows(rows: List[Dict[str, Any]] | None) -> str:
+    """Lab satırlarını tek satırlık kompakt biçime çevirir: `Ad=değer birim [aralık] durum; ...`"""
+    if not rows:
+        return "-"
+    parts: List[str] = []
+    for r in rows:
+        if not isinstance(r, dict):
+            r = r.model_dump() if hasattr(r, "model_dump") else {"name": str(r)}
+        s = f"{r.get('name') or '?'}={_num(r.get('value'))}"
+        if r.get("unit"):
+            s += f" {r['unit']}"
+        if r.get("normalRange"):
+            s += f" [{r['normalRange']}]"
+        if r.get("status"):
+            s += f" {r['status']}"
+        parts.append(s)
+    return "; ".join(parts)
+
+
+def _render_additional(info: Dict[str, Any] | None) -> str:
+    if not info:
+        return "-"
+    # PDF metni hem extracted_text hem extractedText olarak tutulabiliyor; tek kopya yeter
+    if "extractedText" in info and "extracted_text" in info:
+        info = {k: v for k, v in info.items() if k != "extracted_text"}
+    return _compact(info)
+
+
+def _render_patient_block(patient: Dict[str, Any]) -> Dict[str, str]:
+    info = patient.get("additionalInfo") or {}
+    prev = patient.get("previousAnswers")
+    return {
+        "name": _dash(patient.get("name")),
+        "age": _dash(patient.get("age")),
+        "gender": _dash(patient.get("gender")),
+        "symptoms": _dash(patient.get("symptoms")),
+        "duration": _dash(patient.get("duration")),
+        "extra_notes": _dash(patient.get("extra_notes")),
+        "previous_answers": "; ".join(str(x) for x in prev) if prev else "-",
+        "labs": render_lab_rows(patient.get("labResults")),
+        "additional": _render_additional(info if isinstance(info, dict) else None),
+        "extracted_text": (info.get("extractedText") if isinstance(info, dict) else None) or "—",
+    }
+
+
+def patient_block(patient: Dict[str, Any], key: str | None = None) -> Dict[str, str]:
+    """Hasta profilinin render edilmiş alanları (key = profil sürümü verilirse cache'li)."""
+    if key is None:
+        return _render_patient_block(patient)
+    with _block_lock:
+        blk = _block_cache.get(key)
+        if blk is not None:
+            _block_cache.move_to_end(key)
+            return blk
+    blk = _render_patient_block(patient)
+    with _block_lock:
+        _block_cache[key] = blk
+        while len(_block_cache) > _BLOCK_CACHE_MAX:
+            _block_cache.popitem(last=False)
+    return blk
+
+
+def render(template: str, patient: Dict[str, Any] | None = None,
+           profile_key: str | None = None, **extra: Any) -> str:
+    """Kayıtlı kullanıcı şablonunu hasta bloğu + ek alanlarla doldurur."""
+    fields: Dict[str, Any] = dict(patient_block(patient, profile_key)) if patient is not None else {}
+    fields.update(extra)
+    return USER_TEMPLATES[template].format(**fields)
+
+
+# ---------------------------------------------------------------------
+# İlk değerlendirme — formdan (SORU MODU)
+# ---------------------------------------------------------------------
+def prompt_initial_from_form(form: dict) -> tuple[str, str]:
+    return SYSTEM_GENERAL, render("initial_from_form", form)
+
+def prompt_chat_followup(user_msg: str, patient: dict, history: list[dict],
+                         profile_key: str | None = None) -> tuple[str, str]:
+    # --- Debug: gelen full history hakkında kısa log ---
+    print("[prompt_chat_followup] -- START --")
+    print("[prompt_chat_followup] total_turns:", len(history))
+
+    # son 8 turu prompta koyuyoruz (ayrıca loglayalım)
+    recent = history[-8:]
+    print("[prompt_chat_followup] recent_turns:", len(recent))
+    for i, t in enumerate(recent, 1):
+        role = t.get("role")
+        content = str(t.get("content") or "")
+
+        cleaned = content[:220].replace("\n", " ")
+        print(f"[prompt_chat_followup] recent[{i}] {role}: {cleaned}")
+
+    convo = "\n".join([f"{t['role']}: {t['content']}" for t in recent])
+
+    # --- Heuristik: şimdiye kadar kaç "soru turu" yapıldı? ---
+    # Not: regex kullanmadan basit işaretlerle sayıyoruz.
+    # Bir turu saymak için: asistan mesajında numaralı soru kalıbından en az biri olsun.
+    # (örn. "1." ve "?" barındırması veya satır içi "\n2." / "\n3." geçmesi)
+    qa_rounds = 0
+    for t in history:
+        if t.get("role") == "assistant":
+            c = (t.get("content") or "")
+            if (("1." in c and "?" in c) or ("\n2." in c) or ("\n3." in c)):
+                qa_rounds += 1
+
+    # --- Expert mod kontrolü (sohbet uzman aşamasına geçtiyse) ---
+    # Sahnenin 'expert_evaluation' olmasından veya uzman imza cümlesinin geçmişte bulunmasından anlayalım
+    in_expert_mode = any(
+        ("expert_evaluation" in ((getattr(t, "stage", None) or t.get("stage") or ""))) or
+        (t.get("role") == "assistant" and EXPERT_SIGNATURE in (t.get("content") or ""))
+        for t in history
+    )
+
+    print("[prompt_chat_followup] qa_rounds:", qa_rounds, "in_expert_mode:", in_expert_mode)
+
+    name = (patient.get("name") or "").strip()
+    # Selam sadece ilk turda
+    selam = (f"Merhaba {name}, birkaç kısa sorum olacak."
+             if (name and qa_rounds == 0) else
+             ("Birkaç kısa sorum olacak." if qa_rounds == 0 else ""))
+
+    if in_expert_mode:
+        # Expert modu promptu: soru sorma, doğrudan yanıt
+        usr = render("chat_expert", patient, profile_key, convo=convo, user_msg=user_msg, signature=EXPERT_SIGNATURE)
+        return SYSTEM_PROMPTS["chat_expert"], usr
+
+    # SORU MODU (yalnızca tur sayısına göre karar ver)
+    usr = render(
+        "chat_question", patient, profile_key,
+        qa_rounds=qa_rounds, convo=convo, user_msg=user_msg,
+        selam=(selam + " ") if selam else "",
+    )
+    return SYSTEM_PROMPTS["chat_question"], usr
+# ---------------------------------------------------------------------
+# Geri uyumluluk — SORU MODU korunur (tur sınırı eklendi)
+# ---------------------------------------------------------------------
+def prompt_initial_assessment(patient: dict) -> tuple[str, str]:
+    return SYSTEM_GENERAL, render("initial_assessment", patient)
+
+def prompt_follow_up(patient: dict) -> tuple[str, str]:
+    name = (patient.get("name") or "").strip()
+    selam = f"Merhaba {name}, birkaç kısa sorum olacak." if name else "Birkaç kısa sorum olacak."
+    return SYSTEM_GENERAL, render("follow_up", patient, selam=selam)
+# ---------------------------------------------------------------------
+# Uzman değerlendirme — paragraf üslubu, sonda nazik soru
+# ---------------------------------------------------------------------
+def prompt_expert_from_summary(summary: str) -> tuple[str, str]:
+    return SYSTEM_PROMPTS["expert"], render("expert_from_summary", summary=summary)
+
+def prompt_case_condense(summary: str) -> tuple[str, str]:
+    return SYSTEM_PROMPTS["case_condense"], render("case_condense", summary=summary)
+
+def prompt_expert(patient: dict) -> tuple[str, str]:
+    return SYSTEM_PROMPTS["expert"], render("expert", patient)
+
+# ---------------------------------------------------------------------
+# Tahlil akışı — hasta bloğu üç aşama arasında paylaşılır
+# ---------------------------------------------------------------------
+def prompt_lab_analysis(patient: dict, trends: str = "—") -> tuple[str, str]:
+    return SYSTEM_GENERAL, render("lab_analysis", patient, trends=trends)
+
+def prompt_lab_follow_up(patient: dict) -> tuple[str, str]:
+    return SYSTEM_GENERAL, render("lab_follow_up", patient)
+
+def prompt_lab_final(patient: dict, trends: str = "—") -> tuple[str, str]:
+    return SYSTEM_GENERAL, render("lab_final", patient, trends=trends)
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, Body
+from fastapi import APIRouter, Depends, Body, Header, Query
 from app.deps import get_session
 from app.models import CompleteRequest, InitialForm
 from app.prompts import (
     prompt_initial_from_form, prompt_follow_up, prompt_expert, prompt_expert_from_summary
 )
 from app.services.openai_service import complete
+from app.services.form_cache import form_cache
+from app.routers.jobs import submit_job
 from app.store import store
 import json
 
@@ -53,15 +55,20 @@ def initial_any(body: dict = Body(...), sess=Depends(get_session)):
         }
     })
 
-    # Formu direkt LLM'e gönder
-    system, user = prompt_initial_from_form(form_dict)
-    out = complete(system, user)
+    # Benzer bir form daha önce görüldüyse soru setini önbellekten ver
+    out = form_cache.lookup(form_dict) if form_cache.enabled else None
+    if out is None:
+        # Formu direkt LLM'e gönder
+        system, user = prompt_initial_from_form(form_dict)
+        out = complete(system, user, stage="initial_assessment", session_id=sess.id)
+        if form_cache.enabled and "[GO_EXPERT]" not in out:
+            form_cache.add(form_dict, out)
 
     # Eğer model soru sormadan eksperte geçmek istiyorsa: [GO_EXPERT] yakala
     if "[GO_EXPERT]" in out:
         # form verisiyle uzman değerlendirmesi
         sys2, usr2 = prompt_expert(form_dict)
-        expert = complete(sys2, usr2, temperature=0.1)
+        expert = complete(sys2, usr2, temperature=0.1, stage="expert_evaluation", session_id=sess.id)
 
         # geçmiş
         store.add_turn(sess.id, "user", f"[INITIAL FORM]\n{json.dumps(form_dict, ensure_ascii=False)}")
@@ -79,18 +86,30 @@ def initial_any(body: dict = Body(...), sess=Depends(get_session)):
 def follow_up(req: CompleteRequest, sess=Depends(get_session)):
     store.upsert_patient(sess.id, req.patientData.model_dump(exclude_none=True))
     system, user = prompt_follow_up(req.patientData.model_dump(exclude_none=True))
-    out = complete(system, user)
+    out = complete(system, user, stage="follow_up", session_id=sess.id)
     store.add_turn(sess.id, "user", f"[FOLLOW-UP ANSWERS]\n{req.patientData.previousAnswers or ''}")
     store.add_turn(sess.id, "assistant", out)
     store.set_stage(sess.id, "follow_up")
     return {"content": out}
 
+def _run_expert(sess_id: str, patient: dict) -> dict:
+    store.upsert_patient(sess_id, patient)
+    system, user = prompt_expert(patient)
+    out = complete(system, user, temperature=0.1, stage="expert_evaluation", session_id=sess_id)
+    store.add_turn(sess_id, "user", "[REQUEST EXPERT EVALUATION]")
+    store.add_turn(sess_id, "assistant", out)
+    store.set_stage(sess_id, "expert_evaluation")
+    return {"content": out}
+
 @router.post("/expert")
-def expert(req: CompleteRequest, sess=Depends(get_session)):
-    store.upsert_patient(sess.id, req.patientData.model_dump(exclude_none=True))
-    system, user = prompt_expert(req.patientData.model_dump(exclude_none=True))
-    out = complete(system, user, temperature=0.1)
-    store.add_turn(sess.id, "user", "[REQUEST EXPERT EVALUATION]")
-    store.add_turn(sess.id, "assistant", out)
-    store.set_stage(sess.id, "expert_evaluation")
-    return {"content": out}
\ No newline at end of file
+def expert(
+    req: CompleteRequest,
+    async_: bool = Query(False, alias="async"),
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
+    sess=Depends(get_session),
+):
+    patient = req.patientData.model_dump(exclude_none=True)
+    if async_:
+        return submit_job("expert_evaluation", sess.id, req.model_dump(), idempotency_key,
+                          lambda: _run_expert(sess.id, patient))
+    return _run_expert(sess.id, patient)
\ No newline at end of file
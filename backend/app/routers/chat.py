@@ -1,42 +1,71 @@
 # app/routers/chat.py
 
-from fastapi import APIRouter, Depends
+import asyncio
+import json
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
 from app.deps import get_session
-from app.models import ChatRequest
+from app.models import ChatRequest, Session
 from app.prompts import prompt_chat_followup, prompt_expert_from_summary
+from app.routers.labs import _detect_critical
 from app.services.openai_service import complete
+from app.services.summarizer import summaries
 from app.store import store
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-def summarize_session(patient: dict, history: list[dict]) -> str:
-    user_msgs = [h["content"] for h in history if h["role"] == "user"]
-    last_user = user_msgs[-1] if user_msgs else ""
-    lines = [
-        f"Yaş/Cinsiyet: {patient.get('age')}/{patient.get('gender')}",
-        f"Ana şikayet: {patient.get('symptoms')}",
-        f"Süre: {patient.get('duration') or (patient.get('additionalInfo') or {}).get('duration')}",
-        f"Ek notlar: {patient.get('extra_notes')}",
-        f"Son kullanıcı mesajı: {last_user}",
-    ]
-    prev = patient.get("previousAnswers")
-    if prev:
-        lines.append(f"Önceki yanıtlar: {prev}")
-    return "\n".join([s for s in lines if s and s not in ("None", "null")])
+Emit = Callable[[Dict[str, Any]], None]
 
-@router.post("/send")
-def send(req: ChatRequest, sess=Depends(get_session)):
+class _MarkerGuard:
+    """
+    Soru modunda model yalnızca "[GO_EXPERT]" dönebilir; işaretin kullanıcıya
+    token olarak akmaması için ilk anlamlı karakter "[" ise çıktı tutulur.
+    """
+
+    def __init__(self, emit: Emit) -> None:
+        self.emit = emit
+        self.buf = ""
+        self.state = "pending"   # pending | pass | hold
+
+    def __call__(self, text: str) -> None:
+        if self.state == "pass":
+            self.emit({"type": "token", "text": text})
+            return
+        if self.state == "hold":
+            return
+        self.buf += text
+        head = self.buf.lstrip()
+        if not head:
+            return
+        if head.startswith("["):
+            self.state = "hold"
+        else:
+            self.state = "pass"
+            self.emit({"type": "token", "text": self.buf})
+        self.buf = ""
+
+def _token_sink(emit: Optional[Emit]) -> Optional[Callable[[str], None]]:
+    if emit is None:
+        return None
+    return lambda text: emit({"type": "token", "text": text})
+
+def handle_message(sess: Session, message: str, emit: Optional[Emit] = None) -> Dict[str, Any]:
+    """
+    /chat/send ve /chat/ws ortak karar mantığı. emit verilirse yanıt token
+    token ve stage geçişleri olay olarak iletilir.
+    """
     # 1) Kullanıcı mesajını geçmişe yaz
-    store.add_turn(sess.id, "user", req.message)
+    store.add_turn(sess.id, "user", message)
 
-    patient = sess.patient.model_dump()
-    history = [t.model_dump() for t in sess.history]
     stage = store.get_stage(sess.id)
 
     # === A) UZMAN MODUNDA DEVAM ===
     # Daha önce ekspertize geçildiyse, soru modunu hiç çağırma.
     if stage == "expert_evaluation":
-        summary = summarize_session(patient, history)
+        # arka planda güncellenen vaka özeti; geçmiş burada yeniden taranmaz
+        summary = summaries.get(sess)
 
         EXPERT_REPLY_SYS = (
             "Uzman klinik danışman modundasın. Artık anamnez sorusu sorma ve yeni soru üretme. "
@@ -46,24 +75,33 @@ def send(req: ChatRequest, sess=Depends(get_session)):
         )
         EXPERT_REPLY_USR = (
             f"Kısa vaka özeti:\n{summary}\n\n"
-            f"Kullanıcı sorusu/mesajı:\n{req.message}\n\n"
+            f"Kullanıcı sorusu/mesajı:\n{message}\n\n"
             "Kısa ve doğrudan cevap ver."
         )
 
-        expert_reply = complete(EXPERT_REPLY_SYS, EXPERT_REPLY_USR, temperature=0.2)
+        expert_reply = complete(EXPERT_REPLY_SYS, EXPERT_REPLY_USR, temperature=0.2,
+                                stage="expert_evaluation", on_token=_token_sink(emit),
+                                session_id=sess.id)
         store.add_turn(sess.id, "assistant", expert_reply)
         # stage expert_evaluation olarak kalır
         return {"content": expert_reply, "auto_expert": False}
 
     # === B) SORU MODU (UZMANA GEÇMEMİŞ) ===
-    system, user = prompt_chat_followup(req.message, patient, history)
-    out = complete(system, user)
+    profile_key, patient = store.get_profile(sess.id)
+    history = sess.history.to_dicts()
+    system, user = prompt_chat_followup(message, patient, history, profile_key)
+    out = complete(system, user, stage="follow_up",
+                   on_token=_MarkerGuard(emit) if emit is not None else None,
+                   session_id=sess.id)
 
     # Sadece İLK KEZ kesin eşleşmede uzmana geç (içerik içinde geçen kelimeye değil)
     if out.strip() == "[GO_EXPERT]":
-        summary = summarize_session(patient, history)
+        if emit is not None:
+            emit({"type": "stage", "stage": "expert_evaluation"})
+        summary = summaries.get(sess)
         sys2, usr2 = prompt_expert_from_summary(summary)
-        expert = complete(sys2, usr2, temperature=0.1)
+        expert = complete(sys2, usr2, temperature=0.1, stage="expert_evaluation",
+                          on_token=_token_sink(emit), session_id=sess.id)
 
         store.add_turn(sess.id, "assistant", expert)
         store.set_stage(sess.id, "expert_evaluation")  # <-- bundan sonra hep uzman modu
@@ -72,4 +110,93 @@ def send(req: ChatRequest, sess=Depends(get_session)):
     # Normal soru modu cevabı
     store.add_turn(sess.id, "assistant", out)
     store.set_stage(sess.id, "follow_up")
-    return {"content": out, "auto_expert": False}
\ No newline at end of file
+    return {"content": out, "auto_expert": False}
+
+@router.post("/send")
+def send(req: ChatRequest, sess=Depends(get_session)):
+    return handle_message(sess, req.message)
+
+# ---------------- WebSocket ----------------
+# Oturum bağlantıda bir kez bağlanır (tarayıcı WS'de header gönderemediği için
+# ?session_id=); sonrasında her mesaj tek frame. Sunucu olayları:
+#   ready, token, stage, alert, message, error, pong
+# İstemci akış sırasında koparsa gönderim hatası yutulur ve üretim bir sonraki
+# token'da durdurulur (upstream akışı kapatılır).
+
+class _ClientGone(Exception):
+    """WS istemcisi koptu; emit üretim thread'inde bunu fırlatarak akışı keser."""
+
+@router.websocket("/ws")
+async def chat_ws(websocket: WebSocket, session_id: str):
+    sess = store.get(session_id)
+    if not sess:
+        await websocket.close(code=4404, reason="Session not found or expired")
+        return
+    await websocket.accept()
+    await websocket.send_json({"type": "ready", "session_id": sess.id, "stage": sess.stage})
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                data = json.loads(raw)
+            except ValueError:
+                data = {"type": "message", "message": raw}   # düz metin frame = mesaj
+            kind = data.get("type", "message") if isinstance(data, dict) else None
+            if kind == "ping":
+                await websocket.send_json({"type": "pong"})
+                continue
+            message = data.get("message") if kind == "message" else None
+            if not isinstance(message, str) or not message.strip():
+                await websocket.send_json({"type": "error", "detail": "message alanı gerekli"})
+                continue
+
+            # TTL'i tazeler; tahliye/snapshot sonrası güncel nesneyi verir
+            sess = store.get(session_id)
+            if not sess:
+                await websocket.send_json({"type": "error", "detail": "Session not found or expired"})
+                await websocket.close(code=4404)
+                return
+
+            queue: asyncio.Queue = asyncio.Queue()
+            gone = threading.Event()
+
+            def emit(ev: Dict[str, Any]) -> None:
+                if gone.is_set():
+                    raise _ClientGone()
+                loop.call_soon_threadsafe(queue.put_nowait, ev)
+
+            before = store.get_stage(sess.id)
+            task = asyncio.create_task(asyncio.to_thread(handle_message, sess, message, emit))
+            task.add_done_callback(lambda _: loop.call_soon_threadsafe(queue.put_nowait, None))
+
+            try:
+                while True:
+                    ev = await queue.get()
+                    if ev is None:
+                        break
+                    await websocket.send_json(ev)
+            except (WebSocketDisconnect, RuntimeError):
+                # istemci koptu: üretimi durdur, thread'in bitmesini bekle (hata günlüğe düşmesin)
+                gone.set()
+                await asyncio.gather(task, return_exceptions=True)
+                return
+
+            try:
+                result = task.result()
+            except Exception as e:
+                print("[chat/ws] message failed:", e)
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                continue
+
+            after = store.get_stage(sess.id)
+            if after != before and not result.get("auto_expert"):
+                await websocket.send_json({"type": "stage", "stage": after})
+            alerts = _detect_critical(result["content"])
+            if alerts:
+                await websocket.send_json({"type": "alert", "alerts": alerts})
+            await websocket.send_json({"type": "message", "stage": after, **result})
+    except (WebSocketDisconnect, RuntimeError):
+        # receive sırasında kopma ya da kapanmış sokete gönderim
+        return
@@ -0,0 +1,37 @@
+# app/routers/debug.py
+import asyncio
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from app.deps import require_admin
+from app.services.profiler import sampler, watchdog
+from app.services.usage import usage
+from app.settings import settings
+
+router = APIRouter(prefix="/debug", tags=["debug"], dependencies=[Depends(require_admin)])
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(seconds: float = Query(5.0, gt=0)):
+    """
+    N saniye boyunca süreç içi örnekleme; flamegraph uyumlu collapsed-stack metni döner.
+    """
+    seconds = min(seconds, settings.PROFILE_MAX_SECONDS)
+    try:
+        return await asyncio.to_thread(sampler.run, seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/loop")
+def loop_lag():
+    """Event loop gecikme istatistikleri ve son takılmaların yığınları."""
+    return watchdog.stats()
+
+@router.get("/usage")
+def usage_ledger(session_id: str | None = None, top: int = Query(20, ge=1, le=200)):
+    """
+    Upstream token defteri: son 60 sn TPM, kota reddleri, stage / model bazında
+    toplamlar (LLM_PRICES varsa maliyet) ve en çok token harcayan oturumlar.
+    session_id verilirse yalnızca o oturum.
+    """
+    return usage.snapshot(session_id, top)
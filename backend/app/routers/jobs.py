@@ -0,0 +1,40 @@
+# app/routers/jobs.py
+import asyncio
+import time
+from typing import Any, Callable, Dict
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse
+
+from app.deps import get_session
+from app.models import JobStatus
+from app.services.jobs import jobs, request_key
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+POLL_INTERVAL = 0.25
+
+def submit_job(kind: str, sess_id: str, body: Any, idem: str | None,
+               fn: Callable[[], Dict[str, Any]]) -> JSONResponse:
+    """?async=1: işi kuyruğa al (ya da aynı anahtarlı mevcut işe bağlan), 202 + job id dön."""
+    try:
+        job = jobs.submit(kind, sess_id, request_key(sess_id, kind, body, idem), fn)
+    except OverflowError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return JSONResponse(status_code=202, content={
+        "job_id": job.id, "status": job.status, "poll": f"/jobs/{job.id}",
+    })
+
+@router.get("/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str, wait: float = Query(0, ge=0, le=30), sess=Depends(get_session)):
+    """
+    İş durumu. wait > 0 ise iş bitene ya da süre dolana kadar bekler (long-poll);
+    bitmiş işte result, /labs/final ve /assessment/expert yanıtıyla aynıdır.
+    """
+    job = jobs.get(job_id)
+    if not job or job.session_id != sess.id:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    deadline = time.monotonic() + wait
+    while not job.finished and time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+    return job.to_status()
@@ -0,0 +1,329 @@
+# app/routers/lab_batch.py
+# Klinik toplu aktarımları için tahlil analizi iş API'si.
+# Öğeler /labs/analyze ile aynı normalize + prompt hattından geçer; oturum açılmaz.
+# online: sınırlı eşzamanlılıkla LLM; offline: upstream Batch API'ye tek dosya.
+# Uçlar X-Clinic-Token ister; işler açan kliniğe aittir. Online çağrılar toplu iş
+# kotasıyla (batch=True: TPM_BATCH + global TPM'in TPM_BATCH_SHARE payı) ve klinik
+# başına ayrı bir hesapla ("batch:clinic:<id>") sınırlıdır; kotaya takılan
+# öğe hata sayılmaz, Retry-After kadar bekleyip LAB_BATCH_QUOTA_WAIT içinde yeniden dener.
+from __future__ import annotations
+
+import asyncio
+import json
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+
+from app.deps import require_clinic
+from app.models import LabBatchRequest, LabBatchStatus
+from app.prompts import prompt_lab_analysis
+from app.routers.labs import (
+    _attach_extracted_text, _detect_critical, _history_owner, _lab_trends, _normalize_payload,
+)
+from app.services.openai_service import complete, fetch_batch, submit_batch
+from app.services.pdf_service import extract_text_from_upload
+from app.services.usage import QuotaExceeded
+from app.settings import settings
+
+router = APIRouter(prefix="/labs/analyze/batch", tags=["labs"])
+
+
+# ---------------- job state ----------------
+
+class LabBatchJob:
+    def __init__(self, mode: str, total: int, clinic: str) -> None:
+        self.id = uuid4().hex
+        self.mode = mode
+        self.clinic = clinic
+        self.status = "running" if mode == "online" else "submitted"
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        self.results: List[Dict[str, Any]] = []
+        self.upstream_id: Optional[str] = None
+        # offline işlerde custom_id -> (index, ref)
+        self.pending: Dict[str, tuple[int, Any]] = {}
+        self.task: Optional[asyncio.Task] = None
+        # offline sonuçların tek kez işlenmesi için (_refresh_offline)
+        self.lock = asyncio.Lock()
+        self._changed = asyncio.Event()
+
+    # --------- progress ----------
+    def add_result(self, res: Dict[str, Any]) -> None:
+        self.results.append(res)
+        if res.get("error"):
+            self.failed += 1
+        else:
+            self.done += 1
+        if self.done + self.failed >= self.total:
+            self.finish("completed")
+        else:
+            self._notify()
+
+    def finish(self, status: str, error: str | None = None) -> None:
+        self.status = status
+        self.error = error
+        self.finished_at = datetime.utcnow()
+        self._notify()
+
+    def _notify(self) -> None:
+        ev, self._changed = self._changed, asyncio.Event()
+        ev.set()
+
+    async def wait(self, seen: int) -> None:
+        """Sonuç sayısı `seen`'i geçene ya da iş bitene kadar bekler."""
+        while len(self.results) <= seen and not self.finished:
+            await self._changed.wait()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def progress(self) -> Dict[str, Any]:
+        return {"type": "progress", "status": self.status, "total": self.total,
+                "done": self.done, "failed": self.failed}
+
+    def to_status(self) -> LabBatchStatus:
+        return LabBatchStatus(
+            job_id=self.id, mode=self.mode, status=self.status,  # type: ignore[arg-type]
+            total=self.total, done=self.done, failed=self.failed,
+            created_at=self.created_at, error=self.error,
+        )
+
+
+class LabBatchRegistry:
+    def __init__(self) -> None:
+        self._jobs: Dict[str, LabBatchJob] = {}
+
+    def add(self, job: LabBatchJob) -> LabBatchJob:
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[LabBatchJob]:
+        return self._jobs.get(job_id)
+
+    def sweep(self) -> None:
+        """Bitmiş ve TTL'i dolmuş işleri temizle."""
+        cutoff = datetime.utcnow() - timedelta(seconds=int(settings.LAB_BATCH_TTL))
+        for jid in [j.id for j in list(self._jobs.values())
+                    if j.finished_at and j.finished_at < cutoff]:
+            self._jobs.pop(jid, None)
+
+
+jobs = LabBatchRegistry()
+
+
+# ---------------- workers ----------------
+
+def _prepare(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Tek öğeyi /labs/analyze ile aynı şekilde normalize eder."""
+    raw = {k: v for k, v in raw.items() if k != "ref"}
+    return _attach_extracted_text(_normalize_payload(raw, None))
+
+def _prepare_all(items: List[tuple[int, Dict[str, Any]]]) -> Tuple[
+        List[tuple[int, Any, Dict[str, Any]]], List[tuple[int, Any, str]]]:
+    """Tüm öğeleri normalize eder (thread'de çalışır): (hastalar, hatalı öğeler)."""
+    patients: List[tuple[int, Any, Dict[str, Any]]] = []
+    invalid: List[tuple[int, Any, str]] = []
+    for index, raw in items:
+        ref = raw.get("ref") if isinstance(raw, dict) else None
+        try:
+            patients.append((index, ref, _prepare(raw)))
+        except Exception as e:
+            invalid.append((index, ref, f"Geçersiz öğe: {e}"))
+    return patients, invalid
+
+def _owner(job: LabBatchJob) -> str:
+    """Tahlil geçmişi sahibi: "clinic:<id>" (kota hesabı bunun "batch:" önekli hali)."""
+    return _history_owner(None, job.clinic)
+
+def _analyze_one(job: LabBatchJob, patient: Dict[str, Any]) -> str:
+    system, user = prompt_lab_analysis(patient, _lab_trends(patient, _owner(job)))
+    return complete(system, user, stage="lab_analysis", session_id=f"batch:{_owner(job)}", batch=True)
+
+def _result(index: int, ref: Any, content: str | None = None, error: str | None = None) -> Dict[str, Any]:
+    if error:
+        return {"type": "result", "index": index, "ref": ref, "error": error}
+    return {"type": "result", "index": index, "ref": ref, "content": content,
+            "criticalAlerts": _detect_critical(content or "")}
+
+async def _run_online(job: LabBatchJob, patients: List[tuple[int, Any, Dict[str, Any]]]) -> None:
+    sem = asyncio.Semaphore(max(1, settings.LAB_BATCH_CONCURRENCY))
+
+    loop = asyncio.get_running_loop()
+
+    async def one(index: int, ref: Any, patient: Dict[str, Any]) -> None:
+        async with sem:
+            deadline: Optional[float] = None
+            while True:
+                try:
+                    out = await asyncio.to_thread(_analyze_one, job, patient)
+                    job.add_result(_result(index, ref, content=out))
+                except QuotaExceeded as e:
+                    # kota dolu: iş yavaşlar, öğe düşmez (süre dolarsa hata)
+                    if deadline is None:
+                        deadline = loop.time() + settings.LAB_BATCH_QUOTA_WAIT
+                    if loop.time() + e.retry_after > deadline:
+                        job.add_result(_result(index, ref, error=str(e)))
+                    else:
+                        await asyncio.sleep(e.retry_after)
+                        continue
+                except Exception as e:
+                    print(f"[labs/batch] {job.id} item {index} failed:", e)
+                    job.add_result(_result(index, ref, error=str(e)))
+                return
+
+    await asyncio.gather(*(one(i, ref, p) for i, ref, p in patients))
+
+def _submit_offline(job: LabBatchJob, patients: List[tuple[int, Any, Dict[str, Any]]]) -> None:
+    reqs = []
+    for index, ref, patient in patients:
+        system, user = prompt_lab_analysis(patient, _lab_trends(patient, _owner(job)))
+        cid = f"{job.id}-{index}"
+        job.pending[cid] = (index, ref)
+        reqs.append({"custom_id": cid, "system": system, "user": user})
+    job.upstream_id = submit_batch(reqs, stage="lab_analysis")
+
+async def _refresh_offline(job: LabBatchJob) -> None:
+    """Offline işin upstream durumunu kontrol eder; bittiyse sonuçları işe yazar."""
+    if job.mode != "offline" or job.finished or not job.upstream_id:
+        return
+    # status ve results aynı anda yoklanırsa sonuçlar iki kez eklenmesin
+    async with job.lock:
+        if job.finished or not job.pending:
+            return
+        try:
+            outputs = await asyncio.to_thread(fetch_batch, job.upstream_id)
+        except Exception as e:
+            job.finish("failed", str(e))
+            return
+        if outputs is None:
+            return
+        for cid, (index, ref) in list(job.pending.items()):
+            content = outputs.get(cid)
+            if content:
+                job.add_result(_result(index, ref, content=content))
+            else:
+                job.add_result(_result(index, ref, error="Upstream yanıtı yok"))
+        job.pending.clear()
+
+async def _start(job: LabBatchJob, items: List[tuple[int, Dict[str, Any]]]) -> LabBatchJob:
+    # 500 öğeye kadar normalize (pydantic + PDF metni) event loop'u bloklamasın
+    patients, invalid = await asyncio.to_thread(_prepare_all, items)
+    for index, ref, error in invalid:
+        # doğrulanamayan öğe işi durdurmaz; hatalı sonuç olarak raporlanır
+        job.add_result(_result(index, ref, error=error))
+
+    if job.mode == "online":
+        if patients:
+            job.task = asyncio.create_task(_run_online(job, patients))
+        return job
+
+    if not patients:
+        return job
+    try:
+        await asyncio.to_thread(_submit_offline, job, patients)
+    except Exception as e:
+        job.finish("failed", str(e))
+    return job
+
+def _check_size(n: int) -> None:
+    if n == 0:
+        raise HTTPException(status_code=400, detail="Boş toplu iş")
+    if n > settings.LAB_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"En fazla {settings.LAB_BATCH_MAX_ITEMS} öğe gönderilebilir")
+
+def _require_job(job_id: str, clinic: str) -> LabBatchJob:
+    job = jobs.get(job_id)
+    if not job or job.clinic != clinic:
+        raise HTTPException(status_code=404, detail="Batch job not found or expired")
+    return job
+
+
+# ---------------- endpoints ----------------
+
+@router.post("", response_model=LabBatchStatus)
+async def submit(req: LabBatchRequest, clinic: str = Depends(require_clinic)):
+    _check_size(len(req.items))
+    job = jobs.add(LabBatchJob(req.mode, len(req.items), clinic))
+    print(f"[/labs/analyze/batch] job={job.id} mode={job.mode} items={job.total}")
+    await _start(job, list(enumerate(req.items)))
+    return job.to_status()
+
+@router.post("/pdf", response_model=LabBatchStatus)
+async def submit_pdfs(files: List[UploadFile] = File(...), mode: str = "online",
+                      clinic: str = Depends(require_clinic)):
+    """
+    Birden çok PDF'i tek işte analiz eder. Her dosya bir hasta paneli sayılır;
+    ref olarak dosya adı döner.
+    """
+    _check_size(len(files))
+    if mode not in ("online", "offline"):
+        raise HTTPException(status_code=400, detail="mode online|offline olmalı")
+
+    items: List[Dict[str, Any]] = []
+    for f in files:
+        content = await f.read()
+        if len(content) > 10 * 1024 * 1024:  # 10MB
+            items.append({"ref": f.filename, "_error": "Dosya boyutu 10MB'dan büyük olamaz"})
+            continue
+        try:
+            text = await asyncio.to_thread(extract_text_from_upload, content, f.filename or "")
+        except Exception as e:
+            items.append({"ref": f.filename, "_error": f"PDF işleme hatası: {e}"})
+            continue
+        items.append({
+            "ref": f.filename,
+            "patientData": {"additionalInfo": {"uploaded_file": f.filename, "extracted_text": text}},
+        })
+
+    job = jobs.add(LabBatchJob(mode, len(items), clinic))
+    print(f"[/labs/analyze/batch/pdf] job={job.id} mode={job.mode} files={job.total}")
+    ok: List[tuple[int, Dict[str, Any]]] = []
+    for index, it in enumerate(items):
+        if "_error" in it:
+            job.add_result(_result(index, it["ref"], error=it["_error"]))
+        else:
+            ok.append((index, it))
+    if ok:
+        await _start(job, ok)
+    return job.to_status()
+
+@router.get("/{job_id}", response_model=LabBatchStatus)
+async def status(job_id: str, clinic: str = Depends(require_clinic)):
+    job = _require_job(job_id, clinic)
+    await _refresh_offline(job)
+    return job.to_status()
+
+@router.get("/{job_id}/results")
+async def results(job_id: str, clinic: str = Depends(require_clinic)):
+    """
+    Sonuçları NDJSON olarak akıtır: her tamamlanan öğe için bir `result`
+    satırı ve ardından bir `progress` satırı; iş bitince `done` satırı.
+    Offline işlerde o anki durum döner ve akış kapanır.
+    """
+    job = _require_job(job_id, clinic)
+    await _refresh_offline(job)
+
+    async def gen() -> AsyncIterator[bytes]:
+        cursor = 0
+        while True:
+            while cursor < len(job.results):
+                yield (json.dumps(job.results[cursor], ensure_ascii=False) + "\n").encode("utf-8")
+                cursor += 1
+                yield (json.dumps(job.progress(), ensure_ascii=False) + "\n").encode("utf-8")
+            if job.finished or job.mode == "offline":
+                final = {**job.progress(), "type": "done" if job.finished else "progress"}
+                if job.error:
+                    final["error"] = job.error
+                yield (json.dumps(final, ensure_ascii=False) + "\n").encode("utf-8")
+                return
+            await job.wait(cursor)
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
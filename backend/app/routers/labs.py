@@ -1,12 +1,13 @@
 # app/routers/labs.py
 from __future__ import annotations
-from fastapi import APIRouter, Depends, Body, UploadFile, File
+from fastapi import APIRouter, Depends, Body, UploadFile, File, Header, HTTPException, Query
 from typing import List, Dict, Any, Tuple
+import asyncio
 import re
 import json
 from pydantic import ValidationError
 
-from app.deps import get_session
+from app.deps import get_clinic, get_session
 from app.models import PatientData, LabValue
 from app.prompts import (
     prompt_lab_analysis,
@@ -15,6 +16,9 @@ from app.prompts import (
 )
 from app.services.openai_service import complete
 from app.services.pdf_service import extract_text_from_upload
+from app.services.lab_history import lab_history
+from app.services.uploads import uploads
+from app.routers.jobs import submit_job
 from app.store import store
 
 router = APIRouter(prefix="/labs", tags=["labs"])
@@ -115,16 +119,17 @@ def _detect_critical(text: str) -> List[str]:
             flags.append(f"Kritik uyarı ifadesi tespit edildi: '{p}'")
     return list(dict.fromkeys(flags))
 
-def _normalize_payload(raw: Dict[str, Any], sess_id: str) -> Dict[str, Any]:
+def _normalize_payload(raw: Dict[str, Any], sess_id: str | None) -> Dict[str, Any]:
     """
     FE’nin olası biçimleri:
       A) {"stage": "...", "patientData": {...}}
       B) {"stage": "...", "patientData": "<hash/hex>"}  -> store’daki profili temel al
       C) Doğrudan patient alanları
     Sonuç: dict (PatientData şemasına uygun) + labResults normalize.
+    sess_id None ise (toplu iş) oturum profili kullanılmaz.
     """
     # Mevcut profil (oturumdan)
-    snap = store.snapshot(sess_id)
+    snap = store.snapshot(sess_id) if sess_id else None
     current = snap.patient.model_dump(exclude_none=True) if snap else {}
 
     # --- patientData çıkar ---
@@ -157,30 +162,59 @@ def _normalize_payload(raw: Dict[str, Any], sess_id: str) -> Dict[str, Any]:
         print("[labs] VALIDATION ERROR (merged):", ve)
         raise
 
+    # Kompakt mod: metin yerine id geldiyse yüklenen metni geri koy
+    _resolve_text_ref(p)
+
     # labResults’ı kesin normalize et (float/status)
     if "labResults" in p and isinstance(p["labResults"], list):
         p["labResults"] = _coerce_lab_values(p["labResults"])
 
     return p
 
-# ---------------- endpoints ----------------
+def _resolve_text_ref(patient: Dict[str, Any]) -> None:
+    """additionalInfo.extracted_text_ref -> additionalInfo.extracted_text (uploads deposundan)."""
+    info = patient.get("additionalInfo")
+    if not isinstance(info, dict) or "extracted_text_ref" not in info:
+        return
+    ref = info.pop("extracted_text_ref")
+    text = uploads.get(str(ref))
+    if text is None:
+        raise HTTPException(status_code=410, detail="Yüklenen metin bulunamadı; PDF'i tekrar yükleyin")
+    info["extracted_text"] = text
+    info["extracted_text_id"] = ref
 
-@router.post("/analyze")
-def analyze(body: Dict[str, Any] = Body(...), sess=Depends(get_session)):
-    print("[/labs/analyze] raw body =", json.dumps(body, ensure_ascii=False))
-    patient = _normalize_payload(body, sess.id)
-    
-    # PDF'den çıkarılan text varsa additionalInfo'ya ekle
+def _attach_extracted_text(patient: Dict[str, Any]) -> Dict[str, Any]:
+    """PDF'den çıkarılan text varsa additionalInfo.extractedText olarak ekler."""
     if "additionalInfo" in patient and isinstance(patient["additionalInfo"], dict):
         additional_info = patient["additionalInfo"]
         if "extracted_text" in additional_info:
-            # PDF text'i extractedText olarak ekle
-            patient["additionalInfo"]["extractedText"] = additional_info["extracted_text"]
-    
+            additional_info["extractedText"] = additional_info["extracted_text"]
+    return patient
+
+def _history_owner(sess_id: str | None, clinic: str | None) -> str:
+    """patientRef'in sahibi: geçerli X-Clinic-Token varsa klinik, yoksa oturum."""
+    return f"clinic:{clinic}" if clinic else f"session:{sess_id}"
+
+def _lab_trends(patient: Dict[str, Any], owner: str) -> str:
+    """patientRef varsa paneli sahibin hasta indeksine ekler ve prompt için trend özetini döndürür."""
+    ref = patient.get("patientRef")
+    if not ref:
+        return "—"
+    lab_history.ingest(owner, ref, patient.get("labResults"))
+    return lab_history.summary(owner, ref)
+
+# ---------------- endpoints ----------------
+
+@router.post("/analyze")
+def analyze(body: Dict[str, Any] = Body(...), sess=Depends(get_session),
+            clinic: str | None = Depends(get_clinic)):
+    print("[/labs/analyze] raw body =", json.dumps(body, ensure_ascii=False))
+    patient = _attach_extracted_text(_normalize_payload(body, sess.id))
+
     store.upsert_patient(sess.id, patient)
 
-    system, user = prompt_lab_analysis(patient)
-    out = complete(system, user)  # Uyarı eklemiyoruz; UI gösteriyor
+    system, user = prompt_lab_analysis(patient, _lab_trends(patient, _history_owner(sess.id, clinic)))
+    out = complete(system, user, stage="lab_analysis", session_id=sess.id)  # Uyarı eklemiyoruz; UI gösteriyor
 
     store.add_turn(sess.id, "user", "[LAB ANALYSIS REQUEST]")
     store.add_turn(sess.id, "assistant", out)
@@ -200,7 +234,7 @@ def lab_follow_up(body: Dict[str, Any] = Body(...), sess=Depends(get_session)):
     store.upsert_patient(sess.id, patient)
 
     system, user = prompt_lab_follow_up(patient)
-    out = complete(system, user)
+    out = complete(system, user, stage="lab_follow_up", session_id=sess.id)
 
     store.add_turn(sess.id, "user", "[LAB FOLLOW-UP REQUEST]")
     store.add_turn(sess.id, "assistant", out)
@@ -208,25 +242,40 @@ def lab_follow_up(body: Dict[str, Any] = Body(...), sess=Depends(get_session)):
 
     return {"content": out, "questions": _extract_questions(out)}
 
-@router.post("/final")
-def lab_final(body: Dict[str, Any] = Body(...), sess=Depends(get_session)):
-    print("[/labs/final] raw body =", json.dumps(body, ensure_ascii=False))
-    patient = _normalize_payload(body, sess.id)
-    store.upsert_patient(sess.id, patient)
+def _run_lab_final(sess_id: str, patient: Dict[str, Any], owner: str) -> Dict[str, Any]:
+    store.upsert_patient(sess_id, patient)
 
-    system, user = prompt_lab_final(patient)
-    out = complete(system, user, temperature=0.2)
+    system, user = prompt_lab_final(patient, _lab_trends(patient, owner))
+    out = complete(system, user, temperature=0.2, stage="lab_final", session_id=sess_id)
 
-    store.add_turn(sess.id, "user", "[LAB FINAL REQUEST]")
-    store.add_turn(sess.id, "assistant", out)
-    store.set_stage(sess.id, "lab_final")
+    store.add_turn(sess_id, "user", "[LAB FINAL REQUEST]")
+    store.add_turn(sess_id, "assistant", out)
+    store.set_stage(sess_id, "lab_final")
 
     return {"content": out}
 
+@router.post("/final")
+def lab_final(
+    body: Dict[str, Any] = Body(...),
+    async_: bool = Query(False, alias="async"),
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
+    sess=Depends(get_session),
+    clinic: str | None = Depends(get_clinic),
+):
+    print("[/labs/final] raw body =", json.dumps(body, ensure_ascii=False))
+    patient = _normalize_payload(body, sess.id)
+    owner = _history_owner(sess.id, clinic)
+    if async_:
+        return submit_job("lab_final", sess.id, body, idempotency_key,
+                          lambda: _run_lab_final(sess.id, patient, owner))
+    return _run_lab_final(sess.id, patient, owner)
+
 @router.post("/upload-pdf")
-async def upload_pdf(file: UploadFile = File(...), sess=Depends(get_session)):
+async def upload_pdf(file: UploadFile = File(...), compact: bool = Query(False), sess=Depends(get_session)):
     """
     PDF dosyasını yükler ve text'e çevirir.
+    compact=1: metin yanıtta geri gönderilmez; istemci sonraki isteklerde
+    additionalInfo.extracted_text_ref = text_id ile referanslar.
     """
     try:
         # Dosya boyutunu kontrol et (10MB limit)
@@ -234,24 +283,39 @@ async def upload_pdf(file: UploadFile = File(...), sess=Depends(get_session)):
         if len(content) > 10 * 1024 * 1024:  # 10MB
             return {"error": "Dosya boyutu 10MB'dan büyük olamaz"}
         
-        # PDF'den text çıkar
-        extracted_text = extract_text_from_upload(content, file.filename)
+        # PDF'den text çıkar (event loop'u bloklamasın)
+        extracted_text = await asyncio.to_thread(extract_text_from_upload, content, file.filename)
         
+        text_id = uploads.put(extracted_text)
+
         # Session'a kaydet
         store.upsert_patient(sess.id, {
             "additionalInfo": {
                 "uploaded_file": file.filename,
                 "extracted_text": extracted_text,
+                "extracted_text_id": text_id,
                 "file_size": len(content)
             }
         })
         
-        return {
+        resp = {
             "success": True,
             "filename": file.filename,
-            "extracted_text": extracted_text,
+            "text_id": text_id,
             "text_length": len(extracted_text)
         }
+        if not compact:
+            resp["extracted_text"] = extracted_text
+        return resp
         
     except Exception as e:
-        return {"error": f"PDF işleme hatası: {str(e)}"}
\ No newline at end of file
+        return {"error": f"PDF işleme hatası: {str(e)}"}
+
+@router.get("/trends/{patient_ref}")
+def trends(patient_ref: str, sess=Depends(get_session), clinic: str | None = Depends(get_clinic)):
+    """
+    Hasta referansı için analit bazında son değer, fark, trend yönü ve son anormal tarih.
+    Yalnızca çağıranın (klinik ya da oturum) kendi yüklediği seriler görünür.
+    """
+    return {"patientRef": patient_ref,
+            "analytes": lab_history.trends(_history_owner(sess.id, clinic), patient_ref)}
@@ -1,12 +1,13 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from app.store import store
 from app.models import CreateSessionResp, SessionSnapshot
 
 router = APIRouter(prefix="/sessions", tags=["sessions"])
 
 @router.post("", response_model=CreateSessionResp)
-def create_session():
+def create_session(request: Request):
     sess = store.create()
+    request.state.session_id = sess.id   # stateless modda ilk token bu yanıtla döner
     return CreateSessionResp(session_id=sess.id)
 
 @router.get("/{sid}", response_model=SessionSnapshot)
@@ -19,7 +20,7 @@ def get_session(sid: str):
         id=s.id,
         stage=s.stage,
         patient=s.patient,
-        history=s.history,
+        history=s.history.to_models(),
         created_at=s.created_at,
         last_used_at=s.last_used_at,
     )
\ No newline at end of file
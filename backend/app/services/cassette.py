@@ -0,0 +1,110 @@
+# app/services/cassette.py
+# LLM trafiği için kayıt / tekrar oynatma (record / replay).
+# record: her complete() çağrısı (system, user, model, temperature) -> yanıt + süre
+#         olarak JSONL kasete eklenir.
+# replay: upstream'e gidilmez; yanıt kasetten, gecikme kaydedilen süre x ölçek
+#         kadar beklenerek verilir. Router'ların kendi CPU maliyetini OpenAI
+#         gecikmesinden ayırıp offline ve deterministik ölçmek için.
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.settings import settings
+
+
+def cassette_key(system: str, user: str, model: str, temperature: float) -> str:
+    raw = json.dumps([system, user, model, round(float(temperature), 4)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str = "", mode: str = "", latency_scale: float = 1.0) -> None:
+        self.path = path
+        self.mode = mode if path and mode in ("record", "replay") else ""
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[dict]] = {}
+        self._cursor: Dict[str, int] = {}
+        if self.mode == "replay":
+            self._load()
+        if self.mode:
+            print(f"[cassette] mode={self.mode} path={self.path}")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            raise Exception(f"Kaset bulunamadı: {self.path}")
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    self._entries.setdefault(rec["key"], []).append(rec)
+
+    def record(
+        self,
+        system: str,
+        user: str,
+        model: str,
+        temperature: float,
+        content: str,
+        finish_reason: Optional[str],
+        seconds: float,
+        stage: Optional[str] = None,
+    ) -> None:
+        rec = {
+            "key": cassette_key(system, user, model, temperature),
+            "stage": stage,
+            "model": model,
+            "temperature": temperature,
+            "system": system,
+            "user": user,
+            "content": content,
+            "finish_reason": finish_reason,
+            "seconds": round(seconds, 4),
+        }
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def replay(self, system: str, user: str, model: str, temperature: float) -> Tuple[str, Optional[str]]:
+        """
+        Kayıtlı yanıtı (content, finish_reason) döndürür. Aynı anahtar birden
+        fazla kaydedildiyse kayıt sırasıyla (sonra döngüsel) verilir.
+        """
+        key = cassette_key(system, user, model, temperature)
+        with self._lock:
+            recs = self._entries.get(key)
+            if not recs:
+                raise Exception(f"Kasette kayıt yok (model={model}, key={key[:12]})")
+            i = self._cursor.get(key, 0)
+            self._cursor[key] = i + 1
+            rec = recs[i % len(recs)]
+        delay = rec.get("seconds", 0.0) * self.latency_scale
+        if delay > 0:
+            time.sleep(delay)
+        return rec["content"], rec.get("finish_reason")
+
+    def rewind(self) -> None:
+        with self._lock:
+            self._cursor.clear()
+
+
+cassette = Cassette(
+    path=settings.LLM_CASSETTE_PATH,
+    mode=settings.LLM_CASSETTE_MODE,
+    latency_scale=settings.LLM_REPLAY_LATENCY_SCALE,
+)
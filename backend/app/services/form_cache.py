@@ -0,0 +1,278 @@
+# app/services/form_cache.py
+# İlk form (InitialForm) için yakın-tekrar önbelleği.
+# "baş ağrısı, 3 gün" ile "3 gündür baş ağrısı" aynı ilk soru setini üretir;
+# normalize alanlar (yaş bandı, cinsiyet, süre kovası) + belirti shingle'ları
+# üzerinden süreç içi MinHash/LSH indeksiyle eşleştirip upstream çağrısını atlarız.
+from __future__ import annotations
+
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from app.settings import settings
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5EED)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_TR_FOLD = str.maketrans({
+    "I": "ı", "İ": "i",
+})
+_ASCII_FOLD = str.maketrans({
+    "ç": "c", "ğ": "g", "ı": "i", "ö": "o", "ş": "s", "ü": "u", "â": "a", "î": "i", "û": "u",
+})
+_WORD = re.compile(r"[a-z]+")
+# Süre birimi kelime başında ve yalnızca zaman ekleriyle: "ayak", "bayılma", "güneş" süre değildir
+_TIME_UNIT = r"(saat|gun|hafta|ay|yil|dun)"
+_TIME_SUFFIX = r"(?:ler|lar)?(?:dir|dur|tir|tur|luk|lik|dan|den|tan|ten|u|i|e|a)?"
+_DURATION = re.compile(rf"\b(?:(\d+|bir|iki|uc|dort|bes|birkac)\s*)?{_TIME_UNIT}{_TIME_SUFFIX}\b")
+_NUMBERS = {"bir": 1, "iki": 2, "uc": 3, "dort": 4, "bes": 5, "birkac": 3}
+_UNIT_DAYS = {"saat": 1 / 24, "gun": 1, "dun": 1, "hafta": 7, "ay": 30, "yil": 365}
+# süre/bağlaç kelimeleri belirti shingle'larına girmez ("gündür", "haftadır" dahil)
+_TIME_WORD = re.compile(_TIME_UNIT + _TIME_SUFFIX)
+_STOP = frozenset(("ve", "ile", "cok", "biraz", "bir", "iki", "uc", "dort", "bes", "birkac", "de", "da"))
+# Varlık / olumsuzluk ("var", "yok", "değil", "-miyor", "-medi") shingle'lardan atılmaz;
+# ayrıca olumsuzlanan terimler anahtarın tam eşleşen parçasıdır: "ateş var" ile
+# "ateş yok" benzerlik ne olursa olsun aynı kovaya düşmez.
+_NEG_WORDS = frozenset(("yok", "yoktu", "yoktur", "degil", "degildi", "degildir", "olmadi", "olmuyor", "hayir"))
+_NEG_VERB = re.compile(r"m[iu]yor|m[ae]d[iu]|m[ae]z")
+# Taraf ve kritik klinik terimler de anahtarın tam eşleşen parçasıdır: "sol kol ağrısı,
+# göğüste baskı" ile "sağ kol ağrısı, göğüste baskı" 3-gram benzerliği eşiği geçse de
+# farklı vakadır. Terimler ASCII-katlanmış kelime kökleriyle (önek) eşleşir.
+_SIDE = re.compile(r"(sag|sol)(da|dan|daki|a|e)?")
+_KEY_TERMS = ("gogus", "nefes", "bayil", "uyus", "felc", "kanam", "kanli", "nobet",
+              "bilinc", "konusma", "gorme", "hamile", "gebe", "iki taraf", "her iki")
+
+# Acil yönlendirme içeren yanıtlar vakaya özeldir; önbelleğe alınmaz
+_NO_CACHE = ("112", "acil")
+_GREETING = re.compile(r"^\s*Merhaba[^.!\n]*[.!]\s*")
+# Yaşın metinde geçmesi ("34 yaşında") vakaya özeldir
+_AGE_IN_TEXT = "{age} yas"
+
+
+def _norm(text: str) -> str:
+    return text.translate(_TR_FOLD).lower().translate(_ASCII_FOLD)
+
+
+def _age_band(age: Optional[int]) -> str:
+    if age is None:
+        return "?"
+    for hi, band in ((1, "0-1"), (5, "2-5"), (12, "6-12"), (17, "13-17"),
+                     (29, "18-29"), (44, "30-44"), (64, "45-64")):
+        if age <= hi:
+            return band
+    return "65+"
+
+
+def _gender(g: Optional[str]) -> str:
+    g = _norm(g or "").strip()
+    if g[:1] in ("k", "f"):
+        return "f"
+    if g[:1] in ("e", "m"):
+        return "m"
+    return "?"
+
+
+def _duration_bucket(*texts: Optional[str]) -> str:
+    for t in texts:
+        m = _DURATION.search(_norm(t or ""))
+        if not m:
+            continue
+        num, unit = m.group(1), m.group(2)
+        n = _NUMBERS.get(num or "", None) if num and not num.isdigit() else (int(num) if num else 1)
+        days = (n or 1) * _UNIT_DAYS[unit]
+        if days < 1:
+            return "<1g"
+        if days <= 3:
+            return "1-3g"
+        if days <= 7:
+            return "4-7g"
+        if days <= 30:
+            return "8-30g"
+        return ">30g"
+    return "?"
+
+
+def _content_word(w: str) -> bool:
+    return len(w) >= 2 and w not in _STOP and not _TIME_WORD.fullmatch(w)
+
+
+def _negations(*texts: Optional[str]) -> Tuple[str, ...]:
+    """Olumsuzlanan terimler: 'yok/değil' öncesindeki kelime ya da olumsuz fiilin kendisi."""
+    out: Set[str] = set()
+    for t in texts:
+        prev = ""
+        for w in _WORD.findall(_norm(t or "")):
+            if w in _NEG_WORDS:
+                out.add(prev or w)
+            elif len(w) > 4 and _NEG_VERB.search(w):
+                out.add(w)
+            if _content_word(w) and w not in _NEG_WORDS:
+                prev = w
+    return tuple(sorted(out))
+
+
+def _identifying(form: dict, text: str) -> bool:
+    """
+    Selam dışında hastaya özgü bilgi (ad/soyad, "Ayşe Hanım", kesin yaş) geçen
+    yanıt başka hastaya verilemez; yalnızca kişiye özgü olmayan soru seti saklanır.
+    """
+    words = set(_WORD.findall(_norm(text)))
+    if any(len(w) >= 2 and w in words for w in _WORD.findall(_norm(form.get("name") or ""))):
+        return True
+    age = form.get("age")
+    return age is not None and _AGE_IN_TEXT.format(age=age) in _norm(text)
+
+
+def _key_terms(*texts: Optional[str]) -> Tuple[str, ...]:
+    """Metindeki taraf (sag/sol) ve kritik terimler; kümeler birebir aynı olmalı."""
+    out: Set[str] = set()
+    for t in texts:
+        norm = _norm(t or "")
+        words = _WORD.findall(norm)
+        for w in words:
+            m = _SIDE.fullmatch(w)
+            if m:
+                out.add(m.group(1))
+        joined = " " + " ".join(words)
+        out.update(k for k in _KEY_TERMS if " " + k in joined)
+    return tuple(sorted(out))
+
+
+def _shingles(*texts: Optional[str]) -> FrozenSet[str]:
+    """Kelime sırası ve ek farklarına dayanıklı: her kelimenin karakter 3-gram'ları."""
+    out: Set[str] = set()
+    for t in texts:
+        for w in _WORD.findall(_norm(t or "")):
+            if not _content_word(w):
+                continue
+            w = f"^{w}$"
+            out.update(w[i:i + 3] for i in range(len(w) - 2))
+    return frozenset(out)
+
+
+def _h(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def minhash(shingles: FrozenSet[str]) -> Tuple[int, ...]:
+    hs = [_h(x) for x in shingles]
+    return tuple(min((a * x + b) % _PRIME for x in hs) for a, b in _PERMS)
+
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class _Entry:
+    __slots__ = ("shingles", "bands", "questions", "greeted")
+
+    def __init__(self, shingles: FrozenSet[str], bands: List[Tuple], questions: str, greeted: bool) -> None:
+        self.shingles = shingles
+        self.bands = bands
+        self.questions = questions
+        self.greeted = greeted     # orijinal yanıt selamla mı başlıyordu
+
+
+class FormCache:
+    """
+    Yaş bandı + cinsiyet + süre kovası + olumsuzlanan terimler + taraf/kritik terimler
+    aynı, belirti benzerliği eşik üstündeyse isabet.
+    """
+
+    def __init__(self, max_entries: int | None = None, threshold: float | None = None) -> None:
+        self.enabled = settings.FORM_CACHE_ENABLED
+        self.max_entries = int(max_entries or settings.FORM_CACHE_MAX)
+        self.threshold = float(threshold or settings.FORM_CACHE_THRESHOLD)
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple, Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _features(self, form: dict) -> Tuple[Tuple, FrozenSet[str]]:
+        key = (
+            _age_band(form.get("age")),
+            _gender(form.get("gender")),
+            _duration_bucket(form.get("duration"), form.get("symptoms")),
+            _negations(form.get("symptoms"), form.get("extra_notes")),
+            _key_terms(form.get("symptoms"), form.get("extra_notes")),
+        )
+        return key, _shingles(form.get("symptoms"), form.get("extra_notes"))
+
+    @staticmethod
+    def _band_keys(key: Tuple, sig: Tuple[int, ...]) -> List[Tuple]:
+        return [(key, b, sig[b * ROWS:(b + 1) * ROWS]) for b in range(BANDS)]
+
+    def lookup(self, form: dict) -> Optional[str]:
+        """Güvenli eşleşmede selamı forma göre kişiselleştirilmiş soru setini döndürür."""
+        key, sh = self._features(form)
+        if not sh:
+            return None
+        bands = self._band_keys(key, minhash(sh))
+        best: Tuple[float, Optional[int]] = (0.0, None)
+        with self._lock:
+            cands: Set[int] = set()
+            for bk in bands:
+                cands |= self._buckets.get(bk, set())
+            for eid in cands:
+                score = _jaccard(sh, self._entries[eid].shingles)
+                if score > best[0]:
+                    best = (score, eid)
+            if best[1] is None or best[0] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best[1])
+            entry = self._entries[best[1]]
+        print(f"[form_cache] hit jaccard={best[0]:.2f} key={key}")
+        if not entry.greeted:
+            return entry.questions
+        return self._greet(form.get("name")) + entry.questions
+
+    def add(self, form: dict, out: str) -> None:
+        low = out.lower()
+        if any(x in low for x in _NO_CACHE) or "?" not in out:
+            return
+        key, sh = self._features(form)
+        if not sh:
+            return
+        questions, greeted = _GREETING.subn("", out, count=1)
+        if _identifying(form, questions):
+            return
+        bands = self._band_keys(key, minhash(sh))
+        with self._lock:
+            eid = self._next_id
+            self._next_id += 1
+            self._entries[eid] = _Entry(sh, bands, questions.lstrip(), bool(greeted))
+            for bk in bands:
+                self._buckets.setdefault(bk, set()).add(eid)
+            while len(self._entries) > self.max_entries:
+                old_id, old = self._entries.popitem(last=False)
+                for bk in old.bands:
+                    b = self._buckets.get(bk)
+                    if b is not None:
+                        b.discard(old_id)
+                        if not b:
+                            del self._buckets[bk]
+
+    @staticmethod
+    def _greet(name: Optional[str]) -> str:
+        name = (name or "").strip()
+        return f"Merhaba {name}, geçmiş olsun. " if name else "Merhaba, geçmiş olsun. "
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+form_cache = FormCache()
@@ -0,0 +1,115 @@
+# app/services/jobs.py
+# Uzun süren tekil LLM değerlendirmeleri (/labs/final, /assessment/expert) için
+# yerel iş kuyruğu. ?async=1 ile gelen istek hemen job id alır; sınırlı bir thread
+# havuzu işi yürütür ve sonucu oturuma (store.add_turn / set_stage) yazar.
+# Aynı istek anahtarıyla gelen tekrarlar (proxy timeout sonrası retry) mevcut işe bağlanır.
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+from uuid import uuid4
+
+from app.models import JobStatus
+from app.settings import settings
+
+
+def request_key(sess_id: str, kind: str, body: Any, idempotency_key: str | None = None) -> str:
+    """Idempotency-Key header'ı varsa o, yoksa gövdenin kanonik JSON özeti (oturum kapsamlı)."""
+    if idempotency_key:
+        raw = f"{sess_id}|{kind}|key|{idempotency_key}"
+    else:
+        raw = f"{sess_id}|{kind}|body|" + json.dumps(body, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Job:
+    def __init__(self, kind: str, sess_id: str, key: str) -> None:
+        self.id = uuid4().hex
+        self.kind = kind
+        self.session_id = sess_id
+        self.key = key
+        self.status = "queued"
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def to_status(self) -> JobStatus:
+        return JobStatus(
+            job_id=self.id, kind=self.kind, status=self.status,  # type: ignore[arg-type]
+            created_at=self.created_at, finished_at=self.finished_at,
+            result=self.result, error=self.error,
+        )
+
+
+class JobPool:
+    def __init__(self, workers: int | None = None, max_pending: int | None = None) -> None:
+        self.workers = max(1, int(workers or settings.JOB_WORKERS))
+        self.max_pending = int(max_pending or settings.JOB_MAX_PENDING)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._jobs: Dict[str, Job] = {}
+        self._by_key: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        return self._executor
+
+    def submit(self, kind: str, sess_id: str, key: str, fn: Callable[[], Dict[str, Any]]) -> Job:
+        """
+        Aynı anahtarlı canlı (kuyrukta / çalışan / tamamlanmış) iş varsa onu döndürür;
+        başarısız işler yeniden denenebilir. Kuyruk doluysa OverflowError.
+        """
+        with self._lock:
+            jid = self._by_key.get(key)
+            existing = self._jobs.get(jid) if jid else None
+            if existing is not None and existing.status != "failed":
+                return existing
+            pending = sum(1 for j in self._jobs.values() if not j.finished)
+            if pending >= self.max_pending:
+                raise OverflowError("İş kuyruğu dolu")
+            job = Job(kind, sess_id, key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+        self._pool().submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn: Callable[[], Dict[str, Any]]) -> None:
+        job.status = "running"
+        try:
+            job.result = fn()
+            job.status = "completed"
+        except Exception as e:
+            print(f"[jobs] {job.kind} {job.id} failed:", e)
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = datetime.utcnow()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def sweep(self) -> None:
+        """Bitmiş ve TTL'i dolmuş işleri temizle."""
+        cutoff = datetime.utcnow() - timedelta(seconds=int(settings.JOB_TTL))
+        with self._lock:
+            for job in [j for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+                self._jobs.pop(job.id, None)
+                if self._by_key.get(job.key) == job.id:
+                    del self._by_key[job.key]
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+jobs = JobPool()
@@ -0,0 +1,307 @@
+# app/services/lab_history.py
+# Hasta referansı (patientRef) başına uzunlamasına tahlil indeksi.
+# Her (hasta, analit) serisi sütunlar halinde tutulur: gün (ordinal), değer,
+# durum. Ekleme anında son değer / önceki değer / fark / trend yönü / son
+# anormal tarih önceden hesaplanır; lab promptlarına eski raporların ham
+# metni yerine kısa bir trend özeti girer. Oturum TTL'inden bağımsızdır ve
+# LAB_HISTORY_PATH verilirse diske yazılır.
+# patientRef'ler sahibine (klinik ya da oturum) bağlıdır: okuma ve yazma her
+# zaman (sahip, ref) çiftiyle yapılır; başka bir sahip aynı ref'i bilse de
+# yalnızca kendi (boş) serisini görür.
+# Oturum sahipli seriler ("session:<sid>") ayrı tutulur: diske yazılmaz,
+# LAB_HISTORY_MAX_PATIENTS sınırına sayılmaz (anonim trafik klinik geçmişini
+# tahliye edemez) ve oturum store'dan düşünce sweep() ile silinir.
+from __future__ import annotations
+
+import marshal
+import os
+import re
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.settings import settings
+
+_STATUS = {"low": -1, "normal": 0, "high": 1}
+_STATUS_NAME = {-1: "low", 0: "normal", 1: "high"}
+_UNKNOWN = 2
+_FOLD = str.maketrans({"ç": "c", "ğ": "g", "ı": "i", "İ": "i", "ö": "o", "ş": "s", "ü": "u"})
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+_TREND_WINDOW = 5
+_STABLE_PCT = 5.0
+_MAGIC = b"MDVLABH1"
+_SEP = "\x1f"
+_SESSION_OWNER = "session:"
+
+
+def _key(owner: str, ref: str) -> str:
+    return f"{owner}{_SEP}{ref}"
+
+
+def analyte_key(name: str) -> str:
+    """'Hemoglobin (HGB)', 'hemoglobin hgb' -> 'hemoglobinhgb'"""
+    return _NON_ALNUM.sub("", (name or "").translate(_FOLD).lower())
+
+
+def _parse_day(v: Any) -> Optional[int]:
+    """ISO ('2026-04-02') ya da TR ('02.04.2026') -> date.toordinal(); boş / okunamazsa None."""
+    if isinstance(v, (date, datetime)):
+        return v.toordinal()
+    s = str(v or "").strip()[:10]
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(s, fmt).toordinal()
+        except ValueError:
+            continue
+    return None
+
+
+def _iso(day: int) -> str:
+    return date.fromordinal(day).isoformat()
+
+
+def _num(v: float, sign: bool = False) -> str:
+    """Değer olduğu gibi (':g' 6 basamağa yuvarlar: 250000 -> 2.5e+05); tam sayılar noktasız."""
+    s = str(int(v)) if v.is_integer() and abs(v) < 1e15 else repr(v)
+    return f"+{s}" if sign and v >= 0 else s
+
+
+class _Series:
+    __slots__ = ("name", "unit", "range", "days", "values", "status", "summary")
+
+    def __init__(self, name: str, unit: Optional[str]) -> None:
+        self.name = name
+        self.unit = unit
+        self.range: Optional[str] = None
+        self.days = array("i")
+        self.values = array("d")
+        self.status = array("b")
+        self.summary: Dict[str, Any] = {}
+
+    def add(self, day: int, value: float, status: int, max_points: int) -> bool:
+        # Aynı gün aynı değer: aynı raporun tekrar yüklenmesi
+        for i in range(len(self.days) - 1, -1, -1):
+            if self.days[i] == day and self.values[i] == value:
+                return False
+            if self.days[i] < day:
+                break
+        # tarih sırasını koru (geçmiş raporlar sonradan gelebilir)
+        i = len(self.days)
+        while i > 0 and self.days[i - 1] > day:
+            i -= 1
+        self.days.insert(i, day)
+        self.values.insert(i, value)
+        self.status.insert(i, status)
+        if len(self.days) > max_points:
+            drop = len(self.days) - max_points
+            del self.days[:drop], self.values[:drop], self.status[:drop]
+        self._summarize()
+        return True
+
+    def _summarize(self) -> None:
+        n = len(self.values)
+        last = self.values[-1]
+        s: Dict[str, Any] = {
+            "name": self.name, "unit": self.unit, "points": n,
+            "last": last, "last_date": _iso(self.days[-1]),
+            "last_status": _STATUS_NAME.get(self.status[-1]),
+            "prev": None, "prev_date": None, "delta": None, "delta_pct": None,
+            "trend": None, "last_abnormal": None,
+        }
+        if n >= 2:
+            prev = self.values[-2]
+            s["prev"], s["prev_date"] = prev, _iso(self.days[-2])
+            s["delta"] = round(last - prev, 4)
+            s["delta_pct"] = round((last - prev) / abs(prev) * 100, 1) if prev else None
+            s["trend"] = self._trend()
+        for i in range(n - 1, -1, -1):
+            if self.status[i] in (-1, 1):
+                s["last_abnormal"] = _iso(self.days[i])
+                break
+        self.summary = s
+
+    def _trend(self) -> str:
+        """Son birkaç noktanın eğimi, ortalamaya göre %'si küçükse 'stable'."""
+        xs = self.days[-_TREND_WINDOW:]
+        ys = self.values[-_TREND_WINDOW:]
+        n = len(xs)
+        mx, my = sum(xs) / n, sum(ys) / n
+        var = sum((x - mx) ** 2 for x in xs)
+        if var == 0 or my == 0:
+            change = ys[-1] - ys[0]
+        else:
+            change = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / var * (xs[-1] - xs[0])
+        pct = abs(change) / abs(my) * 100 if my else abs(change)
+        if pct < _STABLE_PCT:
+            return "stable"
+        return "up" if change > 0 else "down"
+
+    # --------- kalıcılık ----------
+    def to_state(self) -> tuple:
+        return (self.name, self.unit, self.range,
+                self.days.tobytes(), self.values.tobytes(), self.status.tobytes())
+
+    @classmethod
+    def from_state(cls, st: tuple) -> "_Series":
+        s = cls(st[0], st[1])
+        s.range = st[2]
+        s.days.frombytes(st[3])
+        s.values.frombytes(st[4])
+        s.status.frombytes(st[5])
+        if len(s.days):
+            s._summarize()
+        return s
+
+
+_TREND_TR = {"up": "artış", "down": "düşüş", "stable": "stabil"}
+
+
+class LabHistoryIndex:
+    def __init__(self, path: str | None = None) -> None:
+        self.path = settings.LAB_HISTORY_PATH if path is None else path
+        self.max_points = settings.LAB_HISTORY_MAX_POINTS
+        self.max_patients = settings.LAB_HISTORY_MAX_PATIENTS
+        # patientRef -> {analyte_key: _Series}; LRU sırası
+        self._patients: "OrderedDict[str, Dict[str, _Series]]" = OrderedDict()
+        # oturum sahipli seriler: aynı yapı, kalıcı değil, LRU sınırı yok
+        self._ephemeral: Dict[str, Dict[str, _Series]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    # --------- yazma ----------
+    def ingest(self, owner: str, ref: str, rows: Iterable[Dict[str, Any]] | None, day: Any = None) -> int:
+        """
+        Normalize LabValue satırlarını sahibin hastasına ekler; eklenen nokta sayısını döndürür.
+        Tarih satırın numune tarihinden ya da `day`den (rapor tarihi) gelir; ikisi de yoksa
+        satır seriye girmez (eski raporun yeniden yüklenmesi bugüne sahte nokta üretmesin).
+        """
+        ref = _key(owner, ref)
+        scoped = not owner.startswith(_SESSION_OWNER)
+        report_day = _parse_day(day)
+        points: List[tuple] = []
+        for r in rows or []:
+            v = r.get("value")
+            key = analyte_key(r.get("name") or "")
+            d = _parse_day(r.get("date")) or report_day
+            if key and isinstance(v, (int, float)) and d is not None:
+                points.append((key, r, d, float(v)))
+        if not points:
+            return 0
+        added = 0
+        with self._lock:
+            bucket = self._patients if scoped else self._ephemeral
+            series = bucket.get(ref)
+            if series is None:
+                series = bucket[ref] = {}
+            if scoped:
+                self._patients.move_to_end(ref)
+            for key, r, d, v in points:
+                s = series.get(key)
+                if s is None:
+                    s = series[key] = _Series(r.get("name"), r.get("unit"))
+                s.unit = r.get("unit") or s.unit
+                s.range = r.get("normalRange") or s.range
+                if s.add(d, v, _STATUS.get(r.get("status"), _UNKNOWN), self.max_points):
+                    added += 1
+            while len(self._patients) > self.max_patients:
+                self._patients.popitem(last=False)
+            self._dirty = self._dirty or (scoped and added > 0)
+        return added
+
+    def sweep(self, alive: Callable[[str], bool]) -> None:
+        """Oturumu artık olmayan (alive(sid) False) oturum sahipli serileri bırak."""
+        with self._lock:
+            keys = list(self._ephemeral)
+        dead = [k for k in keys if not alive(k.split(_SEP, 1)[0][len(_SESSION_OWNER):])]
+        if dead:
+            with self._lock:
+                for k in dead:
+                    self._ephemeral.pop(k, None)
+
+    # --------- okuma ----------
+    def _series(self, owner: str, ref: str) -> Dict[str, _Series]:
+        """self._lock altında."""
+        bucket = self._ephemeral if owner.startswith(_SESSION_OWNER) else self._patients
+        return bucket.get(_key(owner, ref)) or {}
+
+    def trends(self, owner: str, ref: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            series = self._series(owner, ref)
+            return [dict(s.summary) for s in series.values() if s.summary]
+
+    def summary(self, owner: str, ref: str | None, only: Iterable[str] | None = None, limit: int = 20) -> str:
+        """
+        Prompt için kompakt trend özeti (yalnızca en az iki ölçümü olan analitler):
+        `Ad: son birim (tarih) <- önceki (tarih), Δ fark (%), yön; son anormal tarih | ...`
+        """
+        if not ref:
+            return "—"
+        keys = {analyte_key(x) for x in only} if only else None
+        parts: List[str] = []
+        with self._lock:
+            series = self._series(owner, ref)
+            for key, s in series.items():
+                t = s.summary
+                if not t or t["points"] < 2 or (keys is not None and key not in keys):
+                    continue
+                unit = f" {t['unit']}" if t["unit"] else ""
+                line = (f"{t['name']}: {_num(t['last'])}{unit} ({t['last_date']}) <- "
+                        f"{_num(t['prev'])} ({t['prev_date']}), Δ{_num(t['delta'], sign=True)}")
+                if t["delta_pct"] is not None:
+                    line += f" ({t['delta_pct']:+g}%)"
+                line += f", {_TREND_TR.get(t['trend'], '-')}"
+                if t["last_abnormal"]:
+                    line += f"; son anormal {t['last_abnormal']}"
+                parts.append(line)
+                if len(parts) >= limit:
+                    break
+        return " | ".join(parts) if parts else "—"
+
+    # --------- kalıcılık ----------
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {ref: {k: s.to_state() for k, s in series.items()}
+                     for ref, series in self._patients.items()}
+            self._dirty = False
+        raw = _MAGIC + zlib.compress(marshal.dumps(state), 1)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        print(f"[lab_history] {len(state)} hasta yazıldı -> {self.path}")
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            if not raw.startswith(_MAGIC):
+                raise ValueError("Geçersiz lab geçmişi dosyası")
+            state = marshal.loads(zlib.decompress(raw[len(_MAGIC):]))
+        except Exception as e:
+            print("[lab_history] load failed:", e)
+            return
+        legacy = 0
+        with self._lock:
+            for ref, series in state.items():
+                if _SEP not in ref or ref.startswith(_SESSION_OWNER):
+                    # sahipsiz eski kayıt ya da önceki sürümün yazdığı oturum serisi: yüklenmez
+                    legacy += 1
+                    continue
+                self._patients[ref] = {k: _Series.from_state(st) for k, st in series.items()}
+        print(f"[lab_history] {len(state) - legacy} hasta yüklendi <- {self.path}"
+              + (f" ({legacy} sahipsiz / oturum kaydı atlandı)" if legacy else ""))
+
+
+lab_history = LabHistoryIndex()
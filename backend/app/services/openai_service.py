@@ -1,18 +1,279 @@
-from openai import OpenAI
-from app.settings import settings
+import json
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple, get_args
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+from app.models import Stage
+from app.settings import settings, StageRoute
+from app.services.cassette import cassette
+from app.services.usage import usage, approx_tokens, estimate_call
 
-def complete(system: str, user: str, model: str | None = None, temperature: float = 0.2) -> str:
+# openai paketi ağır (~0.4 s import): istemci ilk LLM çağrısında ya da
+# startup sonrası arka planda (warm_up) kurulur; /health bunu beklemez.
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    return _client
+
+def __getattr__(name: str):
+    # Eski "openai_service.client" erişimleri için
+    if name == "client":
+        return get_client()
+    raise AttributeError(name)
+
+def warm_up() -> None:
+    """Ağır bağımlılıkları önceden yükle (startup'ta thread'de çağrılır)."""
+    try:
+        get_client()
+        import PyPDF2  # noqa: F401
+    except Exception as e:
+        print("[openai] warm-up failed:", e)
+
+_unknown = set(settings.STAGE_ROUTES) - set(get_args(Stage))
+if _unknown:
+    print("[openai] STAGE_ROUTES içinde bilinmeyen stage(ler):", sorted(_unknown))
+
+def route_for(stage: Stage | None) -> StageRoute:
+    return settings.STAGE_ROUTES.get(stage or "", StageRoute())
+
+def _upstream_stops(stop: List[str]) -> List[str]:
+    # Upstream eşleşen stop metnini çıktıdan atar. "[İŞARET]" biçimindeki
+    # işaretlerin çıktıda kalması için stop olarak "İŞARET]" gönderilir;
+    # çıktıda kalan "[" sonradan tamamlanır (bkz. _restore_marker).
+    return [x[1:] if x.startswith("[") and len(x) > 1 else x for x in stop]
+
+def _restore_marker(content: str, stop: List[str], finish_reason: str | None) -> str:
+    if finish_reason != "stop" or not content.endswith("["):
+        return content
+    for x in stop:
+        if x.startswith("[") and len(x) > 1:
+            return content + x[1:]
+    return content
+
+def complete(
+    system: str,
+    user: str,
+    model: str | None = None,
+    temperature: float = 0.2,
+    stage: Stage | None = None,
+    max_tokens: int | None = None,
+    stop: List[str] | None = None,
+    on_token: Callable[[str], None] | None = None,
+    session_id: str | None = None,
+    batch: bool = False,
+) -> str:
     """
-    Basit chat completion. Stream gerekirse burada genişletebilirsin.
+    Basit chat completion. on_token verilirse yanıt stream edilir ve her parça
+    geldikçe çağrılır (WebSocket sohbet); dönüş değeri yine tam metindir.
+    stage verilirse model / max_tokens / stop settings.STAGE_ROUTES'tan gelir
+    (açık parametreler önceliklidir) ve gecikme stage bazında kaydedilir.
+    LLM_CASSETTE_MODE=record/replay ile çağrılar kasete yazılır / kasetten verilir.
+    Token kullanımı usage defterine (stage / model / session_id) yazılır; TPM kotası
+    aşılacaksa upstream'e gidilmeden QuotaExceeded fırlatılır. batch=True (toplu işler)
+    global kotanın yalnızca TPM_BATCH_SHARE payını kullanır.
     """
-    response = client.chat.completions.create(
-        model=model or settings.OPENAI_MODEL,
+    route = route_for(stage)
+    model = model or route.model or settings.OPENAI_MODEL
+    max_tokens = max_tokens if max_tokens is not None else route.max_tokens
+    stop = stop if stop is not None else route.stop
+
+    kwargs: Dict = {}
+    if max_tokens:
+        kwargs["max_tokens"] = max_tokens
+    if stop:
+        kwargs["stop"] = _upstream_stops(stop)
+
+    # kasetten verilen yanıt upstream kullanmaz
+    reserved = None
+    if not cassette.replaying:
+        reserved = usage.reserve(session_id, estimate_call(system, user, max_tokens), batch=batch)
+
+    t0 = time.perf_counter()
+    tokens: Optional[Tuple[int, int]] = None
+    content: Optional[str] = None
+    try:
+        if cassette.replaying:
+            content, finish_reason = cassette.replay(system, user, model, temperature)
+            if on_token:
+                for i in range(0, len(content), _REPLAY_CHUNK):
+                    on_token(content[i:i + _REPLAY_CHUNK])
+        elif on_token:
+            content, finish_reason, tokens = _stream(system, user, model, temperature, kwargs, on_token)
+            if cassette.recording:
+                cassette.record(system, user, model, temperature, content, finish_reason,
+                                time.perf_counter() - t0, stage)
+        else:
+            response = get_client().chat.completions.create(
+                model=model,
+                temperature=temperature,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": user},
+                ],
+                **kwargs,
+            )
+            choice = response.choices[0]
+            content, finish_reason = choice.message.content or "", choice.finish_reason
+            if getattr(response, "usage", None):
+                tokens = (response.usage.prompt_tokens, response.usage.completion_tokens)
+            if cassette.recording:
+                cassette.record(system, user, model, temperature, content, finish_reason,
+                                time.perf_counter() - t0, stage)
+    finally:
+        latency.record(stage or "-", model, time.perf_counter() - t0)
+        if reserved is not None:
+            if content is None:
+                usage.release(session_id, reserved)
+            else:
+                estimated = tokens is None
+                if estimated:
+                    tokens = (approx_tokens(system) + approx_tokens(user), approx_tokens(content))
+                usage.settle(session_id, stage or "-", model, reserved, tokens[0], tokens[1], estimated)
+
+    content = content.strip()
+    if stop:
+        content = _restore_marker(content, stop, finish_reason)
+    return content
+
+_REPLAY_CHUNK = 16
+
+def _stream(system: str, user: str, model: str, temperature: float, kwargs: Dict,
+            on_token: Callable[[str], None]) -> Tuple[str, Optional[str], Optional[Tuple[int, int]]]:
+    parts: List[str] = []
+    finish_reason: Optional[str] = None
+    tokens: Optional[Tuple[int, int]] = None
+    stream = get_client().chat.completions.create(
+        model=model,
         temperature=temperature,
         messages=[
             {"role": "system", "content": system},
             {"role": "user", "content": user},
         ],
+        stream=True,
+        stream_options={"include_usage": True},   # son olayda usage gelir (choices boş)
+        **kwargs,
+    )
+    try:
+        for event in stream:
+            if getattr(event, "usage", None):
+                tokens = (event.usage.prompt_tokens, event.usage.completion_tokens)
+            if not event.choices:
+                continue
+            choice = event.choices[0]
+            delta = choice.delta.content if choice.delta else None
+            if delta:
+                parts.append(delta)
+                on_token(delta)   # istemci koptuysa fırlatır; akış aşağıda kapanır
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    return "".join(parts), finish_reason, tokens
+
+# ---------------- stage gecikme istatistikleri ----------------
+
+class LatencyStats:
+    """Stage başına son N çağrının gecikmesi (routing tablosunu ayarlamak için)."""
+
+    def __init__(self, window: int = 200) -> None:
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._models: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, model: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+            self._models[stage] = model
+
+    def snapshot(self) -> Dict[str, Dict]:
+        out: Dict[str, Dict] = {}
+        with self._lock:
+            items = [(k, sorted(v)) for k, v in self._samples.items()]
+        for stage, xs in items:
+            if not xs:
+                continue
+            out[stage] = {
+                "model": self._models.get(stage),
+                "count": self._counts.get(stage, 0),
+                "p50_ms": round(xs[len(xs) // 2] * 1000, 1),
+                "p95_ms": round(xs[min(len(xs) - 1, int(len(xs) * 0.95))] * 1000, 1),
+                "max_ms": round(xs[-1] * 1000, 1),
+            }
+        return out
+
+latency = LatencyStats()
+
+# ---------------- upstream batch (offline işler) ----------------
+
+_BATCH_PENDING = ("validating", "in_progress", "finalizing")
+
+def submit_batch(requests: List[Dict], model: str | None = None, stage: Stage | None = None) -> str:
+    """
+    Chat completion isteklerini upstream Batch API'ye gönderir.
+    requests: [{"custom_id", "system", "user", "temperature"?}, ...] -> upstream batch id
+    """
+    route = route_for(stage)
+    lines = []
+    for r in requests:
+        body: Dict = {
+            "model": model or route.model or settings.OPENAI_MODEL,
+            "temperature": r.get("temperature", 0.2),
+            "messages": [
+                {"role": "system", "content": r["system"]},
+                {"role": "user", "content": r["user"]},
+            ],
+        }
+        # stop gönderilmez: offline işte erken durmanın gecikme kazancı yok
+        if route.max_tokens:
+            body["max_tokens"] = route.max_tokens
+        lines.append(json.dumps({
+            "custom_id": r["custom_id"],
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body,
+        }, ensure_ascii=False))
+    payload = "\n".join(lines).encode("utf-8")
+    client = get_client()
+    f = client.files.create(file=("batch.jsonl", payload), purpose="batch")
+    b = client.batches.create(
+        input_file_id=f.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
     )
-    return response.choices[0].message.content.strip()
\ No newline at end of file
+    return b.id
+
+def fetch_batch(batch_id: str) -> Optional[Dict[str, Optional[str]]]:
+    """
+    Upstream batch sonucunu okur.
+    Henüz bitmediyse None; bittiyse {custom_id: içerik | None} döner.
+    """
+    client = get_client()
+    b = client.batches.retrieve(batch_id)
+    if b.status in _BATCH_PENDING:
+        return None
+    if b.status != "completed" or not b.output_file_id:
+        raise Exception(f"Upstream batch {b.status}")
+
+    out: Dict[str, Optional[str]] = {}
+    for line in client.files.content(b.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        rec = json.loads(line)
+        body = (rec.get("response") or {}).get("body") or {}
+        choices = body.get("choices") or []
+        content = (choices[0].get("message") or {}).get("content") if choices else None
+        out[rec["custom_id"]] = content.strip() if content else None
+    return out
@@ -1,25 +1,126 @@
 # app/services/pdf_service.py
-import PyPDF2
 import io
-from typing import Optional
+import re
+from typing import Callable, Dict, Iterator, List, Optional
 
-def extract_text_from_pdf(file_content: bytes) -> str:
+from app.settings import settings
+
+# ---------------- backend'ler ----------------
+# Her backend PDF baytlarından sayfa metinlerini tembel (sayfa sayfa) üretir;
+# erken durma / sayfa sınırı çağıranın döngüsünde uygulanır. Motorlar ilk
+# kullanımda import edilir (soğuk başlatmada PDF kütüphanesi yüklenmez).
+
+def _pages_pypdf2(file_content: bytes) -> Iterator[str]:
+    import PyPDF2
+    reader = PyPDF2.PdfReader(io.BytesIO(file_content))
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+def _pages_pypdfium2(file_content: bytes) -> Iterator[str]:
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(file_content)
+    try:
+        for i in range(len(pdf)):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            try:
+                yield textpage.get_text_range() or ""
+            finally:
+                textpage.close()
+                page.close()
+    finally:
+        pdf.close()
+
+def _pages_pdfminer(file_content: bytes) -> Iterator[str]:
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+    for layout in extract_pages(io.BytesIO(file_content)):
+        yield "".join(el.get_text() for el in layout if isinstance(el, LTTextContainer))
+
+BACKENDS: Dict[str, Callable[[bytes], Iterator[str]]] = {
+    "pypdf2": _pages_pypdf2,
+    "pypdfium2": _pages_pypdfium2,
+    "pdfminer": _pages_pdfminer,
+}
+
+_MODULES = {"pypdf2": "PyPDF2", "pypdfium2": "pypdfium2", "pdfminer": "pdfminer"}
+_available: Dict[str, bool] = {}
+
+def _backend_available(name: str) -> bool:
+    if name not in _available:
+        try:
+            __import__(_MODULES[name])
+            _available[name] = True
+        except ImportError:
+            print(f"[pdf] '{name}' backend kurulu değil, PyPDF2 kullanılacak")
+            _available[name] = False
+    return _available[name]
+
+def _resolve_backend(name: Optional[str]) -> str:
+    name = (name or settings.PDF_BACKEND or "pypdf2").lower()
+    if name not in BACKENDS:
+        print(f"[pdf] bilinmeyen backend '{name}', PyPDF2 kullanılacak")
+        return "pypdf2"
+    if name != "pypdf2" and not _backend_available(name):
+        return "pypdf2"
+    return name
+
+# ---------------- tahlil tablosu tespiti ----------------
+
+_RANGE = re.compile(r"\d+(?:[.,]\d+)?\s*[-–]\s*\d+(?:[.,]\d+)?")
+_UNIT = re.compile(r"(mg/dl|g/dl|u/l|iu/l|mmol/l|µmol/l|umol/l|ng/ml|pg/ml|µiu/ml|uiu/ml|miu/ml|10\^\d|/µl|/ul|fl\b|pg\b|%)", re.I)
+_NUMBER = re.compile(r"\d")
+LAB_PAGE_MIN_ROWS = 3
+
+def _is_lab_page(text: str) -> bool:
+    """Sayfada en az birkaç 'değer + birim/referans aralığı' satırı var mı?"""
+    rows = 0
+    for line in text.splitlines():
+        if _NUMBER.search(line) and (_RANGE.search(line) or _UNIT.search(line)):
+            rows += 1
+            if rows >= LAB_PAGE_MIN_ROWS:
+                return True
+    return False
+
+# ---------------- çıkarma ----------------
+
+def extract_text_from_pdf(
+    file_content: bytes,
+    backend: Optional[str] = None,
+    max_pages: Optional[int] = None,
+    early_stop: Optional[int] = None,
+) -> str:
     """
     PDF dosyasından text çıkarır.
+    Sayfalar tembel okunur ve en fazla PDF_MAX_PAGES sayfa okunur. early_stop=N
+    (PDF_EARLY_STOP, varsayılan kapalı) verilirse tahlil tablosu görüldükten sonra
+    art arda N tablosuz sayfa gelince durulur; okunan sayfaların hepsi döner.
     """
+    name = _resolve_backend(backend)
+    max_pages = settings.PDF_MAX_PAGES if max_pages is None else max_pages
+    early_stop = settings.PDF_EARLY_STOP if early_stop is None else early_stop
+    pages = BACKENDS[name](file_content)
     try:
-        pdf_file = io.BytesIO(file_content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        text = ""
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text += page.extract_text() + "\n"
-        
-        return text.strip()
-    
+        parts: List[str] = []
+        seen_lab = False
+        since_lab = 0   # son tahlil sayfasından beri art arda tablosuz sayfa
+        for page_text in pages:
+            parts.append(page_text)
+            if max_pages and len(parts) >= max_pages:
+                break
+            if early_stop:
+                if _is_lab_page(page_text):
+                    seen_lab, since_lab = True, 0
+                elif seen_lab:
+                    since_lab += 1
+                    if since_lab >= early_stop:
+                        break
+        return "\n".join(parts).strip()
+
     except Exception as e:
         raise Exception(f"PDF okuma hatası: {str(e)}")
+    finally:
+        pages.close()
 
 def extract_text_from_upload(file_content: bytes, filename: str) -> str:
     """
@@ -27,5 +128,5 @@ def extract_text_from_upload(file_content: bytes, filename: str) -> str:
     """
     if not filename.lower().endswith('.pdf'):
         raise Exception("Sadece PDF dosyaları desteklenir")
-    
+
     return extract_text_from_pdf(file_content)
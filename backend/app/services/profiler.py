@@ -0,0 +1,126 @@
+# app/services/profiler.py
+# Event loop gecikme bekçisi ve istek üzerine çalışan istatistiksel örnekleyici.
+#
+# LoopWatchdog: loop içindeki bir görev her aralıkta nabız atar; ayrı bir thread
+#   nabız gecikince loop thread'inin o anki yığınını (loop'u bloklayan kod) yakalar.
+# StackSampler: yalnızca /debug/profile çağrıldığında N saniye boyunca tüm
+#   thread'lerin yığınlarını örnekler ve flamegraph uyumlu "collapsed" çıktı üretir.
+#   Boştayken hiçbir maliyeti yoktur.
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional
+
+from app.settings import settings
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+# ---------------- event loop gecikme bekçisi ----------------
+
+class LoopWatchdog:
+    def __init__(self, threshold_ms: int | None = None, keep: int = 20) -> None:
+        self.threshold = (settings.LOOP_LAG_THRESHOLD_MS if threshold_ms is None else threshold_ms) / 1000
+        self.interval = max(0.01, self.threshold / 2)
+        self.incidents: Deque[Dict] = deque(maxlen=keep)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = now - expected
+            if lag > self.max_lag:
+                self.max_lag = lag
+            self._beat = now
+
+    def _monitor(self) -> None:
+        reported = 0.0   # aynı takılma için tek kayıt
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            lag = time.monotonic() - beat - self.interval
+            if lag < self.threshold or beat == reported:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = traceback.format_stack(frame) if frame is not None else []
+            self.stalls += 1
+            self.incidents.append({
+                "at": time.time(),
+                "lag_ms": round(lag * 1000, 1),
+                "stack": [ln.rstrip() for ln in stack[-12:]],
+            })
+            print(f"[loopwatch] event loop {lag * 1000:.0f} ms bloklandı:\n" + "".join(stack[-6:]))
+
+    def start(self) -> Optional[asyncio.Task]:
+        """Startup hook'unda (event loop içinde) çağrılır; eşik 0 ise kapalı."""
+        if self.threshold <= 0:
+            return None
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        threading.Thread(target=self._monitor, name="loopwatch", daemon=True).start()
+        return asyncio.create_task(self._heartbeat())
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        return {
+            "threshold_ms": round(self.threshold * 1000),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls,
+            "incidents": list(self.incidents),
+        }
+
+
+# ---------------- istatistiksel örnekleyici ----------------
+
+class StackSampler:
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self._busy = threading.Lock()
+
+    def run(self, seconds: float) -> str:
+        """
+        seconds boyunca tüm thread'leri örnekler (çağıran thread hariç).
+        Çıktı: "thread;kök;...;yaprak adet" satırları (flamegraph.pl / speedscope).
+        """
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("Profil zaten çalışıyor")
+        try:
+            me = threading.get_ident()
+            counts: Counter = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for tid, frame in sys._current_frames().items():
+                    if tid == me:
+                        continue
+                    stack: List[str] = []
+                    while frame is not None:
+                        stack.append(_frame_label(frame))
+                        frame = frame.f_back
+                    stack.append(names.get(tid, str(tid)))
+                    counts[";".join(reversed(stack))] += 1
+                time.sleep(self.interval)
+            return "\n".join(f"{k} {v}" for k, v in counts.most_common())
+        finally:
+            self._busy.release()
+
+
+watchdog = LoopWatchdog()
+sampler = StackSampler()
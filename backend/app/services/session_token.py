@@ -0,0 +1,130 @@
+# app/services/session_token.py
+# Stateless mod: oturumun tamamı (profil, stage, geçmiş) sıkıştırılmış ve
+# HMAC-SHA256 ile imzalanmış bir token olarak istemciyle taşınır.
+#   v1.<base64url(zlib(marshal(oturum)))>.<base64url(hmac)>
+# İstemci token'ı X-Session-Token ile geri gönderir; herhangi bir instance
+# store araması / sticky routing olmadan isteği karşılayabilir. Token
+# SESSION_TOKEN_MAX_BYTES'ı aşarsa (büyük lab oturumları) verilmez ve
+# istemci X-Session-Id ile sunucu tarafı store'a döner.
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import secrets
+from datetime import datetime, timedelta
+from typing import Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.models import Session
+from app.services.snapshot import session_from_record
+from app.settings import settings
+from app.store import store
+
+VERSION = "v1"
+TOKEN_HEADER = "X-Session-Token"
+MODE_HEADER = "X-Session-Mode"
+
+
+class TokenError(Exception):
+    pass
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _unb64(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+_key: Optional[bytes] = None
+
+
+def _secret() -> bytes:
+    global _key
+    if _key is None:
+        if settings.SESSION_TOKEN_SECRET:
+            _key = settings.SESSION_TOKEN_SECRET.encode("utf-8")
+        else:
+            # Tek instance'ta çalışır; yatay ölçekte tüm instance'lara aynı secret verilmeli
+            print("[session_token] SESSION_TOKEN_SECRET yok, süreç başına rastgele anahtar kullanılıyor")
+            _key = secrets.token_bytes(32)
+    return _key
+
+
+def _sign(payload: str) -> bytes:
+    return hmac.new(_secret(), f"{VERSION}.{payload}".encode("ascii"), hashlib.sha256).digest()
+
+
+def encode(record: bytes) -> str:
+    payload = _b64(record)
+    return f"{VERSION}.{payload}.{_b64(_sign(payload))}"
+
+
+def decode(token: str) -> Session:
+    """İmzayı doğrular (kayıt ancak bundan sonra açılır) ve süresi dolmuşsa reddeder."""
+    try:
+        version, payload, mac = token.strip().split(".")
+    except ValueError:
+        raise TokenError("Geçersiz session token")
+    if version != VERSION:
+        raise TokenError("Desteklenmeyen session token sürümü")
+    try:
+        ok = hmac.compare_digest(_unb64(mac), _sign(payload))
+    except (ValueError, TypeError):
+        ok = False
+    if not ok:
+        raise TokenError("Session token imzası geçersiz")
+    try:
+        s = session_from_record(_unb64(payload))
+    except Exception:
+        raise TokenError("Session token çözülemedi")
+    if datetime.utcnow() - s.last_used_at > timedelta(seconds=int(settings.SESSION_TTL)):
+        raise TokenError("Session token süresi doldu")
+    return s
+
+
+def issue(sid: str) -> Optional[str]:
+    """Güncel oturum için token; boyut sınırını aşarsa None (sunucu tarafı moda dönülür)."""
+    record = store.export_record(sid)
+    if record is None:
+        return None
+    token = encode(record)
+    if len(token) > settings.SESSION_TOKEN_MAX_BYTES:
+        return None
+    return token
+
+
+class SessionTokenMiddleware:
+    """
+    Oturuma dokunan her HTTP yanıtına (deps.get_session / POST /sessions
+    scope state'e session_id yazar) yeni token ya da X-Session-Mode: server ekler.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.STATELESS_SESSIONS:
+            await self.app(scope, receive, send)
+            return
+        state = scope.setdefault("state", {})
+
+        async def wrapped(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                sid = state.get("session_id")
+                if sid and message["status"] < 500:
+                    h = MutableHeaders(raw=list(message["headers"]))
+                    token = issue(sid)
+                    if token:
+                        h[TOKEN_HEADER] = token
+                        h[MODE_HEADER] = "token"
+                    else:
+                        h[MODE_HEADER] = "server"
+                    message = {**message, "headers": h.raw}
+            await send(message)
+
+        await self.app(scope, receive, wrapped)
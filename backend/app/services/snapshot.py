@@ -0,0 +1,139 @@
+# app/services/snapshot.py
+# Canlı oturumların ikili snapshot'ı (deploy sırasında kaybolmasınlar diye).
+#
+# Dosya düzeni:
+#   MAGIC
+#   [u32 uzunluk][zlib(marshal(oturum durumu))] ... (oturum başına bir kayıt)
+#   [zlib(marshal({sid: (offset, uzunluk)}))]      (indeks)
+#   [u64 indeks offset][u32 indeks uzunluk] MAGIC   (trailer)
+#
+# Yazma akış halinde (kayıt kayıt) yapılır; okuma mmap + yalnızca indeks,
+# oturumlar ilk erişimde tek tek açılır.
+from __future__ import annotations
+
+import marshal
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.history import CompactHistory
+from app.models import PatientData, Session
+
+MAGIC = b"MDVSNAP1"
+_LEN = struct.Struct("<I")
+_TRAILER = struct.Struct("<QI")
+# Oturum zamanları naive UTC; yerel saat dilimine bağımlı olmamak için elle çevrilir
+_EPOCH = datetime(1970, 1, 1)
+
+
+# ---------------- oturum <-> durum ----------------
+
+def session_to_record(s: Session, patient: Optional[dict] = None) -> bytes:
+    state = {
+        "id": s.id,
+        "created_at": (s.created_at - _EPOCH).total_seconds(),
+        "last_used_at": (s.last_used_at - _EPOCH).total_seconds(),
+        "stage": s.stage,
+        "patient": patient if patient is not None else s.patient.model_dump(exclude_none=True),
+        "history": s.history.to_state(),
+        "profile_version": s.profile_version,
+        "version": s.version,
+    }
+    return zlib.compress(marshal.dumps(state), 1)
+
+def session_from_record(raw: bytes) -> Session:
+    state = marshal.loads(zlib.decompress(raw))
+    return Session.model_construct(
+        id=state["id"],
+        created_at=_EPOCH + timedelta(seconds=state["created_at"]),
+        last_used_at=_EPOCH + timedelta(seconds=state["last_used_at"]),
+        stage=state["stage"],
+        patient=PatientData.model_validate(state["patient"]),
+        history=CompactHistory.from_state(state["history"]),
+        profile_version=state.get("profile_version", 0),
+        version=state.get("version", 0),
+    )
+
+
+# ---------------- yazma ----------------
+
+def write_snapshot(path: str, records: Iterable[Tuple[str, bytes]]) -> int:
+    """
+    (sid, kayıt) çiftlerini akış halinde geçici dosyaya yazar ve atomik olarak
+    yerine koyar. Yazılan oturum sayısını döndürür.
+    """
+    tmp = path + ".tmp"
+    index: Dict[str, Tuple[int, int]] = {}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        for sid, rec in records:
+            f.write(_LEN.pack(len(rec)))
+            index[sid] = (f.tell(), len(rec))
+            f.write(rec)
+        idx = zlib.compress(marshal.dumps(index), 1)
+        idx_off = f.tell()
+        f.write(idx)
+        f.write(_TRAILER.pack(idx_off, len(idx)))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(index)
+
+
+# ---------------- okuma ----------------
+
+class SnapshotReader:
+    """mmap üzerinden tembel okuma; take() bir oturumu indeksten çıkarıp döndürür."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._f = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._f.close()
+            raise
+        mm = self._mm
+        tail = len(MAGIC) + _TRAILER.size
+        if mm[:len(MAGIC)] != MAGIC or mm[-len(MAGIC):] != MAGIC or len(mm) < len(MAGIC) + tail:
+            self.close()
+            raise ValueError("Geçersiz snapshot dosyası")
+        idx_off, idx_len = _TRAILER.unpack(mm[-tail:-len(MAGIC)])
+        self._index: Dict[str, Tuple[int, int]] = marshal.loads(zlib.decompress(mm[idx_off:idx_off + idx_len]))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, sid: str) -> bool:
+        return sid in self._index
+
+    def ids(self) -> list[str]:
+        return list(self._index.keys())
+
+    def raw(self, sid: str) -> Optional[bytes]:
+        loc = self._index.get(sid)
+        if not loc:
+            return None
+        off, n = loc
+        return self._mm[off:off + n]
+
+    def take(self, sid: str) -> Optional[Session]:
+        raw = self.raw(sid)
+        if raw is None:
+            return None
+        self._index.pop(sid, None)
+        return session_from_record(raw)
+
+    def discard(self, sid: str) -> None:
+        self._index.pop(sid, None)
+
+    def close(self) -> None:
+        try:
+            self._mm.close()
+        finally:
+            self._f.close()
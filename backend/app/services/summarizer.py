@@ -1,31 +1,188 @@
 # app/services/summarizer.py
 from __future__ import annotations
-from typing import List, Dict
+import asyncio
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
 
-def summarize_case(patient: Dict, history: List[Dict], max_user_msgs: int = 6) -> str:
+from app.models import Session
+from app.prompts import prompt_case_condense
+from app.services.openai_service import complete
+from app.settings import settings
+from app.store import store
+
+MAX_USER_MSGS = 6
+
+
+def _is_marker(msg: str) -> bool:
+    """'[LAB ANALYSIS REQUEST]', '[INITIAL FORM]\\n{...}' gibi sistem işaretli kullanıcı turları."""
+    first = msg.split("\n", 1)[0].strip()
+    return first.startswith("[") and first.endswith("]")
+
+
+def _render(patient: Dict, user_msgs: List[str]) -> str:
+    info = patient.get("additionalInfo", {}) or {}
+    age = patient.get("age") or "-"
+    gender = patient.get("gender") or "-"
+    symptoms = patient.get("symptoms") or "-"
+    duration = patient.get("duration") or info.get("duration") or "-"
+    notes = patient.get("extra_notes") or info.get("extra_notes") or "-"
+
+    bullets = "\n".join([f"- {m}" for m in user_msgs])
+    lines = [
+        f"Demografi: {age} yaş, {gender}",
+        f"Ana şikayet: {symptoms}",
+        f"Süre: {duration}",
+        f"Ek notlar: {notes}",
+    ]
+    prev = patient.get("previousAnswers")
+    if prev:
+        lines.append(f"Önceki yanıtlar: {'; '.join(str(x) for x in prev)}")
+    lines += ["", "Hasta yanıtları (son mesajlar):", bullets if bullets else "- (yok)"]
+    return "\n".join(lines).strip()
+
+
+def summarize_case(patient: Dict, history: List[Dict], max_user_msgs: int = MAX_USER_MSGS) -> str:
     """
     Basit ama sağlam bir 'Vaka Özeti':
     - Demografi + ana şikayet + süre + önemli notlar
     - Son N kullanıcı mesajını madde madde ekler (tekrarları azaltır)
     """
-    age = patient.get("age", "-")
-    gender = patient.get("gender", "-")
-    symptoms = patient.get("symptoms", "-")
-    duration = patient.get("duration") or (patient.get("additionalInfo", {}) or {}).get("duration", "-")
-    notes = patient.get("extra_notes") or (patient.get("additionalInfo", {}) or {}).get("extra_notes", "-")
+    user_msgs = [h["content"].strip() for h in history if h.get("role") == "user"]
+    user_msgs = [m for m in user_msgs if m and not _is_marker(m)][-max_user_msgs:]
+    return _render(patient, user_msgs)
+
+
+# ---------------------------------------------------------------------
+# Oturum başına artımlı (rolling) vaka özeti — istek yolunun dışında
+# ---------------------------------------------------------------------
+class _CaseState:
+    __slots__ = ("lock", "cursor", "user_msgs", "profile_version", "text", "condensed", "condensed_for")
+
+    def __init__(self) -> None:
+        # oturum başına kilit: bir oturumun yavaş güncellemesi diğerlerini bekletmez
+        self.lock = threading.Lock()
+        self.cursor = 0                      # işlenen tur sayısı
+        self.user_msgs: Deque[str] = deque(maxlen=MAX_USER_MSGS)
+        self.profile_version: Optional[int] = None   # text'in üretildiği profil sürümü
+        self.text: Optional[str] = None
+        self.condensed: Optional[str] = None
+        self.condensed_for: Optional[str] = None     # condensed'in kaynağı olan text
+
+
+class CaseSummaries:
+    """
+    store.add_turn sonrası oturum kuyruğa düşer; event loop'taki worker
+    yalnızca yeni turları işleyerek özeti günceller. get() hazır özeti
+    döndürür, worker geride kaldıysa eksik turları yerinde tamamlar.
+    Store'un dilim kilitleri gibi: self._lock yalnızca _states / _pending
+    sözlüklerini korur, özet güncellemesi oturumun kendi kilidiyle yapılır.
+    """
+
+    def __init__(self) -> None:
+        self._states: Dict[str, _CaseState] = {}
+        self._lock = threading.Lock()
+        self._pending: Set[str] = set()
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # --------- kuyruk ----------
+    def notify(self, sid: str) -> None:
+        """store dinleyicisi; herhangi bir thread'den çağrılabilir."""
+        loop, queue = self._loop, self._queue
+        if loop is None or queue is None:
+            return
+        with self._lock:
+            if sid in self._pending:
+                return
+            self._pending.add(sid)
+        loop.call_soon_threadsafe(queue.put_nowait, sid)
+
+    def start(self) -> asyncio.Task:
+        """Startup hook'unda (event loop içinde) çağrılır."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        store.add_listener(self.notify)
+        return asyncio.create_task(self._worker())
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        while True:
+            sid = await self._queue.get()
+            with self._lock:
+                self._pending.discard(sid)
+            try:
+                s = store.peek(sid)
+                if s is None:
+                    self.forget(sid)
+                    continue
+                text = self._refresh(s)
+                if settings.SUMMARY_LLM_CONDENSE:
+                    await asyncio.to_thread(self._condense, sid, text)
+            except Exception as e:
+                print(f"[summarizer] {sid} update failed:", e)
+
+    # --------- özet ----------
+    def _state(self, sid: str, create: bool = False) -> Optional[_CaseState]:
+        with self._lock:
+            st = self._states.get(sid)
+            if st is None and create:
+                st = self._states[sid] = _CaseState()
+            return st
+
+    def _refresh(self, s: Session) -> str:
+        """Yalnızca yeni turları ve değişen profili işleyerek özeti günceller."""
+        h = s.history
+        st = self._state(s.id, create=True)
+        with st.lock:
+            n = len(h)
+            if st.text is not None and st.cursor == n and st.profile_version == s.profile_version:
+                return st.text
+            for i in range(st.cursor, n):
+                if h.role(i) != "user":
+                    continue
+                msg = h.content(i).strip()
+                if msg and not _is_marker(msg):
+                    st.user_msgs.append(msg)
+            st.cursor = n
+            st.profile_version = s.profile_version
+            st.text = _render(s.patient.model_dump(exclude_none=True), list(st.user_msgs))
+            return st.text
+
+    def _condense(self, sid: str, text: str) -> None:
+        st = self._state(sid)
+        if st is None:
+            return
+        with st.lock:
+            if st.condensed_for == text:
+                return
+        system, user = prompt_case_condense(text)
+        out = complete(system, user, temperature=0.0, session_id=sid)
+        with st.lock:
+            if st.text == text:
+                st.condensed, st.condensed_for = out, text
 
-    # En son N kullanıcı mesajı
-    user_msgs = [h["content"] for h in history if h.get("role") == "user"]
-    user_msgs = user_msgs[-max_user_msgs:]
+    def get(self, s: Session) -> str:
+        """Hazır vaka özeti (LLM ile kısaltılmışı güncelse o)."""
+        text = self._refresh(s)
+        st = self._state(s.id)
+        if st is not None:
+            with st.lock:
+                if st.condensed and st.condensed_for == text:
+                    return st.condensed
+        return text
 
-    bullets = "\n".join([f"- {m.strip()}" for m in user_msgs if m.strip()])
+    def forget(self, sid: str) -> None:
+        with self._lock:
+            self._states.pop(sid, None)
 
-    summary = f"""Demografi: {age} yaş, {gender}
-Ana şikayet: {symptoms}
-Süre: {duration}
-Ek notlar: {notes}
+    def sweep(self) -> None:
+        """Store'da artık olmayan oturumların özetlerini bırak."""
+        with self._lock:
+            sids = list(self._states.keys())
+        for sid in sids:
+            if not store.has(sid):
+                self.forget(sid)
 
-Hasta yanıtları (son mesajlar):
-{bullets if bullets else "- (yok)"}"""
 
-    return summary.strip()
\ No newline at end of file
+summaries = CaseSummaries()
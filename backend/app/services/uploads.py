@@ -0,0 +1,47 @@
+# app/services/uploads.py
+# Kompakt mod için yüklenen metin deposu: /labs/upload-pdf çıkarılan metni
+# içerik özetiyle (text_id) saklar; istemci metni her istekte geri göndermek
+# yerine additionalInfo.extracted_text_ref ile id'yi referanslar.
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from app.settings import settings
+
+
+def text_id(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class UploadTextCache:
+    def __init__(self, max_bytes: int | None = None) -> None:
+        self.max_bytes = int(max_bytes or settings.UPLOAD_CACHE_MAX_BYTES)
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, text: str) -> str:
+        tid = text_id(text)
+        with self._lock:
+            if tid in self._texts:
+                self._texts.move_to_end(tid)
+                return tid
+            self._texts[tid] = text
+            self._bytes += len(text)
+            while self._bytes > self.max_bytes and len(self._texts) > 1:
+                _, old = self._texts.popitem(last=False)
+                self._bytes -= len(old)
+        return tid
+
+    def get(self, tid: str) -> Optional[str]:
+        with self._lock:
+            text = self._texts.get(tid)
+            if text is not None:
+                self._texts.move_to_end(tid)
+            return text
+
+
+uploads = UploadTextCache()
@@ -0,0 +1,247 @@
+# app/services/usage.py
+# Upstream token / maliyet defteri ve TPM kotaları.
+# Her complete() çağrısının prompt / completion token'ları (response.usage; yoksa
+# ~4 karakter/token tahmini) stage, model ve oturum bazında biriktirilir. Son
+# 60 saniye, saniyelik 60 dilimli halka sayaçlarla tutulur (oturum başına 2x60 int).
+# Çağrıdan önce tahmini token rezerve edilir; global ya da oturum TPM kotası
+# aşılacaksa upstream'e hiç gidilmez, QuotaExceeded (HTTP 429) fırlatılır.
+# Toplu işler (batch=True) ayrı bir kovaya (TPM_BATCH) yazılır ve global pencereyi
+# ancak TPM_BATCH_SHARE oranına kadar doldurabilir: kalan pay canlı kullanıcılarındır.
+# Çağrı bitince rezervasyonun yazıldığı dilim gerçek kullanımla düzeltilir, hata
+# olursa iade edilir (dilim pencereden çıktıysa düzeltme atlanır).
+from __future__ import annotations
+
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.settings import settings
+
+_WINDOW = 60
+_CHARS_PER_TOKEN = 4
+_DEFAULT_COMPLETION = 512
+
+
+def approx_tokens(text: str) -> int:
+    return (len(text or "") + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def estimate_call(system: str, user: str, max_tokens: int | None) -> int:
+    """Rezervasyon için üst tahmin: prompt + (max_tokens ya da varsayılan yanıt bütçesi)."""
+    return approx_tokens(system) + approx_tokens(user) + (max_tokens or _DEFAULT_COMPLETION)
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, scope: str, retry_after: int) -> None:
+        super().__init__(f"Token kotası aşıldı ({scope}); {retry_after} sn sonra tekrar deneyin")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class _Window:
+    """Son 60 saniyenin token toplamı: saniye damgası + sayaç halkası."""
+    __slots__ = ("stamps", "counts")
+
+    def __init__(self) -> None:
+        self.stamps = array("q", [0] * _WINDOW)
+        self.counts = array("q", [0] * _WINDOW)
+
+    def add(self, now: int, n: int) -> None:
+        i = now % _WINDOW
+        if self.stamps[i] != now:
+            self.stamps[i] = now
+            self.counts[i] = 0
+        self.counts[i] += n
+
+    def correct(self, at: int, delta: int) -> None:
+        """`at` saniyesindeki dilimi düzeltir; dilim o arada yeniden kullanıldıysa dokunmaz."""
+        i = at % _WINDOW
+        if self.stamps[i] == at:
+            self.counts[i] = max(0, self.counts[i] + delta)
+
+    def total(self, now: int) -> int:
+        lo = now - _WINDOW
+        return max(0, sum(c for t, c in zip(self.stamps, self.counts) if t > lo))
+
+    def retry_after(self, now: int, need: int, limit: int) -> int:
+        """En eski dilimler düştükçe `need` token'ın sığacağı ilk an (saniye)."""
+        lo = now - _WINDOW
+        live = sorted((t, c) for t, c in zip(self.stamps, self.counts) if t > lo)
+        used = sum(c for _, c in live)
+        for t, c in live:
+            used -= c
+            if used + need <= limit:
+                return max(1, t + _WINDOW - now)
+        return _WINDOW
+
+
+class Reservation:
+    """reserve() tutamacı: tahminin yazıldığı saniye ve token sayısı."""
+    __slots__ = ("at", "tokens", "batch")
+
+    def __init__(self, at: int, tokens: int, batch: bool = False) -> None:
+        self.at = at
+        self.tokens = tokens
+        self.batch = batch
+
+
+class _Account:
+    __slots__ = ("window", "calls", "prompt", "completion", "last")
+
+    def __init__(self) -> None:
+        self.window = _Window()
+        self.calls = 0
+        self.prompt = 0
+        self.completion = 0
+        self.last = 0.0
+
+
+def _totals() -> List[float]:
+    # calls, prompt_tokens, completion_tokens, estimated_calls, cost_usd
+    return [0, 0, 0, 0, 0.0]
+
+
+def _render(t: List[float]) -> Dict[str, Any]:
+    return {
+        "calls": int(t[0]),
+        "prompt_tokens": int(t[1]),
+        "completion_tokens": int(t[2]),
+        "estimated_calls": int(t[3]),
+        "cost_usd": round(t[4], 6),
+    }
+
+
+class UsageLedger:
+    def __init__(self) -> None:
+        self.global_tpm = settings.TPM_GLOBAL
+        self.session_tpm = settings.TPM_PER_SESSION
+        self.batch_tpm = settings.TPM_BATCH
+        self.batch_share = settings.TPM_BATCH_SHARE
+        self.max_sessions = settings.USAGE_MAX_SESSIONS
+        self.prices = settings.LLM_PRICES
+        self._global = _Window()
+        self._batch = _Window()
+        self._sessions: "OrderedDict[str, _Account]" = OrderedDict()
+        self._stages: Dict[str, List[float]] = {}
+        self._models: Dict[str, List[float]] = {}
+        self._total = _totals()
+        self._rejected = {"global": 0, "session": 0, "batch": 0}
+        self._lock = threading.Lock()
+
+    def _account(self, sid: str) -> _Account:
+        """self._lock altında."""
+        acct = self._sessions.get(sid)
+        if acct is None:
+            acct = self._sessions[sid] = _Account()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(sid)
+        # yalnızca reddedilen / iade edilen çağrıları olan hesap da sweep'te düşsün
+        acct.last = time.time()
+        return acct
+
+    # --------- kota ----------
+    def reserve(self, session_id: Optional[str], estimate: int, batch: bool = False) -> Reservation:
+        """
+        Tahmini token'ı pencerelere yazar; kota aşılacaksa QuotaExceeded.
+        Boş pencerede tek başına kotadan büyük çağrı geçer (aksi halde hiç geçemezdi).
+        batch=True: global pencerede yalnızca TPM_BATCH_SHARE payı kullanılabilir.
+        """
+        now = int(time.monotonic())
+        with self._lock:
+            acct = self._account(session_id) if session_id else None
+            if batch:
+                checks = [("global", self._global, int(self.global_tpm * self.batch_share)),
+                          ("batch", self._batch, self.batch_tpm)]
+            else:
+                checks = [("global", self._global, self.global_tpm)]
+            if acct is not None:
+                checks.append(("session", acct.window, self.session_tpm))
+            for scope, window, limit in checks:
+                if limit <= 0:
+                    continue
+                used = window.total(now)
+                if used > 0 and used + estimate > limit:
+                    self._rejected[scope] += 1
+                    raise QuotaExceeded(scope, window.retry_after(now, estimate, limit))
+            self._global.add(now, estimate)
+            if batch:
+                self._batch.add(now, estimate)
+            if acct is not None:
+                acct.window.add(now, estimate)
+        return Reservation(now, estimate, batch)
+
+    def release(self, session_id: Optional[str], res: Reservation) -> None:
+        """Upstream çağrısı başarısız: rezervasyonu iade et."""
+        with self._lock:
+            self._correct(session_id, res, -res.tokens)
+
+    def _correct(self, session_id: Optional[str], res: Reservation, delta: int) -> Optional[_Account]:
+        """self._lock altında; farkı rezervasyonun dilimine yazar (şimdiki saniyeye değil)."""
+        self._global.correct(res.at, delta)
+        if res.batch:
+            self._batch.correct(res.at, delta)
+        acct = self._sessions.get(session_id) if session_id else None
+        if acct is not None:
+            acct.window.correct(res.at, delta)
+        return acct
+
+    # --------- defter ----------
+    def settle(self, session_id: Optional[str], stage: str, model: str, res: Reservation,
+               prompt: int, completion: int, estimated: bool = False) -> None:
+        price = self.prices.get(model)
+        cost = (prompt * price[0] + completion * price[1]) / 1e6 if price else 0.0
+        row = (1, prompt, completion, 1 if estimated else 0, cost)
+        with self._lock:
+            acct = self._correct(session_id, res, prompt + completion - res.tokens)
+            if acct is not None:
+                acct.calls += 1
+                acct.prompt += prompt
+                acct.completion += completion
+                acct.last = time.time()
+            for t in (self._total, self._stages.setdefault(stage, _totals()),
+                      self._models.setdefault(model, _totals())):
+                for i, v in enumerate(row):
+                    t[i] += v
+
+    def snapshot(self, session_id: Optional[str] = None, top: int = 20) -> Dict[str, Any]:
+        now = int(time.monotonic())
+        with self._lock:
+            if session_id:
+                acct = self._sessions.get(session_id)
+                return {"session_id": session_id, **(self._session_row(acct, now) if acct else {})}
+            sessions = sorted(self._sessions.items(),
+                              key=lambda kv: kv[1].prompt + kv[1].completion, reverse=True)[:top]
+            return {
+                "quota": {"global_tpm": self.global_tpm, "session_tpm": self.session_tpm,
+                          "batch_tpm": self.batch_tpm, "batch_share": self.batch_share},
+                "tpm": self._global.total(now),
+                "batch_tpm": self._batch.total(now),
+                "rejected": dict(self._rejected),
+                "totals": _render(self._total),
+                "by_stage": {k: _render(v) for k, v in self._stages.items()},
+                "by_model": {k: _render(v) for k, v in self._models.items()},
+                "tracked_sessions": len(self._sessions),
+                "top_sessions": [{"session_id": sid, **self._session_row(a, now)} for sid, a in sessions],
+            }
+
+    @staticmethod
+    def _session_row(acct: _Account, now: int) -> Dict[str, Any]:
+        return {
+            "tpm": acct.window.total(now),
+            "calls": acct.calls,
+            "prompt_tokens": acct.prompt,
+            "completion_tokens": acct.completion,
+        }
+
+    def sweep(self) -> None:
+        """SESSION_TTL boyunca çağrı yapmamış oturum hesaplarını bırak."""
+        cutoff = time.time() - int(settings.SESSION_TTL)
+        with self._lock:
+            for sid in [sid for sid, a in self._sessions.items() if a.last < cutoff]:
+                self._sessions.pop(sid, None)
+
+
+usage = UsageLedger()
@@ -1,14 +1,145 @@
 from pydantic import BaseModel
-from dotenv import load_dotenv
-load_dotenv()
+import json
 import os
+from typing import Dict, List, Optional
+
+def _load_dotenv() -> None:
+    # python-dotenv yalnızca bir .env dosyası varsa import edilir (prod'da env doğrudan gelir).
+    # Arama sırası load_dotenv() ile aynı: bu dosyanın dizininden yukarı doğru.
+    d = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(d, ".env")
+        if os.path.isfile(path):
+            from dotenv import load_dotenv
+            load_dotenv(path)
+            return
+        parent = os.path.dirname(d)
+        if parent == d:
+            return
+        d = parent
+
+_load_dotenv()
+
+GO_EXPERT = "[GO_EXPERT]"
+
+class StageRoute(BaseModel):
+    # None -> OPENAI_MODEL / sınırsız / stop yok
+    model: Optional[str] = None
+    max_tokens: Optional[int] = None
+    stop: Optional[List[str]] = None
+
+def _stage_routes() -> Dict[str, StageRoute]:
+    """
+    Stage (models.Stage) -> model / max_tokens / stop tablosu.
+    Soru modu (initial_assessment, follow_up) yalnızca birkaç numaralı soru ya da
+    [GO_EXPERT] üretir: hızlı model + dar bütçe + işarette erken dur.
+    STAGE_ROUTES env'i JSON ile stage bazında alanları ezer:
+      {"lab_final": {"model": "gpt-4o", "max_tokens": 900}}
+    """
+    question = StageRoute(
+        model=os.getenv("OPENAI_FAST_MODEL") or None,
+        max_tokens=int(os.getenv("QUESTION_MAX_TOKENS", "400")),
+        stop=[GO_EXPERT],
+    )
+    routes: Dict[str, StageRoute] = {
+        "initial_assessment": question,
+        "follow_up": question,
+        "expert_evaluation": StageRoute(),
+        "lab_analysis": StageRoute(),
+        "lab_follow_up": StageRoute(),
+        "lab_final": StageRoute(),
+    }
+    override = os.getenv("STAGE_ROUTES")
+    if override:
+        for stage, patch in json.loads(override).items():
+            base = routes.get(stage, StageRoute()).model_dump()
+            routes[stage] = StageRoute(**{**base, **patch})
+    return routes
 
 class Settings(BaseModel):
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    # Stage bazlı model yönlendirme ve çıktı bütçeleri
+    STAGE_ROUTES: Dict[str, StageRoute] = _stage_routes()
     # CORS origin: Vite default port
     FRONTEND_ORIGIN: str = os.getenv("FRONTEND_ORIGIN", "http://localhost:5173")
     # Session TTL (seconds)
     SESSION_TTL: int = int(os.getenv("SESSION_TTL", "3600"))
+    # Store kilit dilimi sayısı (threadpool'daki eşzamanlı router'lar için)
+    STORE_SHARDS: int = int(os.getenv("STORE_SHARDS", "16"))
+    # Store bellek bütçesi (bytes, 0 = sınırsız); aşılınca önce blob'lar diske, sonra LRU tahliye
+    STORE_MAX_BYTES: int = int(os.getenv("STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+    # Diske taşınacak blob'lar (PDF metni vb.) için kök dizin (süreç başına 0700 alt dizin) ve asgari boyut
+    STORE_BLOB_DIR: str = os.getenv("STORE_BLOB_DIR", "")
+    STORE_BLOB_MIN_BYTES: int = int(os.getenv("STORE_BLOB_MIN_BYTES", str(64 * 1024)))
+    # Oturum snapshot dosyası (boş = kapalı). Deploy'lar arası kalıcı diskte olmalı.
+    STORE_SNAPSHOT_PATH: str = os.getenv("STORE_SNAPSHOT_PATH", "")
+    # Periyodik snapshot aralığı (seconds, 0 = yalnızca kapanışta)
+    STORE_SNAPSHOT_INTERVAL: int = int(os.getenv("STORE_SNAPSHOT_INTERVAL", "0"))
+    # Arka plan vaka özetini ayrıca LLM ile kısalt (uzman promptları daha kısa olur)
+    SUMMARY_LLM_CONDENSE: bool = os.getenv("SUMMARY_LLM_CONDENSE", "0") == "1"
+    # Sohbet geçmişinde eski (soğuk) büyük turları zlib ile sıkıştır
+    HISTORY_COMPRESS_COLD: bool = os.getenv("HISTORY_COMPRESS_COLD", "1") == "1"
+    # Toplu tahlil analizi: eşzamanlı LLM çağrısı ve iş başına öğe sınırı
+    LAB_BATCH_CONCURRENCY: int = int(os.getenv("LAB_BATCH_CONCURRENCY", "4"))
+    LAB_BATCH_MAX_ITEMS: int = int(os.getenv("LAB_BATCH_MAX_ITEMS", "500"))
+    # Tamamlanan toplu işlerin bellekte tutulma süresi (seconds)
+    LAB_BATCH_TTL: int = int(os.getenv("LAB_BATCH_TTL", "86400"))
+    # Online öğe TPM kotasına takılırsa en fazla bu kadar bekleyip yeniden dener (seconds)
+    LAB_BATCH_QUOTA_WAIT: int = int(os.getenv("LAB_BATCH_QUOTA_WAIT", "900"))
+    # İlk form yakın-tekrar önbelleği (MinHash/LSH): açık/kapalı, Jaccard eşiği, kapasite
+    FORM_CACHE_ENABLED: bool = os.getenv("FORM_CACHE_ENABLED", "0") == "1"
+    FORM_CACHE_THRESHOLD: float = float(os.getenv("FORM_CACHE_THRESHOLD", "0.8"))
+    FORM_CACHE_MAX: int = int(os.getenv("FORM_CACHE_MAX", "2000"))
+    # PDF metin çıkarma: backend (pypdf2 | pypdfium2 | pdfminer), sayfa sınırı (0 = sınırsız)
+    # ve erken durma: 0 = kapalı (varsayılan); N = son tahlil sayfasından sonra art arda
+    # N tablosuz sayfa gelince dur (tablolar arasındaki açıklama sayfaları atlanmaz)
+    PDF_BACKEND: str = os.getenv("PDF_BACKEND", "pypdf2")
+    PDF_MAX_PAGES: int = int(os.getenv("PDF_MAX_PAGES", "50"))
+    PDF_EARLY_STOP: int = int(os.getenv("PDF_EARLY_STOP", "0"))
+    # LLM kayıt / tekrar oynatma: "" (kapalı) | record | replay, JSONL kaset yolu ve
+    # replay gecikme ölçeği (1.0 = kaydedilen süre, 0 = beklemeden)
+    LLM_CASSETTE_MODE: str = os.getenv("LLM_CASSETTE_MODE", "")
+    LLM_CASSETTE_PATH: str = os.getenv("LLM_CASSETTE_PATH", "")
+    LLM_REPLAY_LATENCY_SCALE: float = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1.0"))
+    # /debug uçları için X-Admin-Token (boş = uçlar kapalı)
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    # Event loop bu kadar (ms) bloklanırsa yığın yakalanır (0 = bekçi kapalı)
+    LOOP_LAG_THRESHOLD_MS: int = int(os.getenv("LOOP_LAG_THRESHOLD_MS", "200"))
+    # /debug/profile için üst süre sınırı (seconds)
+    PROFILE_MAX_SECONDS: int = int(os.getenv("PROFILE_MAX_SECONDS", "30"))
+    # ?async=1 iş modu: worker sayısı, bekleyen iş sınırı, bitmiş işin tutulma süresi (seconds)
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "4"))
+    JOB_MAX_PENDING: int = int(os.getenv("JOB_MAX_PENDING", "100"))
+    JOB_TTL: int = int(os.getenv("JOB_TTL", "3600"))
+    # Hasta başına uzunlamasına tahlil indeksi: dosya (boş = yalnızca bellek),
+    # analit başına tutulan ölçüm sayısı ve hasta sınırı (LRU)
+    LAB_HISTORY_PATH: str = os.getenv("LAB_HISTORY_PATH", "")
+    LAB_HISTORY_MAX_POINTS: int = int(os.getenv("LAB_HISTORY_MAX_POINTS", "50"))
+    LAB_HISTORY_MAX_PATIENTS: int = int(os.getenv("LAB_HISTORY_MAX_PATIENTS", "20000"))
+    # Yanıt sıkıştırma (gzip / brotli) eşiği ve seviyeleri; sıkıştırılmış isteklerde açılmış gövde sınırı
+    COMPRESS_MIN_BYTES: int = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+    COMPRESS_GZIP_LEVEL: int = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+    COMPRESS_BROTLI_QUALITY: int = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+    COMPRESS_MAX_REQUEST_BYTES: int = int(os.getenv("COMPRESS_MAX_REQUEST_BYTES", str(32 * 1024 * 1024)))
+    # Kompakt mod: yüklenen PDF metinleri id ile referanslanır (içerik adresli, bayt bütçeli LRU)
+    UPLOAD_CACHE_MAX_BYTES: int = int(os.getenv("UPLOAD_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    # Stateless mod: oturum imzalı, sıkıştırılmış X-Session-Token olarak istemciyle taşınır.
+    # Secret tüm instance'larda aynı olmalı; token bu boyutu aşarsa sunucu tarafı store kullanılır.
+    STATELESS_SESSIONS: bool = os.getenv("STATELESS_SESSIONS", "0") == "1"
+    SESSION_TOKEN_SECRET: str = os.getenv("SESSION_TOKEN_SECRET", "")
+    SESSION_TOKEN_MAX_BYTES: int = int(os.getenv("SESSION_TOKEN_MAX_BYTES", "6144"))
+    # Upstream token kotaları (dakikalık, 0 = kapalı) ve maliyet tablosu:
+    # LLM_PRICES='{"gpt-4o-mini": [0.15, 0.6]}' -> model başına 1M prompt / completion token USD
+    TPM_GLOBAL: int = int(os.getenv("TPM_GLOBAL", "0"))
+    TPM_PER_SESSION: int = int(os.getenv("TPM_PER_SESSION", "0"))
+    # Toplu işler (batch=True) global TPM'in en fazla bu oranını doldurabilir; kalanı canlı
+    # kullanıcılara ayrılır. Toplu işlerin kendi kovası TPM_BATCH (0 = yalnızca oran sınırı).
+    TPM_BATCH_SHARE: float = float(os.getenv("TPM_BATCH_SHARE", "0.5"))
+    TPM_BATCH: int = int(os.getenv("TPM_BATCH", "0"))
+    USAGE_MAX_SESSIONS: int = int(os.getenv("USAGE_MAX_SESSIONS", "10000"))
+    LLM_PRICES: Dict[str, List[float]] = json.loads(os.getenv("LLM_PRICES") or "{}")
+    # Klinik uçları (toplu tahlil): CLINIC_TOKENS='{"<token>": "<klinik-id>"}'; boşsa uçlar kapalı
+    CLINIC_TOKENS: Dict[str, str] = json.loads(os.getenv("CLINIC_TOKENS") or "{}")
 
 settings = Settings()
\ No newline at end of file
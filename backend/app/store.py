@@ -1,37 +1,160 @@
 # app/store.py
 from __future__ import annotations
-from typing import Dict, Optional, List, Any
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, List, Any, Iterator, Tuple
 from datetime import datetime, timedelta
 
 from app.models import (
     Session,
-    ChatTurn,
     PatientData,
 )
+from app.services.snapshot import SnapshotReader, session_to_record, write_snapshot
 from app.settings import settings
 
 
 TTL_SECONDS = getattr(settings, "SESSION_TTL", 3600)
 
+# Diske taşınan blob'ların additionalInfo içindeki yer tutucusu
+BLOB_MARKER = "\x00blob:"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True   # başka kullanıcının süreci (EPERM) ya da desteklenmeyen platform
+    return True
+
+
+def _approx_size(obj: Any) -> int:
+    """Hasta verisi için kabaca bellek tahmini (string'ler baskın)."""
+    if isinstance(obj, (str, bytes)):
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sum(_approx_size(k) + _approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sum(_approx_size(v) for v in obj)
+    return 16
+
+
+class _Shard:
+    """Oturumların bir dilimi: kendi kilidi, LRU sırası ve bellek muhasebesi."""
+
+    __slots__ = ("lock", "sessions", "sizes", "blobs", "bytes", "evictions", "offloads")
 
-class InMemoryStore:
     def __init__(self) -> None:
-        self._sessions: Dict[str, Session] = {}
+        self.lock = threading.RLock()
+        # LRU sırası: en eski kullanılan başta (get() sona taşır)
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.sizes: Dict[str, int] = {}
+        # diske taşınan blob'lar: sid -> {additionalInfo anahtarı: dosya yolu}
+        self.blobs: Dict[str, Dict[str, str]] = {}
+        self.bytes = 0
+        self.evictions = 0
+        self.offloads = 0
+
+
+class InMemoryStore:
+    """
+    Router'lar sync `def` olduğundan threadpool'da eşzamanlı çalışır.
+    Oturumlar id'ye göre STORE_SHARDS dilime bölünür (lock striping); her
+    işlem yalnızca kendi diliminin kilidini tutar, farklı oturumlar birbirini beklemez.
+    """
+
+    def __init__(self, shards: Optional[int] = None) -> None:
+        n = max(1, int(shards or settings.STORE_SHARDS))
+        self._shards: List[_Shard] = [_Shard() for _ in range(n)]
+        self.max_bytes = int(settings.STORE_MAX_BYTES)
+        # Blob'lar hasta verisi (PDF metni) içerir: süreç başına 0700 alt dizin, dosyalar 0600;
+        # kapanışta (snapshot'a kopyalandıktan sonra) silinir, açılışta ölü süreçlerinki temizlenir
+        self.blob_root = settings.STORE_BLOB_DIR or os.path.join(tempfile.gettempdir(), "medvise-blobs")
+        self.blob_dir = os.path.join(self.blob_root, f"p{os.getpid()}")
+        self.blob_min_bytes = int(settings.STORE_BLOB_MIN_BYTES)
+        # aynı anda tek bir thread bütçe temizliği yapar
+        self._enforce_lock = threading.Lock()
+        # restart sonrası henüz belleğe alınmamış oturumlar (mmap'li snapshot)
+        # kilit sırası: shard -> cold (tersi yasak)
+        self._cold: Optional[SnapshotReader] = None
+        self._cold_until = 0.0
+        self._cold_lock = threading.Lock()
+        # add_turn sonrası çağrılır (ör. arka plan vaka özeti); kilit dışında
+        self._listeners: List[Callable[[str], None]] = []
+
+    def _shard(self, sid: str) -> _Shard:
+        return self._shards[hash(sid) % len(self._shards)]
 
     # --------- session lifecycle ----------
     def create(self) -> Session:
         s = Session()
-        self._sessions[s.id] = s
+        sh = self._shard(s.id)
+        with sh.lock:
+            sh.sessions[s.id] = s
+            self._account(sh, s)
         print(f"[STORE] create() -> {s.id}")
+        self._enforce_budget(keep=s.id)
         return s
 
-    def get(self, sid: str) -> Optional[Session]:
-        s = self._sessions.get(sid)
+    def _load(self, sh: _Shard, sid: str) -> Tuple[Optional[Session], bool]:
+        """sh.lock altında çağrılır. (oturum, bellek büyüdü mü) döndürür."""
+        s = sh.sessions.get(sid)
+        grew = False
+        if s is None and self._cold is not None:
+            s = self._thaw(sh, sid)
+            grew = s is not None
         print(f"[STORE] get({sid}) -> {'found' if s else 'not found'}")
         if s:
             s.last_used_at = datetime.utcnow()
+            sh.sessions.move_to_end(sid)
+            if sid in sh.blobs:
+                self._restore_blobs(sh, s)
+                self._account(sh, s)
+                grew = True
+        return s, grew
+
+    def _require(self, sh: _Shard, sid: str) -> Session:
+        s, _ = self._load(sh, sid)
+        if not s:
+            raise KeyError("Session not found or expired")
         return s
 
+    def get(self, sid: str) -> Optional[Session]:
+        sh = self._shard(sid)
+        with sh.lock:
+            s, grew = self._load(sh, sid)
+        if grew:
+            self._enforce_budget(keep=sid)
+        return s
+
+    def peek(self, sid: str) -> Optional[Session]:
+        """
+        LRU/TTL'e dokunmadan bellekteki oturumu döndür (arka plan işleri için).
+        Blob'ları diske taşınmışsa belleğe geri almadan, blob'ları okunmuş bir kopya döner.
+        """
+        sh = self._shard(sid)
+        with sh.lock:
+            s = sh.sessions.get(sid)
+            if s is None or s.id not in sh.blobs:
+                return s
+            patient = PatientData.model_validate(self._export_patient(sh, s))
+            return s.model_copy(update={"patient": patient})
+
+    def has(self, sid: str) -> bool:
+        """Oturum bellekte mi (blob okumadan)."""
+        sh = self._shard(sid)
+        with sh.lock:
+            return sid in sh.sessions
+
+    def add_listener(self, fn: Callable[[str], None]) -> None:
+        self._listeners.append(fn)
+
     def require(self, sid: str) -> Session:
         s = self.get(sid)
         if not s:
@@ -40,9 +163,19 @@ class InMemoryStore:
 
     # --------- mutations ----------
     def add_turn(self, sid: str, role: str, content: str) -> None:
-        s = self.require(sid)
-        s.history.append(ChatTurn(role=role, content=content))
-        s.last_used_at = datetime.utcnow()
+        sh = self._shard(sid)
+        with sh.lock:
+            s = self._require(sh, sid)
+            s.history.append(role, content)
+            s.version += 1
+            s.last_used_at = datetime.utcnow()
+            self._account(sh, s)
+        self._enforce_budget(keep=sid)
+        for fn in self._listeners:
+            try:
+                fn(sid)
+            except Exception as e:
+                print("[STORE] listener failed:", e)
 
     def upsert_patient(self, sid: str, patch: dict) -> None:
         """
@@ -51,40 +184,49 @@ class InMemoryStore:
         - previousAnswers: listeyi mevcutların sonuna ekler (tekrarları filtrelemez)
         - additionalInfo: dict seviyesinde merge eder
         """
-        s = self.require(sid)
+        sh = self._shard(sid)
+        with sh.lock:
+            s = self._require(sh, sid)
 
-        cur: dict = s.patient.model_dump(exclude_none=True)
+            cur: dict = s.patient.model_dump(exclude_none=True)
 
-        # previousAnswers merge
-        if "previousAnswers" in patch and isinstance(patch["previousAnswers"], list):
-            prev: List[str] = list(cur.get("previousAnswers") or [])
-            prev.extend([str(x) for x in patch["previousAnswers"]])
-            if prev:
-                cur["previousAnswers"] = prev
+            # previousAnswers merge
+            if "previousAnswers" in patch and isinstance(patch["previousAnswers"], list):
+                prev: List[str] = list(cur.get("previousAnswers") or [])
+                prev.extend([str(x) for x in patch["previousAnswers"]])
+                if prev:
+                    cur["previousAnswers"] = prev
 
-        # additionalInfo merge
-        if "additionalInfo" in patch and isinstance(patch["additionalInfo"], dict):
-            cur_add: dict[str, Any] = dict(cur.get("additionalInfo") or {})
-            for k, v in patch["additionalInfo"].items():
-                if v is not None:
-                    cur_add[k] = v
-            if cur_add:
-                cur["additionalInfo"] = cur_add
+            # additionalInfo merge
+            if "additionalInfo" in patch and isinstance(patch["additionalInfo"], dict):
+                cur_add: dict[str, Any] = dict(cur.get("additionalInfo") or {})
+                for k, v in patch["additionalInfo"].items():
+                    if v is not None:
+                        cur_add[k] = v
+                if cur_add:
+                    cur["additionalInfo"] = cur_add
 
-        # primitive alanlar
-        for k, v in patch.items():
-            if k in ("previousAnswers", "additionalInfo"):
-                continue
-            if v is not None:
-                cur[k] = v
+            # primitive alanlar
+            for k, v in patch.items():
+                if k in ("previousAnswers", "additionalInfo"):
+                    continue
+                if v is not None:
+                    cur[k] = v
 
-        s.patient = PatientData(**cur)
-        s.last_used_at = datetime.utcnow()
+            s.patient = PatientData(**cur)
+            s.profile_version += 1
+            s.version += 1
+            s.last_used_at = datetime.utcnow()
+            self._account(sh, s, patient=cur)
+        self._enforce_budget(keep=sid)
 
     def set_stage(self, sid: str, stage: str) -> None:
-        s = self.require(sid)
-        s.stage = stage  # type: ignore
-        s.last_used_at = datetime.utcnow()
+        sh = self._shard(sid)
+        with sh.lock:
+            s = self._require(sh, sid)
+            s.stage = stage  # type: ignore
+            s.version += 1
+            s.last_used_at = datetime.utcnow()
 
     def get_stage(self, sid: str) -> str:
         """Session'ın mevcut stage'ini döndür."""
@@ -96,25 +238,325 @@ class InMemoryStore:
         s = self.require(sid)
         return s.patient.model_dump(exclude_none=True)
 
+    def get_profile(self, sid: str) -> Tuple[str, dict]:
+        """(profil sürüm anahtarı, hasta dict'i); anahtar yalnızca upsert_patient'te değişir."""
+        sh = self._shard(sid)
+        with sh.lock:
+            s, grew = self._load(sh, sid)
+            if not s:
+                raise KeyError("Session not found or expired")
+            out = f"{sid}:{s.profile_version}", s.patient.model_dump(exclude_none=True)
+        if grew:
+            self._enforce_budget(keep=sid)
+        return out
+
     def get_history(self, sid: str) -> List[dict]:
         """Konuşma geçmişini dict listesi olarak döndür."""
         s = self.require(sid)
-        return [t.model_dump() for t in s.history]
+        return s.history.to_dicts()
 
     def snapshot(self, sid: str) -> Optional[Session]:
         return self.get(sid)
 
+    # --------- bellek muhasebesi ----------
+    def _account(self, sh: _Shard, s: Session, patient: Optional[dict] = None) -> None:
+        """sh.lock altında: oturumun tahmini boyutunu yeniden hesapla ve dilim toplamını güncelle."""
+        if patient is None:
+            patient = s.patient.model_dump(exclude_none=True)
+        size = s.history.nbytes() + _approx_size(patient)
+        sh.bytes += size - sh.sizes.get(s.id, 0)
+        sh.sizes[s.id] = size
+
+    def _drop(self, sh: _Shard, sid: str) -> None:
+        sh.sessions.pop(sid, None)
+        sh.bytes -= sh.sizes.pop(sid, 0)
+        for path in (sh.blobs.pop(sid, None) or {}).values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def total_bytes(self) -> int:
+        return sum(sh.bytes for sh in self._shards)
+
+    def _enforce_budget(self, keep: Optional[str] = None) -> None:
+        """
+        Bütçe aşılırsa önce LRU sırasıyla büyük blob'ları diske taşı,
+        yine aşılıyorsa en eski oturumları tamamen çıkar. `keep` dokunulmaz.
+        Çağıran hiçbir shard kilidini tutmamalı; burada aynı anda tek kilit tutulur.
+        """
+        if self.max_bytes <= 0 or self.total_bytes() <= self.max_bytes:
+            return
+        if not self._enforce_lock.acquire(blocking=False):
+            return  # başka bir thread zaten temizliyor
+        try:
+            for sh in self._shards:
+                if self.total_bytes() <= self.max_bytes:
+                    return
+                with sh.lock:
+                    for sid, s in list(sh.sessions.items()):
+                        if self.total_bytes() <= self.max_bytes:
+                            break
+                        if sid != keep:
+                            self._offload_blobs(sh, s)
+
+            # dilim başlarından global olarak en eski kullanılanı çıkar
+            while self.total_bytes() > self.max_bytes:
+                victim: Optional[Tuple[_Shard, str, datetime]] = None
+                for sh in self._shards:
+                    with sh.lock:
+                        for sid, s in sh.sessions.items():
+                            if sid == keep:
+                                continue
+                            if victim is None or s.last_used_at < victim[2]:
+                                victim = (sh, sid, s.last_used_at)
+                            break
+                if victim is None:
+                    return
+                sh, sid, _ = victim
+                with sh.lock:
+                    self._drop(sh, sid)
+                    sh.evictions += 1
+                print(f"[STORE] evict({sid}) bytes={self.total_bytes()}")
+        finally:
+            self._enforce_lock.release()
+
+    def _offload_blobs(self, sh: _Shard, s: Session) -> None:
+        """
+        sh.lock altında. Store'daki oturum nesnesi yer tutuculu bir kopyayla
+        değiştirilir; istekte elde tutulan nesne (sess.patient) tam metni görmeye
+        devam eder, yer tutucu kilitsiz okuyuculara hiç görünmez. Geçmiş (history)
+        iki nesne arasında paylaşılır.
+        """
+        info = s.patient.additionalInfo
+        if not info:
+            return
+        moved = dict(sh.blobs.get(s.id) or {})
+        new_info = dict(info)
+        for k, v in info.items():
+            if not isinstance(v, str) or len(v) < self.blob_min_bytes or v.startswith(BLOB_MARKER):
+                continue
+            self._ensure_blob_dir()
+            path = os.path.join(self.blob_dir, f"{s.id}.{len(moved)}.txt")
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, "w", encoding="utf-8") as f:
+                f.write(v)
+            moved[k] = path
+            new_info[k] = BLOB_MARKER + path
+            sh.offloads += 1
+        if not moved:
+            return
+        sh.blobs[s.id] = moved
+        s = s.model_copy(update={"patient": s.patient.model_copy(update={"additionalInfo": new_info})})
+        sh.sessions[s.id] = s   # LRU sırası korunur
+        self._account(sh, s)
+
+    def _ensure_blob_dir(self) -> None:
+        if os.path.isdir(self.blob_dir):
+            return
+        # makedirs mode'u ara dizinlere uygulamaz; kök ayrıca oluşturulur
+        os.makedirs(self.blob_root, mode=0o700, exist_ok=True)
+        os.makedirs(self.blob_dir, mode=0o700, exist_ok=True)
+        os.chmod(self.blob_dir, 0o700)
+
+    def clean_stale_blobs(self) -> int:
+        """
+        Açılışta: çalışmayan süreçlerin blob dizinlerini ve eski düz düzendeki
+        ({sid}.{n}.txt) dosyaları siler. Aynı pid'li dizin (konteyner restart'ı)
+        de eskidir; bu süreç henüz blob yazmadı. Silinen girdi sayısını döndürür.
+        """
+        if not os.path.isdir(self.blob_root):
+            return 0
+        removed = 0
+        for name in os.listdir(self.blob_root):
+            path = os.path.join(self.blob_root, name)
+            if os.path.isdir(path) and name[:1] == "p" and name[1:].isdigit():
+                pid = int(name[1:])
+                if pid != os.getpid() and _pid_alive(pid):
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+            elif name.endswith(".txt") and os.path.isfile(path):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            print(f"[STORE] removed {removed} stale blob entries from {self.blob_root}")
+        return removed
+
+    def close_blobs(self) -> None:
+        """Kapanışta, write_snapshot blob'ları kayda kopyaladıktan sonra çağrılır."""
+        for sh in self._shards:
+            with sh.lock:
+                sh.blobs.clear()
+        shutil.rmtree(self.blob_dir, ignore_errors=True)
+
+    def _restore_blobs(self, sh: _Shard, s: Session) -> None:
+        moved = sh.blobs.pop(s.id, None) or {}
+        new_info = dict(s.patient.additionalInfo or {})
+        for k, path in moved.items():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+                os.remove(path)
+            except OSError as e:
+                print(f"[STORE] blob restore failed ({s.id}.{k}):", e)
+                text = ""
+            new_info[k] = text
+        s.patient = s.patient.model_copy(update={"additionalInfo": new_info})
+
+    # --------- snapshot / restore ----------
+    def restore_snapshot(self, path: Optional[str] = None) -> int:
+        """
+        Snapshot'ı mmap ile açar; yalnızca indeks okunur. Oturumlar ilk
+        get() çağrısında tek tek belleğe alınır. Açılan oturum sayısını döndürür.
+        """
+        path = path or settings.STORE_SNAPSHOT_PATH
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            reader = SnapshotReader(path)
+        except Exception as e:
+            print(f"[STORE] snapshot restore failed ({path}):", e)
+            return 0
+        with self._cold_lock:
+            if self._cold is not None:
+                self._cold.close()
+            self._cold = reader
+            # snapshot'taki her oturum en geç mtime + TTL'de süresi dolmuş olur
+            self._cold_until = os.path.getmtime(path) + int(TTL_SECONDS)
+        print(f"[STORE] snapshot restored lazily: {len(reader)} sessions")
+        return len(reader)
+
+    def _thaw(self, sh: _Shard, sid: str) -> Optional[Session]:
+        """sh.lock altında: soğuk oturumu snapshot'tan belleğe al."""
+        with self._cold_lock:
+            cold = self._cold
+            if cold is None:
+                return None
+            try:
+                s = cold.take(sid)
+            except Exception as e:
+                print(f"[STORE] snapshot record unreadable ({sid}):", e)
+                cold.discard(sid)
+                return None
+        if s is None:
+            return None
+        if datetime.utcnow() - s.last_used_at > timedelta(seconds=int(TTL_SECONDS)):
+            return None
+        sh.sessions[sid] = s
+        self._account(sh, s)
+        return s
+
+    def _export_patient(self, sh: _Shard, s: Session) -> dict:
+        """Diske taşınmış blob'ları snapshot için satır içine geri koyar."""
+        patient = s.patient.model_dump(exclude_none=True)
+        moved = sh.blobs.get(s.id)
+        if moved and isinstance(patient.get("additionalInfo"), dict):
+            for k, path in moved.items():
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        patient["additionalInfo"][k] = f.read()
+                except OSError:
+                    patient["additionalInfo"].pop(k, None)
+        return patient
+
+    # --------- istemci taraflı oturum (stateless mod) ----------
+    def export_record(self, sid: str) -> Optional[bytes]:
+        """Oturumun tam (blob'lar satır içi) kaydı; session token'ına gömülür."""
+        sh = self._shard(sid)
+        with sh.lock:
+            s = sh.sessions.get(sid)
+            if s is None:
+                return None
+            return session_to_record(s, self._export_patient(sh, s))
+
+    def adopt(self, s: Session) -> Session:
+        """
+        Token'dan çözülen oturumu yerleştirir. Yerel kopya token'dan eski değilse
+        (version >= token'ınki; ör. ?async=1 işi sonucu yazdı ya da istemci eski bir
+        token'ı yeniden gönderdi) yerel kopya korunur, aksi halde token kazanır.
+        """
+        sh = self._shard(s.id)
+        with sh.lock:
+            local = sh.sessions.get(s.id)
+            if local is not None and local.version >= s.version:
+                s = local
+            else:
+                if local is not None:
+                    self._drop(sh, s.id)
+                sh.sessions[s.id] = s
+                self._account(sh, s)
+            s.last_used_at = datetime.utcnow()
+            sh.sessions.move_to_end(s.id)
+        self._enforce_budget(keep=s.id)
+        return s
+
+    def _records(self) -> Iterator[Tuple[str, bytes]]:
+        for sh in self._shards:
+            with sh.lock:
+                sids = list(sh.sessions.keys())
+            for sid in sids:
+                with sh.lock:
+                    s = sh.sessions.get(sid)
+                    if s is None:
+                        continue
+                    rec = session_to_record(s, self._export_patient(sh, s))
+                yield sid, rec
+        # hiç dokunulmamış soğuk oturumlar: çözmeden ham kayıt olarak kopyala
+        with self._cold_lock:
+            cold_ids = self._cold.ids() if self._cold is not None else []
+        for sid in cold_ids:
+            if sid in self._shard(sid).sessions:
+                continue
+            with self._cold_lock:
+                raw = self._cold.raw(sid) if self._cold is not None else None
+            if raw is not None:
+                yield sid, raw
+
+    def write_snapshot(self, path: Optional[str] = None) -> int:
+        """Tüm oturumları akış halinde snapshot dosyasına yazar."""
+        path = path or settings.STORE_SNAPSHOT_PATH
+        if not path:
+            return 0
+        t0 = time.perf_counter()
+        n = write_snapshot(path, self._records())
+        print(f"[STORE] snapshot written: {n} sessions in {(time.perf_counter() - t0) * 1000:.1f} ms")
+        return n
+
+    def stats(self) -> Dict[str, int]:
+        """Gauge'lar: oturum sayısı, tutulan byte, bütçe, taşınan blob ve tahliye sayıları."""
+        return {
+            "sessions": sum(len(sh.sessions) for sh in self._shards),
+            "bytes": self.total_bytes(),
+            "max_bytes": self.max_bytes,
+            "offloaded_sessions": sum(len(sh.blobs) for sh in self._shards),
+            "offloads_total": sum(sh.offloads for sh in self._shards),
+            "evictions_total": sum(sh.evictions for sh in self._shards),
+            "cold_sessions": len(self._cold) if self._cold is not None else 0,
+            "shards": len(self._shards),
+        }
+
     # --------- janitor ----------
     def sweep(self) -> None:
-        """TTL dolan oturumları temizle."""
+        """TTL dolan oturumları temizle (kopyasız: her dilimde LRU başından ilk taze oturuma kadar)."""
         now = datetime.utcnow()
         ttl = timedelta(seconds=int(TTL_SECONDS))
-        to_del: List[str] = []
-        for sid, sess in self._sessions.items():
-            if now - sess.last_used_at > ttl:
-                to_del.append(sid)
-        for sid in to_del:
-            self._sessions.pop(sid, None)
+        for sh in self._shards:
+            with sh.lock:
+                while sh.sessions:
+                    sid, sess = next(iter(sh.sessions.items()))
+                    if now - sess.last_used_at <= ttl:
+                        break
+                    self._drop(sh, sid)
+
+        # snapshot'taki tüm oturumların süresi dolduysa mmap'i bırak
+        with self._cold_lock:
+            if self._cold is not None and (len(self._cold) == 0 or time.time() > self._cold_until):
+                self._cold.close()
+                self._cold = None
 
 
-store = InMemoryStore()
\ No newline at end of file
+store = InMemoryStore()
@@ -0,0 +1,161 @@
+# scripts/bench_pdf.py
+# PDF backend karşılaştırması: üretilmiş tahlil raporu PDF'leri üzerinde
+# backend başına sayfa/saniye, ortalama süre ve tepe bellek (tracemalloc).
+#
+#   cd backend && PYTHONPATH=. python scripts/bench_pdf.py --docs 30 --pages 12
+#   PYTHONPATH=. python scripts/bench_pdf.py --out /tmp/lab-corpus   # korpusu diske de yaz
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import time
+import tracemalloc
+from typing import List, Tuple
+
+from app.services import pdf_service
+
+ANALYTES = [
+    ("Hemoglobin", "g/dL", 12.0, 17.5),
+    ("Hematokrit", "%", 36.0, 52.0),
+    ("Lokosit", "10^3/uL", 4.0, 10.5),
+    ("Trombosit", "10^3/uL", 150.0, 400.0),
+    ("Glukoz", "mg/dL", 70.0, 100.0),
+    ("Kreatinin", "mg/dL", 0.6, 1.2),
+    ("ALT", "U/L", 7.0, 45.0),
+    ("AST", "U/L", 8.0, 40.0),
+    ("TSH", "uIU/mL", 0.4, 4.0),
+    ("Ferritin", "ng/mL", 20.0, 250.0),
+    ("B12", "pg/mL", 200.0, 900.0),
+    ("CRP", "mg/L", 0.0, 5.0),
+    ("Sodyum", "mmol/L", 135.0, 145.0),
+    ("Potasyum", "mmol/L", 3.5, 5.1),
+]
+
+FILLER = (
+    "Bu rapor bilgilendirme amaclidir. Sonuclar klinik bulgularla birlikte "
+    "degerlendirilmelidir. Numune kabul ve onay saatleri laboratuvar bilgi "
+    "sisteminde kayitlidir."
+)
+
+
+# ---------------- minimal PDF yazıcı (bağımlılıksız) ----------------
+
+def _esc(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def _page_stream(lines: List[str]) -> bytes:
+    out = ["BT /F1 10 Tf 14 TL 40 800 Td"]
+    for ln in lines:
+        out.append(f"({_esc(ln)}) Tj T*")
+    out.append("ET")
+    return "\n".join(out).encode("latin-1", "replace")
+
+def build_pdf(pages: List[List[str]]) -> bytes:
+    objs: List[bytes] = []
+    n = len(pages)
+    # 1: katalog, 2: sayfa ağacı, 3: font, sonra (sayfa, içerik) çiftleri
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(n))
+    objs.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objs.append(f"<< /Type /Pages /Kids [{kids}] /Count {n} >>".encode())
+    objs.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, lines in enumerate(pages):
+        content = _page_stream(lines)
+        objs.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        objs.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+
+    buf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objs, start=1):
+        offsets.append(len(buf))
+        buf += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(buf)
+    buf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    for off in offsets:
+        buf += b"%010d 00000 n \n" % off
+    buf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref)
+    return bytes(buf)
+
+
+# ---------------- korpus ----------------
+
+def lab_report(rng: random.Random, n_pages: int, lab_pages: int) -> bytes:
+    """
+    lab_pages tahlil tablosu, aralarında birer açıklama sayfası (gerçek raporlardaki
+    gibi: tablo / yorum / tablo); kalan sayfalar açıklama/ek metin.
+    """
+    lab_at = {2 * i for i in range(lab_pages)}
+    pages: List[List[str]] = []
+    for p in range(n_pages):
+        if p in lab_at:
+            lines = [f"Hasta Protokol: {rng.randint(100000, 999999)}  Sayfa {p + 1}", "Test  Sonuc  Birim  Referans"]
+            for name, unit, lo, hi in ANALYTES * 3:
+                val = round(rng.uniform(lo * 0.7, hi * 1.3), 2)
+                lines.append(f"{name}  {val}  {unit}  {lo}-{hi}")
+        else:
+            lines = [f"Aciklamalar  Sayfa {p + 1}"] + [FILLER] * 40
+        pages.append(lines)
+    return build_pdf(pages)
+
+def corpus(docs: int, pages: int, seed: int = 7) -> List[Tuple[str, bytes]]:
+    rng = random.Random(seed)
+    return [
+        (f"lab_{i:03d}.pdf", lab_report(rng, pages, lab_pages=rng.randint(1, 3)))
+        for i in range(docs)
+    ]
+
+
+# ---------------- ölçüm ----------------
+
+def bench(backend: str, files: List[Tuple[str, bytes]], early_stop: int, max_pages: int) -> dict:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    chars = tables = 0
+    for _, raw in files:
+        text = pdf_service.extract_text_from_pdf(raw, backend=backend, max_pages=max_pages, early_stop=early_stop)
+        chars += len(text)
+        tables += text.count("Test  Sonuc")
+    dt = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": dt, "docs_per_s": len(files) / dt, "chars": chars, "tables": tables,
+            "peak_kb": peak / 1024}
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=30)
+    ap.add_argument("--pages", type=int, default=12)
+    ap.add_argument("--max-pages", type=int, default=0)
+    ap.add_argument("--early", type=int, default=3, help="erken durma: art arda tablosuz sayfa sayısı")
+    ap.add_argument("--backends", default="pypdf2,pypdfium2,pdfminer")
+    ap.add_argument("--out", default="")
+    args = ap.parse_args()
+
+    files = corpus(args.docs, args.pages)
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        for name, raw in files:
+            with open(os.path.join(args.out, name), "wb") as f:
+                f.write(raw)
+
+    total_mb = sum(len(r) for _, r in files) / 1e6
+    print(f"korpus: {len(files)} PDF x {args.pages} sayfa ({total_mb:.1f} MB)")
+    print(f"{'backend':<10} {'early':<6} {'s':>8} {'doc/s':>8} {'chars':>10} {'tablo':>6} {'peak KB':>9}")
+    for backend in args.backends.split(","):
+        if backend != "pypdf2" and not pdf_service._backend_available(backend):
+            continue
+        full = None
+        for early in (0, args.early):
+            r = bench(backend, files, early, args.max_pages)
+            print(f"{backend:<10} {early:<6} {r['seconds']:>8.2f} {r['docs_per_s']:>8.1f} "
+                  f"{r['chars']:>10} {r['tables']:>6} {r['peak_kb']:>9.0f}")
+            if full is None:
+                full = r["tables"]
+            elif r["tables"] != full:
+                print(f"  UYARI: erken durma {full - r['tables']} tahlil tablosunu kaçırdı")
+
+if __name__ == "__main__":
+    main()
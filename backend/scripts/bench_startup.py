@@ -0,0 +1,99 @@
+# scripts/bench_startup.py
+# Soğuk başlatma ölçümü (CI'da çalıştırılabilir, bütçe aşılırsa exit 1):
+#   1) python -X importtime ile "import app.main" toplam süresi ve en pahalı modüller;
+#      /health yolunda yüklenmemesi gereken ağır paketler (openai, PyPDF2, dotenv) kontrolü
+#   2) uvicorn başlatılıp ilk başarılı /health yanıtına kadar geçen süre
+#
+#   cd backend && PYTHONPATH=. python scripts/bench_startup.py --max-import 1.0 --max-health 3.0
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import List, Tuple
+
+LAZY = ("openai", "PyPDF2", "pypdfium2", "pdfminer", "dotenv", "brotli")
+
+
+def import_profile() -> Tuple[float, List[Tuple[int, str]]]:
+    """(toplam saniye, [(kümülatif us, modül)]) — app.main importu, ayrı süreçte."""
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    rows: List[Tuple[int, str]] = []
+    total = 0
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cum, name = [x.strip() for x in line[len("import time:"):].split("|")]
+        rows.append((int(cum), name.strip()))
+        if name == "app.main":
+            total = int(cum)
+    return total / 1e6, rows
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_health(timeout: float = 30.0) -> float:
+    port = _free_port()
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as r:
+                    if r.status == 200:
+                        return time.perf_counter() - t0
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError("/health yanıt vermedi")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--max-import", type=float, default=0.0, help="app.main import bütçesi (s, 0 = yok)")
+    ap.add_argument("--max-health", type=float, default=0.0, help="ilk /health bütçesi (s, 0 = yok)")
+    ap.add_argument("--top", type=int, default=10)
+    args = ap.parse_args()
+
+    failed = False
+    total, rows = import_profile()
+    print(f"import app.main: {total * 1000:.0f} ms")
+    for cum, name in sorted(rows, reverse=True)[:args.top]:
+        print(f"  {cum / 1000:>8.1f} ms  {name}")
+
+    eager = sorted({name.split(".")[0] for _, name in rows if name.split(".")[0] in LAZY})
+    if eager:
+        print("HATA: başlangıçta import edilmemesi gereken paketler:", ", ".join(eager))
+        failed = True
+    if args.max_import and total > args.max_import:
+        print(f"HATA: import bütçesi aşıldı ({total:.2f} s > {args.max_import} s)")
+        failed = True
+
+    health = time_to_health()
+    print(f"ilk /health: {health * 1000:.0f} ms")
+    if args.max_health and health > args.max_health:
+        print(f"HATA: /health bütçesi aşıldı ({health:.2f} s > {args.max_health} s)")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# scripts/check_form_cache.py
+# Form önbelleği eşleşme kontrolü: yeniden ifade edilmiş formlar isabet etmeli,
+# varlık / olumsuzluk farkı olan formlar ("ateş var" / "ateş yok") asla
+# birbirinin yanıtını almamalı; hastaya özgü bilgi (ad, yaş) içeren yanıtlar
+# saklanmamalı. İhlalde çıkış kodu 1.
+#
+#   cd backend && PYTHONPATH=. python scripts/check_form_cache.py
+from __future__ import annotations
+
+import sys
+
+from app.services.form_cache import FormCache, _duration_bucket
+
+BASE = {"age": 34, "gender": "kadın", "duration": "3 gün"}
+ANSWER = "Merhaba, geçmiş olsun. 1. Ateşiniz kaç derece? 2. Öksürük var mı?"
+
+# (kaydedilen belirti, sorgulanan belirti, isabet beklenir mi)
+CASES = [
+    ("baş ağrısı ve ateş", "ateş ve baş ağrısı", True),
+    ("3 gündür baş ağrısı, bulantı", "baş ağrısı bulantı 3 gündür", True),
+    ("baş ağrısı, ateş var", "baş ağrısı, ateş yok", False),
+    ("baş ağrısı, ateş yok", "baş ağrısı, ateş var", False),
+    ("öksürük var, ateş yok", "öksürük yok, ateş var", False),
+    ("karın ağrısı, kusma var", "karın ağrısı, kusma yok", False),
+    ("baş ağrısı geçiyor", "baş ağrısı geçmiyor", False),
+    ("ağrı kesici aldım", "ağrı kesici almadım", False),
+    ("göğüs ağrısı var", "göğüs ağrısı değil, sırt ağrısı var", False),
+    ("sol kol ağrısı ve uyuşma, göğüste baskı", "sağ kol ağrısı ve uyuşma, göğüste baskı", False),
+    ("sol kol ağrısı ve uyuşma", "kol ağrısı ve uyuşma, solda", True),
+    ("kol ağrısı ve uyuşma", "kol ağrısı ve uyuşma, göğüste baskı", False),
+    ("baş ağrısı, bulantı", "baş ağrısı, bulantı, bayılma", False),
+]
+
+
+# (kaydedilen yanıt, saklanmalı mı) — form adı "Ayşe Yılmaz", yaş 34
+PRIVATE = [
+    ("Merhaba Ayşe Hanım, geçmiş olsun. 1. Ateşiniz var mı?", True),
+    ("Geçmiş olsun. Ayşe Hanım, ateşiniz var mı?", False),
+    ("1. Yılmaz ailesinde migren var mı? 2. Ateş?", False),
+    ("34 yaşında biri için şunu sormalıyım: ateşiniz var mı?", False),
+]
+
+# süre kovası: birim kelime başında olmalı ("ayak" / "bayılma" / "güneş" süre değil)
+DURATIONS = [
+    ("ayak ağrısı", "?"),
+    ("bayılma", "?"),
+    ("güneş çarpması", "?"),
+    ("ayak ağrısı 2 aydır", ">30g"),
+    ("bayılma, 3 gündür", "1-3g"),
+    ("bir haftadır", "4-7g"),
+    ("3 saattir", "<1g"),
+]
+
+
+def main() -> int:
+    failed = 0
+    for stored, query, expect in CASES:
+        cache = FormCache(max_entries=10, threshold=0.5)
+        cache.add({**BASE, "symptoms": stored}, ANSWER)
+        hit = cache.lookup({**BASE, "symptoms": query}) is not None
+        ok = hit == expect
+        failed += not ok
+        print(f"{'OK ' if ok else 'HATA'} {stored!r} -> {query!r}: {'isabet' if hit else 'ıska'}")
+    form = {**BASE, "name": "Ayşe Yılmaz", "symptoms": "baş ağrısı ve ateş"}
+    for answer, expect in PRIVATE:
+        cache = FormCache(max_entries=10, threshold=0.5)
+        cache.add(form, answer)
+        out = cache.lookup({**form, "name": "Mehmet"})
+        ok = (out is not None) == expect and "Ayşe" not in (out or "")
+        failed += not ok
+        print(f"{'OK ' if ok else 'HATA'} {answer[:40]!r}: {'saklandı' if out else 'saklanmadı'}")
+    for text, expect in DURATIONS:
+        got = _duration_bucket(text)
+        failed += got != expect
+        print(f"{'OK ' if got == expect else 'HATA'} süre {text!r}: {got} (beklenen {expect})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# scripts/replay_profile.py
+# Router'ları uçtan uca kasetten (replay) koşturup istek başına backend CPU
+# süresini ve sıcak noktaları (_normalize_payload, prompt_chat_followup, store,
+# serileştirme) ölçer. OpenAI gecikmesi devre dışıdır (ölçek 0).
+#
+#   1) kaset kaydı (gerçek API anahtarı gerekir):
+#      cd backend && PYTHONPATH=. python scripts/replay_profile.py --record cassettes/flow.jsonl
+#   2) offline ve deterministik ölçüm:
+#      PYTHONPATH=. python scripts/replay_profile.py --replay cassettes/flow.jsonl --rounds 20
+from __future__ import annotations
+
+import argparse
+import contextlib
+import functools
+import io
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+FLOW_MESSAGES = [
+    "Ağrı daha çok alnımda, zonklayıcı.",
+    "Işıktan rahatsız oluyorum, bulantım var ama kusmadım.",
+    "Ateşim yok, ağrı kesici biraz işe yaradı.",
+    "Daha önce böyle migren atakları olmuştu.",
+]
+
+LAB_PAYLOAD = {
+    "patientData": {
+        "name": "Deneme",
+        "age": 41,
+        "gender": "Kadın",
+        "patientRef": "replay-1",
+        "labResults": [
+            {"name": "Hemoglobin", "value": 10.9, "unit": "g/dL", "normalRange": "12-16", "date": "2026-04-02"},
+            {"name": "Ferritin", "value": 8, "unit": "ng/mL", "normalRange": "20-250", "date": "2026-04-02"},
+            {"name": "TSH", "value": 2.1, "unit": "uIU/mL", "normalRange": "0.4-4.0", "date": "2026-04-02"},
+        ],
+    }
+}
+
+
+def _check_payload() -> None:
+    """Şema kayarsa (alan adı değişirse) lab yolu sessizce boş profil ölçmesin."""
+    from app.routers.labs import _normalize_payload
+    rows = _normalize_payload(LAB_PAYLOAD, None).get("labResults") or []
+    if len(rows) != len(LAB_PAYLOAD["patientData"]["labResults"]):
+        raise SystemExit("LAB_PAYLOAD normalize sonrası labResults kaybediyor; PatientData şemasını kontrol edin")
+
+# Router'lar threadpool'da koştuğu için cProfile (yalnızca etkin thread) yetmez;
+# hedef fonksiyonlar thread CPU saatini toplayan sarmalayıcılarla ölçülür.
+_spent: Dict[str, float] = {}
+_calls: Dict[str, int] = {}
+_depth = threading.local()
+
+
+def _timed(label: str, fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*a, **kw):
+        depth = getattr(_depth, label, 0)
+        setattr(_depth, label, depth + 1)
+        t0 = time.thread_time()
+        try:
+            return fn(*a, **kw)
+        finally:
+            setattr(_depth, label, depth)
+            if depth == 0:   # iç içe çağrılar iki kez sayılmasın
+                _spent[label] = _spent.get(label, 0.0) + time.thread_time() - t0
+                _calls[label] = _calls.get(label, 0) + 1
+    return wrapper
+
+
+def _instrument() -> None:
+    import json
+    import fastapi.routing
+    from app.history import CompactHistory
+    from app.routers import chat, labs
+    from app.store import InMemoryStore
+
+    labs._normalize_payload = _timed("_normalize_payload", labs._normalize_payload)
+    chat.prompt_chat_followup = _timed("prompt_chat_followup", chat.prompt_chat_followup)
+    for name in ("create", "get", "peek", "add_turn", "upsert_patient", "set_stage",
+                 "get_stage", "get_patient", "get_history", "snapshot"):
+        setattr(InMemoryStore, name, _timed("store", getattr(InMemoryStore, name)))
+    for name in ("append", "to_dicts", "to_models"):
+        setattr(CompactHistory, name, _timed("history", getattr(CompactHistory, name)))
+    fastapi.routing.jsonable_encoder = _timed("jsonable_encoder", fastapi.routing.jsonable_encoder)
+    json.dumps = _timed("json.dumps", json.dumps)
+
+
+def _flow(client) -> List[Tuple[str, float]]:
+    """Tipik bir oturum akışı; (endpoint, CPU saniye) listesi döndürür."""
+    timings: List[Tuple[str, float]] = []
+
+    def call(method: str, url: str, **kw):
+        t0 = time.process_time()
+        r = client.request(method, url, **kw)
+        timings.append((url, time.process_time() - t0))
+        r.raise_for_status()
+        return r
+
+    sid = call("POST", "/sessions").json()["session_id"]
+    h = {"X-Session-Id": sid}
+    call("POST", "/assessment/initial", headers=h, json={
+        "name": "Deneme", "age": 34, "gender": "Kadın",
+        "symptoms": "baş ağrısı ve bulantı", "duration": "3 gün",
+    })
+    for m in FLOW_MESSAGES:
+        call("POST", "/chat/send", headers=h, json={"message": m})
+    call("POST", "/labs/analyze", headers=h, json=LAB_PAYLOAD)
+    call("POST", "/labs/final", headers=h, json=LAB_PAYLOAD)
+    call("GET", f"/sessions/{sid}", headers=h)
+    return timings
+
+
+def _report(rounds: int) -> None:
+    print("\nsıcak noktalar (tur başına):")
+    print(f"  {'':<22} {'ms':>9} {'çağrı':>7}")
+    for label, total in sorted(_spent.items(), key=lambda kv: -kv[1]):
+        print(f"  {label:<22} {total / rounds * 1000:>9.2f} {_calls[label] // rounds:>7}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    g = ap.add_mutually_exclusive_group(required=True)
+    g.add_argument("--record", metavar="KASET")
+    g.add_argument("--replay", metavar="KASET")
+    ap.add_argument("--rounds", type=int, default=10)
+    ap.add_argument("--latency-scale", type=float, default=0.0)
+    ap.add_argument("--verbose", action="store_true", help="router print çıktılarını göster")
+    args = ap.parse_args()
+
+    # settings import sırasında okunur: app import edilmeden önce ayarlanmalı
+    os.environ["LLM_CASSETTE_MODE"] = "record" if args.record else "replay"
+    os.environ["LLM_CASSETTE_PATH"] = args.record or args.replay
+    os.environ["LLM_REPLAY_LATENCY_SCALE"] = str(args.latency_scale)
+    os.environ.setdefault("STORE_SNAPSHOT_PATH", "")
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services.cassette import cassette
+    _check_payload()
+    _instrument()
+
+    rounds = 1 if args.record else args.rounds
+    per_endpoint: Dict[str, List[float]] = {}
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    with TestClient(app) as client, quiet:
+        for _ in range(rounds):
+            cassette.rewind()
+            timings = _flow(client)
+            for url, cpu in timings:
+                key = "/sessions/{id}" if url.startswith("/sessions/") else url
+                per_endpoint.setdefault(key, []).append(cpu)
+
+    if args.record:
+        print(f"kaset yazıldı: {args.record}")
+        return
+
+    print(f"{rounds} tur, replay gecikme ölçeği={args.latency_scale}")
+    print(f"{'endpoint':<24} {'ort ms':>9} {'max ms':>9}")
+    for url, xs in per_endpoint.items():
+        print(f"{url:<24} {sum(xs) / len(xs) * 1000:>9.2f} {max(xs) * 1000:>9.2f}")
+    _report(rounds)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
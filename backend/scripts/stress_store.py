@@ -0,0 +1,195 @@
+# scripts/stress_store.py
+# InMemoryStore eşzamanlılık stres testi: çok sayıda thread aynı oturum
+# havuzunda get / upsert_patient / add_turn / set_stage / peek / sweep /
+# _enforce_budget çağırır (küçük bütçe: blob taşıma + tahliye sürekli çalışır).
+# Sonunda muhasebe ve tutarlılık değişmezleri kontrol edilir; ihlalde çıkış kodu 1.
+#
+#   cd backend && PYTHONPATH=. python scripts/stress_store.py --threads 16 --seconds 5
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+import app.store as store_mod
+from app.store import BLOB_MARKER, InMemoryStore, _approx_size
+
+
+def _quiet() -> None:
+    # store her get()'te log basar; stres sırasında çıktıyı boğmasın
+    store_mod.print = lambda *a, **k: None  # type: ignore[attr-defined]
+
+
+class Run:
+    def __init__(self, st: InMemoryStore, pool: int) -> None:
+        self.st = st
+        self.ids: List[str] = [st.create().id for _ in range(pool)]
+        self.ids_lock = threading.Lock()
+        # sid -> başarılı add_turn sayısı; sid -> yazan thread'in sıra numaraları
+        self.turns: Counter = Counter()
+        self.lock = threading.Lock()
+        self.ops: Counter = Counter()
+        self.lost = 0
+        self.errors: List[str] = []
+
+    def pick(self, rnd: random.Random) -> str:
+        with self.ids_lock:
+            return rnd.choice(self.ids)
+
+    def replace(self, sid: str) -> None:
+        """Tahliye edilen oturumun yerine yenisi (havuz boyutu sabit)."""
+        with self.ids_lock:
+            if sid in self.ids:
+                self.ids[self.ids.index(sid)] = self.st.create().id
+
+    def worker(self, tid: int, deadline: float, big: int) -> None:
+        rnd = random.Random(tid)
+        seq = 0
+        ops: Counter = Counter()
+        while time.monotonic() < deadline:
+            sid = self.pick(rnd)
+            op = rnd.random()
+            try:
+                if op < 0.35:
+                    seq += 1
+                    self.st.add_turn(sid, "user", f"{tid}:{seq}")
+                    with self.lock:
+                        self.turns[sid] += 1
+                    ops["add_turn"] += 1
+                elif op < 0.55:
+                    patch: Dict = {"age": rnd.randint(1, 90), "symptoms": f"s{tid}"}
+                    if rnd.random() < 0.3:
+                        patch["additionalInfo"] = {"extracted_text": chr(65 + tid % 26) * big}
+                    self.st.upsert_patient(sid, patch)
+                    ops["upsert"] += 1
+                elif op < 0.75:
+                    s = self.st.get(sid)
+                    if s is None:
+                        raise KeyError(sid)
+                    self._check_visible(s)
+                    ops["get"] += 1
+                elif op < 0.85:
+                    s = self.st.peek(sid)
+                    if s is not None:
+                        self._check_visible(s)
+                    ops["peek"] += 1
+                elif op < 0.93:
+                    self.st.set_stage(sid, rnd.choice(["follow_up", "expert_evaluation"]))
+                    ops["set_stage"] += 1
+                elif op < 0.97:
+                    self.st.sweep()
+                    ops["sweep"] += 1
+                else:
+                    self.st._enforce_budget()
+                    ops["enforce"] += 1
+            except KeyError:
+                # bütçe tahliyesi ya da TTL: beklenen; havuzu tazele
+                with self.lock:
+                    self.lost += 1
+                self.replace(sid)
+            except Exception as e:  # pragma: no cover - hata raporu
+                with self.lock:
+                    self.errors.append(f"{type(e).__name__}: {e}")
+        with self.lock:
+            self.ops.update(ops)
+
+    def _check_visible(self, s) -> None:
+        info = s.patient.additionalInfo or {}
+        for k, v in info.items():
+            if isinstance(v, str) and v.startswith(BLOB_MARKER):
+                with self.lock:
+                    self.errors.append(f"yer tutucu görünür: {s.id}.{k}")
+
+
+def check(run: Run) -> List[str]:
+    st = run.st
+    bad: List[str] = list(dict.fromkeys(run.errors))[:20]
+    files = 0
+    for i, sh in enumerate(st._shards):
+        with sh.lock:
+            if sh.bytes != sum(sh.sizes.values()):
+                bad.append(f"shard {i}: bytes {sh.bytes} != sizes toplamı {sum(sh.sizes.values())}")
+            if set(sh.sizes) != set(sh.sessions):
+                bad.append(f"shard {i}: sizes/sessions anahtarları farklı")
+            if not set(sh.blobs) <= set(sh.sessions):
+                bad.append(f"shard {i}: sahipsiz blob kaydı")
+            for sid, s in sh.sessions.items():
+                if st._shard(sid) is not sh:
+                    bad.append(f"{sid}: yanlış dilimde")
+                size = s.history.nbytes() + _approx_size(s.patient.model_dump(exclude_none=True))
+                if sh.sizes.get(sid) != size:
+                    bad.append(f"{sid}: muhasebe {sh.sizes.get(sid)} != gerçek {size}")
+                if len(s.history) != run.turns[sid]:
+                    bad.append(f"{sid}: {len(s.history)} tur, beklenen {run.turns[sid]}")
+                # aynı thread'in turları sırasıyla yazılmış olmalı
+                last: Dict[str, int] = defaultdict(int)
+                for j in range(len(s.history)):
+                    tid, n = s.history.content(j).split(":")
+                    if int(n) <= last[tid]:
+                        bad.append(f"{sid}: thread {tid} tur sırası bozuk")
+                        break
+                    last[tid] = int(n)
+                for path in (sh.blobs.get(sid) or {}).values():
+                    files += 1
+                    if not os.path.exists(path):
+                        bad.append(f"{sid}: blob dosyası yok ({path})")
+    on_disk = len(os.listdir(st.blob_dir)) if os.path.isdir(st.blob_dir) else 0
+    if on_disk != files:
+        bad.append(f"diskte {on_disk} blob dosyası, kayıtlı {files}")
+    return bad
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--seconds", type=float, default=5.0)
+    ap.add_argument("--sessions", type=int, default=64, help="oturum havuzu")
+    ap.add_argument("--shards", type=int, default=8)
+    ap.add_argument("--budget", type=int, default=2_000_000, help="STORE_MAX_BYTES (bayt)")
+    ap.add_argument("--blob", type=int, default=50_000, help="büyük extracted_text boyutu")
+    ap.add_argument("--ttl", type=int, default=0, help="stres sırasında SESSION_TTL (s, 0 = değişmez)")
+    args = ap.parse_args()
+
+    _quiet()
+    if args.ttl:
+        store_mod.TTL_SECONDS = args.ttl
+    st = InMemoryStore(shards=args.shards)
+    st.max_bytes = args.budget
+    st.blob_dir = tempfile.mkdtemp(prefix="stress-blobs-")
+    st.blob_min_bytes = max(1, args.blob // 2)
+
+    run = Run(st, args.sessions)
+    deadline = time.monotonic() + args.seconds
+    threads = [threading.Thread(target=run.worker, args=(i, deadline, args.blob)) for i in range(args.threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    total = sum(run.ops.values())
+    stats = st.stats()
+    print(f"{total} işlem / {elapsed:.1f} s ({total / elapsed:.0f} op/s), {args.threads} thread")
+    print("  " + ", ".join(f"{k}={v}" for k, v in sorted(run.ops.items())))
+    print(f"  oturum={stats['sessions']} bayt={stats['bytes']} bütçe={stats['max_bytes']} "
+          f"taşınan={stats['offloads_total']} tahliye={stats['evictions_total']} kayıp={run.lost}")
+
+    bad = check(run)
+    if bad:
+        print(f"HATA: {len(bad)} değişmez ihlali")
+        for b in bad[:20]:
+            print("  -", b)
+        return 1
+    print("değişmezler OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())